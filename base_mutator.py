@@ -16,4 +16,29 @@ class BaseMutator(ABC):
         This function takes a command-line string (data) and
         returns a mutated command-line string
         """
-        pass
\ No newline at end of file
+        pass
+
+    def mutate_tokens(self, tokens):
+        """
+        Optional token-level variant of mutate(). Takes a list of
+        command_ir.Token (lexed once per seed and shared through the havoc
+        chain) and returns a NEW list; the input list must not be modified
+        because it may be cached on the corpus entry.
+
+        Returning None (the default) declines: the mutator is then given
+        the rendered string through mutate() instead.
+        """
+        return None
+
+    def mutate_batch(self, data, n, rng=None):
+        """
+        Returns 'n' independent mutations of the command-line string 'data'.
+        Override it when a batch is cheaper than n separate calls (e.g. parse
+        once); 'rng' is the random source for implementations that take one.
+        The default simply calls mutate() n times.
+        """
+        return [self.mutate(data) for _ in range(n)]
+
+    @classmethod
+    def supports_tokens(cls):
+        return cls.mutate_tokens is not BaseMutator.mutate_tokens
@@ -0,0 +1,502 @@
+"""
+Benchmark suite for throughput regression tracking.
+
+Microbenchmarks (in-process, in a scratch directory):
+  mutators     mutate() / mutate_tokens() per mutator, on the seed commands
+  havoc        apply_havoc_mutations() and apply_havoc_batch()
+  dedup        DedupStore inserts and lookups at --dedup-sizes keys, canonical_key()
+  choose_seed  choose_seed() and scheduler updates at --corpus-sizes seeds
+
+End-to-end: producer and consumer (--stream) run as separate processes in a
+scratch directory against an in-process fake SIEM (fake_siem.py) that flags
+commands matching --rule. Rates are taken from their metrics endpoints
+(metrics.py) between the end of the warmup and the end of the run.
+
+Results go to BENCH_DIR/bench_<time>.json with the commit and machine they
+were measured on; --compare prints the change of every rate against an
+earlier file.
+
+    python benchmark.py
+    python benchmark.py --only micro --dedup-sizes 1000000 --corpus-sizes 1000000
+    python benchmark.py --only e2e --duration 60 --producer-args "-w 16 -p"
+    python benchmark.py --compare benchmarks/bench_20240610_120000.json
+"""
+import io
+import os
+import sys
+import json
+import time
+import shlex
+import random
+import shutil
+import signal
+import socket
+import argparse
+import platform
+import tempfile
+import subprocess
+import contextlib
+import urllib.request
+
+from producer import ProducerFuzzer, GENERATION_BATCH
+from hash_store import DedupStore, digest_key
+from canonicalize import canonical_key
+from corpus_store import tag_from_filename
+from command_ir import lex
+from scheduler import SeedScheduler, PRIORITY_WEIGHTS
+from fake_siem import FakeSiem, Sensor, load_rules, serve
+
+# --- Benchmark Defaults ---
+BENCH_DIR = "benchmarks"
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+ITERATIONS = 2000                    # Calls per mutator / havoc microbenchmark
+LOOKUPS = 100_000                    # Dedup lookups and scheduler picks per size
+DEDUP_SIZES = [100_000, 1_000_000]
+CORPUS_SIZES = [10_000, 100_000, 1_000_000]
+E2E_DURATION = 30                    # Measured seconds, after the warmup
+E2E_WARMUP = 5
+E2E_RULES = ["vssadmin.*delete", "shadowcopy", "bcdedit"]
+E2E_STOP_TIMEOUT = 15
+# Fallback commands for tags without a seed file
+SAMPLE_COMMANDS = {
+    "cmd": "vssadmin.exe delete shadows /all /quiet",
+    "powershell": "powershell.exe -NoProfile -Command \"Get-WmiObject Win32_ShadowCopy | ForEach-Object { $_.Delete() }\"",
+    "generic": "echo purplefuzz benchmark",
+}
+SEED_PREFIXES = {"cmd": "cmd_", "powershell": "ps_", "generic": "generic_"}
+# config.py overrides for the end-to-end run (fake SIEM, short verdict deadline)
+E2E_CONFIG = """
+SIEM_HOST = '127.0.0.1'
+SIEM_PORT = {port}
+SIEM_USER = None
+SIEM_PASS = None
+SIEM_USE_SSL = False
+CONSUMER_TAIL_INTERVAL = 1
+VERDICT_RECHECK_SCHEDULE = [1, 2]
+VERDICT_DEADLINE = {deadline}
+VERDICT_AUTO_DEADLINE = False
+"""
+
+
+def timed(fn, iterations):
+    """
+    Calls fn() 'iterations' times. Returns the rate and per-call latency.
+    """
+    latencies = []
+    started = time.perf_counter()
+    for _ in range(iterations):
+        t = time.perf_counter()
+        fn()
+        latencies.append(time.perf_counter() - t)
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "calls": iterations,
+        "seconds": round(elapsed, 4),
+        "calls_per_sec": round(iterations / elapsed, 1) if elapsed else None,
+        "p50_us": round(latencies[len(latencies) // 2] * 1e6, 2),
+        "p99_us": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1e6, 2),
+    }
+
+
+def sample_seeds(seed_dir):
+    """
+    (command, tags) per seed file, plus a sample command for every tag that
+    has no seed file.
+    """
+    seeds = []
+    if os.path.isdir(seed_dir):
+        for filename in sorted(os.listdir(seed_dir)):
+            if filename.endswith(".txt"):
+                with open(os.path.join(seed_dir, filename), "r", encoding="utf-8") as f:
+                    command = f.read().strip()
+                if command:
+                    seeds.append((command, [tag_from_filename(filename)]))
+    tags = {tags[0] for _, tags in seeds}
+    seeds += [(command, [tag]) for tag, command in SAMPLE_COMMANDS.items() if tag not in tags]
+    return seeds
+
+
+def quiet():
+    return contextlib.redirect_stdout(io.StringIO())
+
+
+# --- Microbenchmarks ---
+
+def bench_mutators(fuzzer, seeds, iterations):
+    results = {}
+    for mutator in fuzzer.mutators.all():
+        name = mutator.__class__.__name__
+        applicable = [(c, t) for c, t in seeds if "generic" in mutator.tags or t[0] in mutator.tags]
+        if not applicable:
+            continue
+        entry = results[name] = {"errors": 0}
+
+        def call(fn, args):
+            command, tags = random.choice(args)
+            try:
+                fn(command, tags)
+            except Exception:
+                entry["errors"] += 1
+
+        with quiet():
+            entry["mutate"] = timed(lambda: call(lambda c, t: mutator.mutate(c), applicable), iterations)
+            if mutator.supports_tokens():
+                tokenized = [(lex(c, t[0]), t) for c, t in applicable]
+                entry["mutate_tokens"] = timed(lambda: call(lambda c, t: mutator.mutate_tokens(c), tokenized),
+                                               iterations)
+    return results
+
+
+def bench_havoc(fuzzer, seeds, iterations):
+    tokenized = [(command, tags, lex(command, tags[0])) for command, tags in seeds]
+
+    def single():
+        command, tags, _ = random.choice(tokenized)
+        fuzzer.apply_havoc_mutations(command, tags)
+
+    def batch():
+        command, tags, tokens = random.choice(tokenized)
+        fuzzer.apply_havoc_batch(command, tags, tokens, GENERATION_BATCH)
+
+    with quiet():
+        results = {"apply_havoc_mutations": timed(single, iterations),
+                   "apply_havoc_batch": timed(batch, max(1, iterations // GENERATION_BATCH))}
+    batch_result = results["apply_havoc_batch"]
+    batch_result["mutants_per_sec"] = round(batch_result["calls_per_sec"] * GENERATION_BATCH, 1)
+    return results
+
+
+def bench_dedup(workdir, sizes, seeds, lookups):
+    results = {}
+    for size in sizes:
+        base = os.path.join(workdir, f"dedup_{size}")
+        store = DedupStore(base)
+        started = time.perf_counter()
+        for i in range(size):
+            store.add_text(f"bench-command-{i}")
+        store.flush()
+        insert_seconds = time.perf_counter() - started
+        n = min(size, lookups)
+        results[str(size)] = {
+            "inserts_per_sec": round(size / insert_seconds, 1),
+            "duplicate": timed(lambda: store.add_text(f"bench-command-{random.randrange(size)}"), n),
+            "miss": timed(lambda: digest_key(f"bench-miss-{random.random()}") in store, n),
+        }
+        store.close()
+        for suffix in (".idx", ".log", ".bloom"):
+            if os.path.exists(base + suffix):
+                os.remove(base + suffix)
+    results["canonical_key"] = timed(lambda: canonical_key(*random.choice(seeds)), lookups)
+    return results
+
+
+def bench_choose_seed(fuzzer, sizes, lookups):
+    results = {}
+    priorities = list(PRIORITY_WEIGHTS)
+    for size in sizes:
+        now = time.time()
+        scheduler = SeedScheduler()
+        started = time.perf_counter()
+        for i in range(size):
+            scheduler.add({"id": i, "cmd": f"bench-seed-{i}", "tags": ["cmd"], "priority": random.choice(priorities),
+                           "execs": random.randrange(1000), "bypasses": random.randrange(10),
+                           "added_at": now - random.uniform(0, 7200)}, now)
+        build_seconds = time.perf_counter() - started
+        fuzzer.scheduler = scheduler
+
+        def update():
+            seed = scheduler.seeds[random.randrange(size)]
+            seed["execs"] += 1
+            scheduler.update(seed, now)
+
+        results[str(size)] = {"adds_per_sec": round(size / build_seconds, 1),
+                              "choose_seed": timed(fuzzer.choose_seed, lookups),
+                              "update": timed(update, lookups)}
+    return results
+
+
+# --- End-to-end ---
+
+def free_ports(*widths):
+    """
+    One unused port per width, each with the next width - 1 ports unused
+    as well. Every socket stays bound until all ports are picked, so the
+    ranges do not overlap.
+    """
+    ports = []
+    with contextlib.ExitStack() as stack:
+        for width in widths:
+            while True:
+                first = stack.enter_context(socket.socket())
+                first.bind(("127.0.0.1", 0))
+                port = first.getsockname()[1]
+                try:
+                    for offset in range(1, width):
+                        stack.enter_context(socket.socket()).bind(("127.0.0.1", port + offset))
+                except (OSError, OverflowError):
+                    continue
+                ports.append(port)
+                break
+    return ports
+
+
+def scrape(port):
+    """
+    Prometheus text from a metrics endpoint as {(name, labels): value}.
+    """
+    with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics", timeout=5) as response:
+        text = response.read().decode("utf-8")
+    samples = {}
+    for line in text.splitlines():
+        if not line or line.startswith("#"):
+            continue
+        series, value = line.rsplit(" ", 1)
+        name, _, labels = series.partition("{")
+        pairs = tuple(sorted(tuple(pair.split("=", 1)) for pair in labels.rstrip("}").split(",") if pair))
+        samples[(name, tuple((k, v.strip('"')) for k, v in pairs))] = float(value)
+    return samples
+
+
+def scrape_sum(ports):
+    """
+    scrape() of several endpoints with the values of shared series added up.
+    """
+    samples = {}
+    for port in ports:
+        for key, value in scrape(port).items():
+            samples[key] = samples.get(key, 0.0) + value
+    return samples
+
+
+def delta_total(before, after, name, **labels):
+    wanted = {(k, str(v)) for k, v in labels.items()}
+    return sum(value - before.get(key, 0.0) for key, value in after.items()
+               if key[0] == name and wanted <= set(key[1]))
+
+
+def delta_quantile(before, after, name, q):
+    """
+    Bucket bound of the q-quantile of observations made between the scrapes.
+    """
+    buckets = {}
+    for key, value in after.items():
+        if key[0] != name + "_bucket":
+            continue
+        le = dict(key[1])["le"]
+        buckets[le] = buckets.get(le, 0.0) + value - before.get(key, 0.0)
+    bounds = sorted(buckets, key=lambda le: float("inf") if le == "+Inf" else float(le))
+    total = buckets.get("+Inf", 0.0)
+    if not total:
+        return None
+    for le in bounds:
+        if buckets[le] >= q * total:
+            return None if le == "+Inf" else float(le)
+    return None
+
+
+def start_process(module, args, workdir, log_name):
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join([REPO_DIR] + ([env["PYTHONPATH"]] if env.get("PYTHONPATH") else []))
+    env["PYTHONUNBUFFERED"] = "1"
+    log = open(os.path.join(workdir, log_name), "w", encoding="utf-8")
+    # -m puts the scratch directory first on sys.path, so its config.py wins
+    return subprocess.Popen([sys.executable, "-m", module] + args, cwd=workdir, env=env,
+                            stdout=log, stderr=subprocess.STDOUT)
+
+
+def stop_process(process):
+    if process.poll() is None:
+        process.send_signal(signal.SIGINT)
+        try:
+            process.wait(timeout=E2E_STOP_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+
+
+def log_tail(workdir, log_name, lines=15):
+    with open(os.path.join(workdir, log_name), "r", encoding="utf-8", errors="replace") as f:
+        return "".join(f.readlines()[-lines:])
+
+
+def bench_e2e(workdir, duration, warmup, rules, producer_args, deadline):
+    for name in ("mutators", "custom_mutators"):
+        if os.path.isdir(os.path.join(REPO_DIR, name)):
+            os.symlink(os.path.join(REPO_DIR, name), os.path.join(workdir, name))
+    seed_dir = os.path.join(workdir, "seeds")
+    os.makedirs(seed_dir)
+    for i, (command, tags) in enumerate(sample_seeds(os.path.join(REPO_DIR, "seeds"))):
+        with open(os.path.join(seed_dir, f"{SEED_PREFIXES[tags[0]]}bench_{i}.txt"), "w", encoding="utf-8") as f:
+            f.write(command)
+    # A pipelined producer serves its generator process's metrics on producer_port + 1
+    siem_port, producer_port, consumer_port = free_ports(1, 2, 1)
+    producer_ports = [producer_port]
+    if "-p" in producer_args or "--pipeline" in producer_args:
+        producer_ports.append(producer_port + 1)
+    with open(os.path.join(REPO_DIR, "config.py"), "r", encoding="utf-8") as f:
+        config_text = f.read()
+    with open(os.path.join(workdir, "config.py"), "w", encoding="utf-8") as f:
+        f.write(config_text + E2E_CONFIG.format(port=siem_port, deadline=deadline))
+
+    siem = FakeSiem()
+    server = serve("127.0.0.1", siem_port, siem)
+    Sensor(siem, os.path.join(workdir, "queue_log"), load_rules(rules, None)).start()
+    producer = start_process("producer", producer_args + ["--metrics-port", str(producer_port)],
+                             workdir, "producer.log")
+    consumer = start_process("consumer", ["-s", "--metrics-port", str(consumer_port)], workdir, "consumer.log")
+    try:
+        time.sleep(warmup)
+        for process, log_name in ((producer, "producer.log"), (consumer, "consumer.log")):
+            if process.poll() is not None:
+                return {"error": f"{log_name[:-4]} exited early:\n{log_tail(workdir, log_name)}"}
+        p0, c0, t0 = scrape_sum(producer_ports), scrape(consumer_port), time.time()
+        time.sleep(duration)
+        p1, c1, t1 = scrape_sum(producer_ports), scrape(consumer_port), time.time()
+    finally:
+        stop_process(producer)
+        stop_process(consumer)
+        server.shutdown()
+
+    elapsed = t1 - t0
+    mutants = delta_total(p0, p1, "purplefuzz_mutants_total")
+    verdicts = delta_total(c0, c1, "purplefuzz_verdicts_total")
+    return {
+        "seconds": round(elapsed, 2),
+        "execs_per_sec": round(delta_total(p0, p1, "purplefuzz_execs_total") / elapsed, 1),
+        "mutants_per_sec": round(mutants / elapsed, 1),
+        "new_candidate_share": round(delta_total(p0, p1, "purplefuzz_candidates_total", result="new") / mutants, 4)
+        if mutants else None,
+        "exec_p50_s": delta_quantile(p0, p1, "purplefuzz_exec_seconds", 0.5),
+        "exec_p95_s": delta_quantile(p0, p1, "purplefuzz_exec_seconds", 0.95),
+        "queue_write_p95_s": delta_quantile(p0, p1, "purplefuzz_queue_write_seconds", 0.95),
+        "records_per_sec": round(delta_total(c0, c1, "purplefuzz_queue_records_read_total") / elapsed, 1),
+        "verdicts_per_sec": round(verdicts / elapsed, 1),
+        "detected_share": round(delta_total(c0, c1, "purplefuzz_verdicts_total", priority=3) / verdicts, 4)
+        if verdicts else None,
+        "time_to_verdict_p50_s": delta_quantile(c0, c1, "purplefuzz_time_to_verdict_seconds", 0.5),
+        "time_to_verdict_p95_s": delta_quantile(c0, c1, "purplefuzz_time_to_verdict_seconds", 0.95),
+        "pending_at_end": c1.get(("purplefuzz_pending_ids", ()), None),
+        "alerts_indexed": siem.stats.get("indexed"),
+    }
+
+
+# --- Reporting ---
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, capture_output=True,
+                              text=True, timeout=10).stdout.strip() or None
+    except Exception:
+        return None
+
+
+def flatten(results, prefix=""):
+    flat = {}
+    for key, value in results.items():
+        path = f"{prefix}.{key}" if prefix else key
+        if isinstance(value, dict):
+            flat.update(flatten(value, path))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[path] = value
+    return flat
+
+
+def compare(old_results, new_results):
+    """
+    Prints the change of every rate (…_per_sec) present in both runs.
+    """
+    old, new = flatten(old_results), flatten(new_results)
+    for path in sorted(set(old) & set(new)):
+        if path.endswith("_per_sec") and old[path]:
+            change = (new[path] - old[path]) / old[path]
+            marker = "  <-- slower" if change < -0.1 else ""
+            print(f"  {path:<60} {old[path]:>12.1f} -> {new[path]:>12.1f}  {change:+.1%}{marker}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="PurpleFuzz - Throughput benchmarks (micro and end-to-end)")
+    parser.add_argument("--only", choices=["micro", "e2e"], help="Run only one part")
+    parser.add_argument("-m", "--mode", type=int, default=0, choices=[0, 1], help="Mutator mode, as for the producer")
+    parser.add_argument("-n", "--iterations", type=int, default=ITERATIONS, help="Calls per mutator/havoc benchmark")
+    parser.add_argument("--lookups", type=int, default=LOOKUPS, help="Dedup lookups and scheduler picks per size")
+    parser.add_argument("--dedup-sizes", type=int, nargs="+", default=DEDUP_SIZES, help="Dedup store sizes (keys)")
+    parser.add_argument("--corpus-sizes", type=int, nargs="+", default=CORPUS_SIZES, help="Scheduler sizes (seeds)")
+    parser.add_argument("--duration", type=float, default=E2E_DURATION, help="End-to-end measured seconds")
+    parser.add_argument("--warmup", type=float, default=E2E_WARMUP, help="End-to-end seconds before measuring")
+    parser.add_argument("--rule", action="append", default=None,
+                        help="Fake SIEM detection regex (repeatable; default: %s)" % ", ".join(E2E_RULES))
+    parser.add_argument("--producer-args", default="-w 8", help="Producer arguments for the end-to-end run")
+    parser.add_argument("--deadline", type=float, default=3, help="End-to-end verdict deadline in seconds")
+    parser.add_argument("-o", "--output", help="Output JSON file (default: benchmarks/bench_<time>.json)")
+    parser.add_argument("--compare", help="Earlier result file to compare against")
+    parser.add_argument("--keep", action="store_true", help="Keep the scratch directory")
+    args = parser.parse_args()
+
+    output = os.path.abspath(args.output or os.path.join(BENCH_DIR, f"bench_{time.strftime('%Y%m%d_%H%M%S')}.json"))
+    workdir = tempfile.mkdtemp(prefix="purplefuzz_bench_")
+    report = {
+        "timestamp": time.time(),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "settings": {k: v for k, v in vars(args).items() if k not in ("output", "compare", "keep")},
+        "results": {},
+    }
+    results = report["results"]
+    original_cwd = os.getcwd()
+    try:
+        if args.only != "e2e":
+            micro_dir = os.path.join(workdir, "micro")
+            os.makedirs(micro_dir)
+            os.chdir(micro_dir)
+            for name in ("mutators", "custom_mutators"):
+                if os.path.isdir(os.path.join(REPO_DIR, name)):
+                    os.symlink(os.path.join(REPO_DIR, name), name)
+            seeds = sample_seeds(os.path.join(REPO_DIR, "seeds"))
+            with quiet():
+                fuzzer = ProducerFuzzer(args.mode, execute=False, generate=False)
+            try:
+                with quiet():
+                    fuzzer.load_mutators()
+                print(f"[i] Microbenchmarks on {len(seeds)} seed commands in {micro_dir}")
+                results["mutators"] = bench_mutators(fuzzer, seeds, args.iterations)
+                print(f"  [+] mutators: {len(results['mutators'])}")
+                results["havoc"] = bench_havoc(fuzzer, seeds, args.iterations)
+                print(f"  [+] havoc: {results['havoc']['apply_havoc_batch']['mutants_per_sec']} mutants/s batched")
+                results["dedup"] = bench_dedup(micro_dir, args.dedup_sizes, seeds, args.lookups)
+                print(f"  [+] dedup: sizes {args.dedup_sizes}")
+                results["choose_seed"] = bench_choose_seed(fuzzer, args.corpus_sizes, args.lookups)
+                print(f"  [+] choose_seed: sizes {args.corpus_sizes}")
+            finally:
+                # Stop the hot-reload watcher before it can rescan from another cwd
+                fuzzer.mutators.close()
+            os.chdir(original_cwd)
+
+        if args.only != "micro":
+            e2e_dir = os.path.join(workdir, "e2e")
+            os.makedirs(e2e_dir)
+            print(f"[i] End-to-end: {args.warmup:g}s warmup + {args.duration:g}s in {e2e_dir}")
+            results["e2e"] = bench_e2e(e2e_dir, args.duration, args.warmup, args.rule or E2E_RULES,
+                                       shlex.split(args.producer_args), args.deadline)
+            if "error" in results["e2e"]:
+                print(f"  [!] {results['e2e']['error']}")
+            else:
+                print(f"  [+] {results['e2e']['execs_per_sec']} execs/s, "
+                      f"{results['e2e']['verdicts_per_sec']} verdicts/s")
+    finally:
+        os.chdir(original_cwd)
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"\n[+] Results: {output}")
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            previous = json.load(f)
+        print(f"[i] Against {args.compare} (commit {previous.get('commit')}):")
+        compare(previous["results"], results)
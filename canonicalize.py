@@ -0,0 +1,215 @@
+import os
+import re
+import mmap
+import hashlib
+
+from command_ir import lex, OP, WS
+
+# --- Canonical Dedup Defaults ---
+CANONICAL_BUDGET = 0          # Executions allowed per canonical form (0 = unlimited)
+BUDGET_SLOTS = 1 << 22        # One-byte spent counters (4 MB, memory-mapped when persisted)
+BUDGET_PROBES = 2             # Counters per canonical form (one per 4 key bytes); the smallest is its count
+BUDGET_MAX = 255              # Counters saturate here, so larger budgets are capped to it
+
+# Registered canonicalizers, keyed by seed tag
+CANONICALIZERS = {}
+
+WHITESPACE_RE = re.compile(r"\s+")
+PS_CONCAT_RE = re.compile(r"'([^']*)'\s*\+\s*'([^']*)'")
+PS_PAREN_STRING_RE = re.compile(r"\(\s*'([^']*)'\s*\)")
+PS_BARE_STRING_RE = re.compile(r"'([^'\s]*)'")
+
+
+def register_canonicalizer(tag):
+    """
+    Decorator that registers a function(command) -> canonical string for a tag.
+    Custom canonicalizers can be registered the same way for new tags.
+    """
+    def decorator(func):
+        CANONICALIZERS[tag] = func
+        return func
+    return decorator
+
+
+@register_canonicalizer("generic")
+def canonicalize_generic(command):
+    """
+    Case and runs of whitespace do not change what a command does.
+    """
+    return WHITESPACE_RE.sub(" ", command.strip()).casefold()
+
+
+@register_canonicalizer("cmd")
+def canonicalize_cmd(command):
+    """
+    cmd.exe removes '^' escapes outside double quotes before running a command,
+    so 'vss^adm^in' and 'vssadmin' are the same process.
+    """
+    out = []
+    in_quotes = False
+    i = 0
+    while i < len(command):
+        char = command[i]
+        if char == '"':
+            in_quotes = not in_quotes
+        elif char == '^' and not in_quotes:
+            i += 1
+            if i < len(command):
+                out.append(command[i])
+            i += 1
+            continue
+        out.append(char)
+        i += 1
+    return canonicalize_generic("".join(out))
+
+
+@register_canonicalizer("powershell")
+def canonicalize_powershell(command):
+    """
+    Folds literal string concatenations produced by PowerShellConcat
+    ("('Get-Wmi' + 'Object')" -> "Get-WmiObject") and backtick escapes
+    outside single-quoted strings.
+    """
+    folded = command
+    while True:
+        next_folded = PS_CONCAT_RE.sub(lambda m: "'" + m.group(1) + m.group(2) + "'", folded)
+        next_folded = PS_PAREN_STRING_RE.sub(lambda m: "'" + m.group(1) + "'", next_folded)
+        if next_folded == folded:
+            break
+        folded = next_folded
+    # A quoted word without spaces is the same argument as the bare word
+    folded = PS_BARE_STRING_RE.sub(lambda m: m.group(1), folded)
+
+    out = []
+    in_single = False
+    for i, char in enumerate(folded):
+        if char == "'":
+            in_single = not in_single
+        elif char == '`' and not in_single:
+            # Backtick only escapes the next character (`n/`t etc. are kept as-is)
+            if i + 1 < len(folded) and folded[i + 1] not in "0abefnrtuv":
+                continue
+        out.append(char)
+    return canonicalize_generic("".join(out))
+
+
+def canonical_form(command, tags):
+    """
+    Applies the canonicalizer of the first tag that has one, falling back to 'generic'.
+    """
+    for tag in tags:
+        if tag in CANONICALIZERS:
+            return CANONICALIZERS[tag](command)
+    return CANONICALIZERS["generic"](command)
+
+
+def canonical_key(command, tags):
+    """
+    8-byte digest of the canonical form, used as budget and corpus key.
+    """
+    return hashlib.sha256(canonical_form(command, tags).encode()).digest()[:8]
+
+
+def case_class(text):
+    letters = [char for char in text if char.isalpha()]
+    if not letters:
+        return "n"
+    if all(char.islower() for char in letters):
+        return "l"
+    if all(char.isupper() for char in letters):
+        return "u"
+    return "m"
+
+
+def obfuscation_profile(command, tags):
+    """
+    Coarse shape of how a command is written, which canonical_form() throws
+    away: per token its kind, whether it carries escapes (^ or `) and its
+    case class, with operators verbatim. Mutants that only move a caret
+    within a token or re-roll the case of a mixed-case word share a profile;
+    escaping or re-casing another token, or splitting a word into a
+    concatenation, gives a new one.
+    """
+    parts = []
+    for token in lex(command, tags[0] if tags else "generic"):
+        if token.kind == WS:
+            continue
+        if token.kind == OP:
+            parts.append(token.text)
+            continue
+        escaped = "e" if "^" in token.text or "`" in token.text else ""
+        parts.append(token.kind[0] + escaped + case_class(token.text))
+    return " ".join(parts)
+
+
+def budget_key(command, tags):
+    """
+    8-byte digest of canonical form and obfuscation profile: the unit the
+    execution budget is counted in.
+    """
+    text = canonical_form(command, tags) + "\0" + obfuscation_profile(command, tags)
+    return hashlib.sha256(text.encode()).digest()[:8]
+
+
+class CanonicalBudget:
+    """
+    Limits how many mutants with the same canonical form and obfuscation
+    profile (budget_key) get executed. Mutants that only differ by where the
+    carets sit or how a word's case is mixed share one budget, so the exec
+    budget goes to differently written commands rather than re-rolls of one.
+
+    Spent counts live in a fixed table of BUDGET_SLOTS one-byte counters
+    (a count-min sketch), so memory stays bounded however many forms are
+    seen. With a 'path' the table is a memory-mapped file kept next to the
+    dedup store and survives restarts. A collision can only make a form
+    look more spent than it is, never let it run past its budget.
+    """
+    def __init__(self, budget=CANONICAL_BUDGET, path=None, slots=BUDGET_SLOTS):
+        self.budget = min(budget, BUDGET_MAX)
+        self.path = path
+        self.slots = slots
+        self.handle = None
+        self.counters = None
+        if self.budget <= 0:
+            return
+        if path is None:
+            self.counters = bytearray(slots)
+            return
+        if not os.path.exists(path) or os.path.getsize(path) != slots:
+            # New table (or one sized for another slot count: counts restart)
+            with open(path, "wb") as f:
+                f.truncate(slots)
+        self.handle = open(path, "r+b")
+        self.counters = mmap.mmap(self.handle.fileno(), slots)
+
+    def key_for(self, command, tags):
+        return budget_key(command, tags)
+
+    def positions(self, key):
+        # Independent 4-byte slices of the (uniform) canonical key digest
+        return [int.from_bytes(key[4 * i:4 * i + 4], "little") % self.slots for i in range(BUDGET_PROBES)]
+
+    def spent(self, key):
+        return min(self.counters[pos] for pos in self.positions(key))
+
+    def allows(self, key):
+        return self.budget <= 0 or self.spent(key) < self.budget
+
+    def spend(self, key):
+        if self.budget <= 0:
+            return
+        positions = self.positions(key)
+        count = min(self.counters[pos] for pos in positions)
+        if count >= BUDGET_MAX:
+            return
+        # Conservative update: only the counters holding the minimum grow
+        for pos in positions:
+            if self.counters[pos] == count:
+                self.counters[pos] = count + 1
+
+    def close(self):
+        if self.handle is not None:
+            self.counters.flush()
+            self.counters.close()
+            self.handle.close()
+            self.handle = None
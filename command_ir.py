@@ -0,0 +1,189 @@
+from collections import namedtuple
+
+# A lexed command is a list of tokens whose texts concatenate back to the
+# exact original string (whitespace and quotes included).
+Token = namedtuple("Token", ["kind", "text"])
+
+# Token kinds
+WS = "ws"          # Run of whitespace
+WORD = "word"      # Bare word (may contain escapes: ^ in cmd, ` in PowerShell)
+SWITCH = "switch"  # Bare word starting with '-' (or '/' in cmd)
+STRING = "string"  # Quoted string, quotes included
+VAR = "var"        # %VAR% in cmd, $var / ${var} in PowerShell
+OP = "op"          # Operators and punctuation: pipes, redirections, parens, '+', ...
+
+CMD_OPERATORS = ["&&", "||", ">>", "&", "|", ">", "<", "(", ")"]
+PS_OPERATOR_CHARS = "(){}[]+,;|=&"
+
+MUTABLE_KINDS = (WORD, SWITCH)
+
+
+def _is_switch(text, prefixes):
+    return len(text) > 1 and text[0] in prefixes and (text[1].isalpha() or text[1] == "-")
+
+
+def _cmd_var_end(command, i):
+    # End of a %NAME% reference starting at i, or 0 if it is a literal '%'
+    end = command.find("%", i + 1)
+    if end <= i + 1 or any(c.isspace() for c in command[i + 1:end]):
+        return 0
+    return end + 1
+
+
+def lex_cmd(command):
+    """
+    cmd.exe lexer: "..." strings (carets are literal inside), %VAR%, caret
+    escapes inside words, and the & | > < ( ) operators.
+    """
+    tokens = []
+    i, n = 0, len(command)
+    while i < n:
+        ch = command[i]
+        if ch.isspace():
+            j = i
+            while j < n and command[j].isspace():
+                j += 1
+            tokens.append(Token(WS, command[i:j]))
+        elif ch == '"':
+            j = command.find('"', i + 1)
+            j = n if j < 0 else j + 1
+            tokens.append(Token(STRING, command[i:j]))
+        elif ch == "%" and _cmd_var_end(command, i):
+            j = _cmd_var_end(command, i)
+            tokens.append(Token(VAR, command[i:j]))
+        else:
+            op = next((o for o in CMD_OPERATORS if command.startswith(o, i)), None)
+            if op:
+                tokens.append(Token(OP, op))
+                i += len(op)
+                continue
+            j = i
+            while j < n:
+                c = command[j]
+                if c == "^" and j + 1 < n:
+                    j += 2
+                    continue
+                if c.isspace() or c == '"' or any(command.startswith(o, j) for o in CMD_OPERATORS):
+                    break
+                j += 1
+            text = command[i:j]
+            tokens.append(Token(SWITCH if _is_switch(text, "-/") else WORD, text))
+        i = j
+    return tokens
+
+
+def _ps_string_end(command, i):
+    quote = command[i]
+    j = i + 1
+    n = len(command)
+    while j < n:
+        c = command[j]
+        if quote == '"' and c == "`":
+            j += 2
+            continue
+        if c == quote:
+            if j + 1 < n and command[j + 1] == quote:
+                j += 2  # Doubled quote is an escaped quote
+                continue
+            return j + 1
+        j += 1
+    return n
+
+
+def lex_powershell(command):
+    """
+    PowerShell lexer: '...' and "..." strings (doubled quotes and backtick
+    escapes), $var / ${var}, -Switches, backtick escapes inside words and
+    punctuation such as ( ) + , | so existing concatenations stay visible.
+    """
+    tokens = []
+    i, n = 0, len(command)
+    while i < n:
+        ch = command[i]
+        if ch.isspace():
+            j = i
+            while j < n and command[j].isspace():
+                j += 1
+            tokens.append(Token(WS, command[i:j]))
+        elif ch in "'\"":
+            j = _ps_string_end(command, i)
+            tokens.append(Token(STRING, command[i:j]))
+        elif ch == "$" and i + 1 < n and command[i + 1] == "{":
+            j = command.find("}", i + 2)
+            j = n if j < 0 else j + 1
+            tokens.append(Token(VAR, command[i:j]))
+        elif ch == "$" and i + 1 < n and (command[i + 1].isalnum() or command[i + 1] in "_:?$^"):
+            j = i + 2
+            while j < n and (command[j].isalnum() or command[j] in "_:"):
+                j += 1
+            tokens.append(Token(VAR, command[i:j]))
+        elif ch in PS_OPERATOR_CHARS:
+            tokens.append(Token(OP, ch))
+            j = i + 1
+        else:
+            j = i
+            while j < n:
+                c = command[j]
+                if c == "`" and j + 1 < n:
+                    j += 2
+                    continue
+                if c.isspace() or c in "'\"" or c in PS_OPERATOR_CHARS or (c == "$" and j > i):
+                    break
+                j += 1
+            text = command[i:j]
+            tokens.append(Token(SWITCH if _is_switch(text, "-") else WORD, text))
+        i = j
+    return tokens
+
+
+def lex_generic(command):
+    """
+    Shell-agnostic lexer: whitespace, '...' / "..." strings and words.
+    """
+    tokens = []
+    i, n = 0, len(command)
+    while i < n:
+        ch = command[i]
+        if ch.isspace():
+            j = i
+            while j < n and command[j].isspace():
+                j += 1
+            tokens.append(Token(WS, command[i:j]))
+        elif ch in "'\"":
+            j = command.find(ch, i + 1)
+            j = n if j < 0 else j + 1
+            tokens.append(Token(STRING, command[i:j]))
+        else:
+            j = i
+            while j < n and not command[j].isspace() and command[j] not in "'\"":
+                j += 1
+            text = command[i:j]
+            tokens.append(Token(SWITCH if _is_switch(text, "-/") else WORD, text))
+        i = j
+    return tokens
+
+
+LEXERS = {
+    "cmd": lex_cmd,
+    "powershell": lex_powershell,
+    "generic": lex_generic,
+}
+
+
+def lex(command, tag="generic"):
+    """
+    Tokens of 'command' using the lexer for its tag (generic if unknown).
+    """
+    return LEXERS.get(tag, lex_generic)(command)
+
+
+def render(tokens):
+    return "".join(token.text for token in tokens)
+
+
+def mutable_indices(tokens, kinds=MUTABLE_KINDS):
+    """
+    Positions of the tokens a mutator may rewrite in place (bare words and
+    switches by default; strings, variables and operators are left alone).
+    """
+    return [i for i, token in enumerate(tokens) if token.kind in kinds]
@@ -10,4 +10,46 @@ SIEM_USE_SSL = True
 SIEM_VERIFY_CERTS = False     
 
 # --- Fuzzer Configuration ---
-CONSUMER_SLEEP_TIME = 90
\ No newline at end of file
+CONSUMER_SLEEP_TIME = 30      # Batch mode: seconds between queue/re-check cycles
+CONSUMER_TAIL_INTERVAL = 5    # Stream mode: seconds between polls of the alerts index
+
+# --- Verdict Reconciliation ---
+# IDs without an alert stay pending: re-queried at these ages (seconds after
+# execution, batch mode) and declared "not detected" only at the deadline.
+VERDICT_RECHECK_SCHEDULE = [30, 60, 120, 300]
+VERDICT_DEADLINE = 600        # Final deadline until enough latency samples exist
+VERDICT_AUTO_DEADLINE = True  # Derive the deadline from measured ingestion latency
+VERDICT_LATENCY_QUANTILE = 0.99
+VERDICT_SAFETY_FACTOR = 1.5
+VERDICT_MIN_SAMPLES = 50
+VERDICT_MIN_DEADLINE = 30
+VERDICT_MAX_DEADLINE = 1800
+
+# --- SIEM Query Planner ---
+# Keyword field holding the bare correlation ID (e.g. extracted by an ingest
+# pipeline from the run directory). When set, lookups are exact 'terms' on it.
+SIEM_ID_KEYWORD_FIELD = None
+# Keyword fields holding the per-run working directory (temp_workdirs/<ID>)
+SIEM_CWD_FIELDS = ['winlog.event_data.CurrentDirectory', 'process.working_directory']
+# Also search 'message' with match_phrase for IDs the exact lookups did not find
+SIEM_MESSAGE_FALLBACK = True
+SIEM_TERMS_BATCH = 1000       # Values per 'terms' query
+SIEM_PHRASE_BATCH = 50        # IDs per 'match_phrase' fallback query
+SIEM_PREFIX_BATCH = 100       # Run directories per terms + subdirectory 'prefix' query (~6 clauses each)
+SIEM_PAGE_SIZE = 1000         # Hits per page (search_after paging, no hard cap)
+SIEM_PIT_KEEP_ALIVE = '1m'
+SIEM_TIEBREAKER_FIELD = 'kibana.alert.uuid'  # Sort tiebreaker when no point in time is available
+
+# --- SIEM Client / Parallel Search ---
+SIEM_MSEARCH_BATCH = 20       # Searches packed into one _msearch request
+SIEM_QUERY_CONCURRENCY = 4    # _msearch requests in flight at once
+SIEM_CONNECTIONS_PER_NODE = 8 # HTTP connection pool size (>= concurrency)
+SIEM_REQUEST_TIMEOUT = 30     # Seconds per request
+SIEM_MAX_RETRIES = 5          # Retries on 429 / 5xx gateway errors / timeouts
+SIEM_RETRY_BACKOFF = 0.5      # Seconds, doubled after each retry
+
+# --- Alert Tailing (consumer --stream) ---
+SIEM_TAIL_FIELD = '@timestamp' # Alert creation time, increases as alerts are written
+SIEM_TAIL_OVERLAP = 30         # Seconds re-read behind the watermark for late-indexed alerts
+SIEM_TAIL_LOOKBACK = 300       # Seconds to look back on the very first poll
+SIEM_TAIL_FILTER = None        # Optional extra query clause, e.g. restrict to fuzzing hosts
@@ -1,200 +1,269 @@
 import time
-import os
+import argparse
+import logging
 import config 
-import re 
-import urllib3 
-from elasticsearch import Elasticsearch, exceptions
-
-urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+from queue_log import QueueLogReader
+from siem_query import SiemQueryPlanner, AlertTailer, candidate_ids, alert_time
+from verdicts import OutstandingIndex, VerdictPolicy
+from corpus_store import CorpusStore
+from scheduler import mutator_arm, depth_arm
+from oracle import OracleAccuracy
+from verifier import connect_siem
+from metrics import REGISTRY, LOG_LEVELS, setup_logging, start_monitoring, milliseconds
+from results_archive import ResultsArchive, ARCHIVE_DIR, RUN_FIELDS, LEGACY_DIRS, write_legacy_file
 
 # --- Configuration ---
-QUEUE_FILE = "queue.txt"
-INTERESTING_DIR = "interesting_finds"
-SEED_DIR = "seeds" 
-ALERT_DIR = "alerts" 
+QUEUE_DIR = "queue_log"
+QUEUE_BATCH_SIZE = 1000   # Records read from the queue log at a time
+CORPUS_DB = "corpus.db" 
+RESULTS_DIR = ARCHIVE_DIR                     # Verdict archive (results_archive.py query/export)
+CHECKPOINT_FILE = "consumer_checkpoint.json"  # Stream mode alert watermark
+LATENCY_FILE = "ingestion_latency.json"       # Measured execution-to-alert delays
+ORACLE_FILE = "oracle_accuracy.json"          # Local oracle predictions vs. SIEM verdicts
 
 # --- Priority Flags ---
 PRIO_1_BYPASS_SUCCESS = 1
 PRIO_2_BYPASS_FAIL = 2
 PRIO_3_DETECTED_OR_ERROR = 3
+# Verdicts kept in the results archive; --archive-all adds PRIO_2
+ARCHIVED_PRIORITIES = (PRIO_1_BYPASS_SUCCESS, PRIO_3_DETECTED_OR_ERROR)
+
+# --- Metrics (see metrics.py; served with --metrics-port) ---
+log = logging.getLogger("purplefuzz.consumer")
+RECORDS_READ = REGISTRY.counter("purplefuzz_queue_records_read_total", "Queue log records read by the consumer")
+SIEM_QUERIES = REGISTRY.counter("purplefuzz_siem_queries_total", "SIEM lookups by outcome", ["result"])
+SIEM_QUERY_SECONDS = REGISTRY.histogram("purplefuzz_siem_query_seconds", "Time of one SIEM lookup for a batch of IDs")
+SIEM_QUERIED_IDS = REGISTRY.counter("purplefuzz_siem_queried_ids_total", "Correlation IDs looked up in the SIEM")
+VERDICTS = REGISTRY.counter("purplefuzz_verdicts_total", "Verdicts by priority", ["priority"])
+TIME_TO_VERDICT = REGISTRY.histogram("purplefuzz_time_to_verdict_seconds", "Execution to recorded verdict")
+INGESTION_LATENCY = REGISTRY.histogram("purplefuzz_ingestion_latency_seconds", "Execution to alert in the SIEM")
+PENDING_IDS = REGISTRY.gauge("purplefuzz_pending_ids", "Queue records waiting for a verdict")
 
 class ConsumerSIEM:
-    def __init__(self):
+    def __init__(self, archived_priorities=ARCHIVED_PRIORITIES, legacy_files=False):
         print("Initializing Consumer...")
-        os.makedirs(INTERESTING_DIR, exist_ok=True)
-        os.makedirs(SEED_DIR, exist_ok=True)
-        os.makedirs(ALERT_DIR, exist_ok=True)
+        # Verdicts are appended to the results archive in one block per cycle;
+        # 'legacy_files' also writes the old interesting_finds/ and alerts/ files
+        self.archive = ResultsArchive(RESULTS_DIR)
+        self.archived_priorities = archived_priorities
+        self.legacy_files = legacy_files
+
+        # Seeds go into the corpus store the producers read incrementally
+        self.corpus = CorpusStore(CORPUS_DB)
+
+        # Committed offset in the producer's queue log; only new records are read
+        self.queue_reader = QueueLogReader(QUEUE_DIR)
+        self.read_position = self.queue_reader.committed
+
+        # IDs read from the queue that have no verdict yet, and when to give up on them
+        self.pending = OutstandingIndex()
+        self.verdict_policy = VerdictPolicy(LATENCY_FILE)
+
+        # (seed_id, bypassed, detected) per verdict, flushed to the corpus each cycle
+        self.seed_feedback = []
+        # (tag, bandit arms, bypassed, detected) per verdict, for the mutator scheduler
+        self.arm_feedback = []
+        # How well the producer's local oracle predicted the SIEM
+        self.oracle_accuracy = OracleAccuracy(ORACLE_FILE)
+        PENDING_IDS.set_function(lambda: len(self.pending))
         
         print(f"Connecting to SIEM at {config.SIEM_HOST}...")
         try:
-            auth_creds = None
-            if config.SIEM_USER and config.SIEM_PASS:
-                auth_creds = (config.SIEM_USER, config.SIEM_PASS)
-
-            scheme = "https" if config.SIEM_USE_SSL else "http"
-
-            self.siem_client = Elasticsearch(
-                hosts=[{'host': config.SIEM_HOST, 'port': config.SIEM_PORT, 'scheme': scheme}],
-                basic_auth=auth_creds, 
-                verify_certs=config.SIEM_VERIFY_CERTS,
-                ssl_show_warn=False 
-            )
-            
-            if not self.siem_client.ping():
-                raise Exception("Ping failed")
+            self.siem_client = connect_siem()
             print("[+] SIEM connection successful.")
+            self.query_planner = SiemQueryPlanner(self.siem_client)
         except Exception as e:
             print(f"[ERROR] Could not connect to Elasticsearch: {e}")
             exit(1)
 
-    def query_siem_for_ids(self, correlation_ids):
+    def query_siem_for_ids(self, correlation_ids, cwd_by_id=None):
+        """
+        Returns {cid: alert time or None} for the 'correlation_ids' that appear
+        in alerts. 'cwd_by_id' maps IDs to the run directory recorded by the
+        producer, which allows exact keyword lookups instead of phrase matching.
+        """
         if not correlation_ids:
-            return set()
-
-        print(f"  [?] Querying SIEM for {len(correlation_ids)} IDs...")
-        
-        batch_size = 50 
-        detected_ids = set()
+            return {}
 
-        # Build regex to scan IDs from results 
+        log.info("  [?] Querying SIEM for %s IDs...", len(correlation_ids))
+        SIEM_QUERIED_IDS.inc(len(correlation_ids))
         try:
-            id_regex = re.compile("|".join(re.escape(cid) for cid in correlation_ids))
-        except re.error as e:
-            print(f"  [ERROR] Regex compilation failed: {e}")
-            return set()
-
-        for i in range(0, len(correlation_ids), batch_size):
-            batch_ids = correlation_ids[i:i + batch_size]
-            should_clauses = []
-            for cid in batch_ids:
-                # Search in field containing main ID
-                should_clauses.append({"match_phrase": {"winlog.event_data.CurrentDirectory": cid}})
-                # Fallback search in message
-                should_clauses.append({"match_phrase": {"message": cid}})
-
-            query_body = {
-                "query": {
-                    "bool": {
-                        "should": should_clauses,
-                        "minimum_should_match": 1
-                    }
-                },
-                "_source": ["winlog.event_data.CurrentDirectory", "message"], 
-                "size": 1000 
-            }
-            # ---------------------------
+            with SIEM_QUERY_SECONDS.time():
+                detected_ids = self.query_planner.find_detected(correlation_ids, cwd_by_id)
+        except Exception:
+            SIEM_QUERIES.inc(result="error")
+            raise
+        SIEM_QUERIES.inc(result="ok")
+        log.info("  [!] SIEM detected %s IDs.", len(detected_ids))
+        return detected_ids
 
-            try:
-                response = self.siem_client.search(
-                    index=config.SIEM_INDEX,
-                    body=query_body
-                )
-                
-                # Scan results
-                for hit in response['hits']['hits']:
-                    raw_text = str(hit['_source']) 
-                    found = id_regex.findall(raw_text)
-                    detected_ids.update(found)
+    def process_queue(self):
+        """
+        One reconciliation cycle. New queue records join the pending set; every
+        pending ID that reached a re-check point or its final deadline is
+        queried. Detections are recorded at once, IDs still without an alert
+        at the deadline are declared not detected, the rest stay pending.
+        The queue offset only advances past records that have a verdict, so a
+        failed query simply leaves them pending for the next cycle.
+        """
+        self.read_new_records(self.pending)
+        now = time.time()
+        deadline = self.verdict_policy.deadline()
+        if not len(self.pending):
+            print("  [~] No pending queue records.")
+            self.finish_cycle(deadline)
+            return
 
+        due = [cid for cid, entry in self.pending.items() if self.verdict_policy.is_due(entry, now, deadline)]
+        if due:
+            cwd_by_id = {cid: self.pending.entries[cid]["data"]["cwd"] for cid in due if self.pending.entries[cid]["data"]["cwd"]}
+            try:
+                detected_ids = self.query_siem_for_ids(due, cwd_by_id)
             except Exception as e:
-                print(f"  [ERROR] Batch query failed: {e}")
-                continue
+                print(f"[CRITICAL ERROR] Queue processing failed: {e}")
+                print("  [~] IDs stay pending, they will be re-checked next cycle.")
+                return
 
-        print(f"  [!] SIEM detected {len(detected_ids)} IDs.")
-        return detected_ids
+            not_detected = 0
+            for cid in due:
+                entry = self.pending.entries[cid]
+                if cid in detected_ids:
+                    self.pending.resolve(cid)
+                    self.observe_detection(entry, detected_ids[cid])
+                    self.record_verdict(cid, entry["data"], True)
+                elif now - entry["added"] >= deadline:
+                    self.pending.resolve(cid)
+                    self.record_verdict(cid, entry["data"], False)
+                    not_detected += 1
+                else:
+                    self.verdict_policy.mark_checked(entry, now)
+            print(f"  [+] {len(detected_ids)} detected, {not_detected} past deadline, {len(self.pending)} still pending.")
+            self.print_latency_summary(deadline)
 
-    def process_queue(self):
-        processing_file = "queue.processing.txt"
-        try:
-            os.rename(QUEUE_FILE, processing_file)
-        except FileNotFoundError:
-            print("  [~] No queue file to process.")
-            return
+        self.finish_cycle(deadline)
+
+    def observe_detection(self, entry, seen_at):
+        """
+        Feeds the execution-to-alert delay into the latency histogram.
+        """
+        latency = (seen_at if seen_at is not None else time.time()) - entry["added"]
+        self.verdict_policy.observe(latency)
+        INGESTION_LATENCY.observe(max(latency, 0.0))
+        return latency
 
-        commands_to_check = {} 
+    def finish_cycle(self, deadline):
+        # Before the offset commit: a crash archives a verdict twice rather than not at all
+        self.archive.flush()
+        if self.seed_feedback:
+            # Before the offset commit, so a crash re-counts rather than loses feedback
+            self.corpus.record_results(self.seed_feedback)
+            self.seed_feedback = []
+            # Online eviction: keeps every priority bin under its cap
+            evicted = self.corpus.enforce_caps()
+            if evicted:
+                print(f"  [-] Evicted {evicted} low-energy seeds from full priority bins.")
+        if self.arm_feedback:
+            self.corpus.record_arm_results(self.arm_feedback)
+            self.arm_feedback = []
+        offset = self.pending.committable_offset()
+        if offset is not None:
+            self.queue_reader.commit(offset)
+        self.verdict_policy.save()
+        self.oracle_accuracy.save()
+
+    def print_latency_summary(self, deadline):
+        histogram = self.verdict_policy.histogram
+        if histogram.total:
+            print(f"  [i] Verdict deadline {deadline:.0f}s; ingestion latency: {histogram.summary()}")
+        if sum(self.oracle_accuracy.matrix.values()):
+            print(f"  [i] Local oracle vs. SIEM: {self.oracle_accuracy.summary()}")
+
+    def parse_record(self, record):
+        """
+        Extracts what a verdict needs from a queue record, or None if malformed.
+        """
         try:
-            with open(processing_file, 'r', encoding='utf-8') as f:
-                for line in f:
-                    try:
-                        cid, success_str, tags_str, cmd = line.strip().split('|', 3)
-                        commands_to_check[cid] = {
-                            "success": (success_str == 'True'),
-                            "cmd": cmd,
-                            "tags": tags_str.split(' ')
-                        }
-                    except ValueError:
-                        continue
-            
-            if not commands_to_check:
-                os.remove(processing_file)
-                return
+            return {
+                "success": bool(record["success"]),
+                "cmd": record["cmd"],
+                "tags": record["tags"],
+                "cwd": record.get("cwd"),
+                "ts": record.get("ts"),
+                "seed_id": record.get("seed_id"),
+                "mutators": record.get("mutators") or [],
+                "oracle": record.get("oracle"),
+                "run": {field: record[field] for field in RUN_FIELDS if field in record}
+            }
+        except (KeyError, TypeError):
+            return None
 
-            all_ids = list(commands_to_check.keys())
-            detected_ids = self.query_siem_for_ids(all_ids)
+    def record_verdict(self, cid, data, was_detected):
+        run_success = data["success"]
+        command = data["cmd"]
+        tags = data["tags"]
+        
+        priority = PRIO_3_DETECTED_OR_ERROR
 
-            for cid, data in commands_to_check.items():
-                was_detected = cid in detected_ids
-                run_success = data["success"]
-                command = data["cmd"]
-                tags = data["tags"]
-                
-                priority = PRIO_3_DETECTED_OR_ERROR
-
-                if not was_detected and run_success:
-                    priority = PRIO_1_BYPASS_SUCCESS
-                elif not was_detected and not run_success:
-                    priority = PRIO_2_BYPASS_FAIL
-
-                # Create common filename
-                filename = f"prio_{priority}__{int(time.time())}__{cid[:4]}.txt"
-                original_tag = tags[0] if tags else "generic"
-                seed_filename = f"{original_tag}_fuzzed_{filename}" 
-                seed_filepath = os.path.join(SEED_DIR, seed_filename)
-
-                # PRIO 1: Save to interesting_finds AND add to seeds
-                if priority == PRIO_1_BYPASS_SUCCESS:
-                    filepath = os.path.join(INTERESTING_DIR, filename)
-                    with open(filepath, 'w', encoding='utf-8') as f:
-                        f.write(command)
-                    
-                    # Add to seeds
-                    with open(seed_filepath, 'w', encoding='utf-8') as f:
-                        f.write(command)
-
-                    print(f"  [***] Found Bypass Prio 1! Saved & added to seeds.")
-                
-                # PRIO 2
-                elif priority == PRIO_2_BYPASS_FAIL:
-                    pass # Ignored
-
-                # PRIO 3: Save alerts AND add to seeds
-                elif priority == PRIO_3_DETECTED_OR_ERROR:
-                    filepath = os.path.join(ALERT_DIR, filename)
-                    with open(filepath, 'w', encoding='utf-8') as f:
-                        f.write(command)
-                    
-                    # Add to seeds 
-                    with open(seed_filepath, 'w', encoding='utf-8') as f:
-                        f.write(command)
-                        
-                    # print(f"  [!] Detected (Prio 3). Saved & added to seeds.")
-
-            os.remove(processing_file)
-            print("  [+] Queue processing complete.")
+        if not was_detected and run_success:
+            priority = PRIO_1_BYPASS_SUCCESS
+        elif not was_detected and not run_success:
+            priority = PRIO_2_BYPASS_FAIL
 
-        except Exception as e:
-            print(f"[CRITICAL ERROR] Queue processing failed: {e}")
-            if os.path.exists(processing_file):
-                try:
-                    if os.path.exists(QUEUE_FILE):
-                        with open(QUEUE_FILE, 'a', encoding='utf-8') as qf:
-                            with open(processing_file, 'r', encoding='utf-8') as pf:
-                                qf.write(pf.read())
-                        os.remove(processing_file)
-                    else:
-                        os.rename(processing_file, QUEUE_FILE)
-                except Exception as rename_e:
-                    print(f"[ERROR] Could not revert queue file: {rename_e}")
+        VERDICTS.inc(priority=priority)
+        if data.get("ts"):
+            TIME_TO_VERDICT.observe(max(time.time() - data["ts"], 0.0))
+
+        # Feedback for the seed this mutant came from (drives its scheduling energy)
+        seed_id = data.get("seed_id")
+        self.seed_feedback.append((seed_id, priority == PRIO_1_BYPASS_SUCCESS, was_detected))
+
+        original_tag = tags[0] if tags else "generic"
+
+        if data.get("oracle") is not None:
+            self.oracle_accuracy.observe(data["oracle"], was_detected)
+
+        # ... and for the mutator chain and stack depth that produced it
+        chain = data.get("mutators") or []
+        if chain:
+            arms = [mutator_arm(name) for name in chain] + [depth_arm(len(chain))]
+            self.arm_feedback.append((original_tag, arms, priority == PRIO_1_BYPASS_SUCCESS, was_detected))
+
+        if priority in self.archived_priorities:
+            result = {
+                "id": cid,
+                "verdict": priority,
+                "detected": was_detected,
+                "success": run_success,
+                "cmd": command,
+                "tags": tags,
+                "seed_id": seed_id,
+                "mutators": chain,
+                "oracle": data.get("oracle"),
+                "executed_at": data.get("ts"),
+                "decided_at": time.time(),
+                **data.get("run", {})
+            }
+            self.archive.add(result)
+            if self.legacy_files and priority in LEGACY_DIRS:
+                write_legacy_file(result)
+
+        # PRIO 1: Archived AND added to seeds
+        if priority == PRIO_1_BYPASS_SUCCESS:
+            # Add to seeds
+            self.corpus.add_seed(command, original_tag, priority, parent_id=seed_id, source=cid)
+
+            log.info("  [***] Found Bypass Prio 1! Saved & added to seeds.")
+        
+        # PRIO 2
+        elif priority == PRIO_2_BYPASS_FAIL:
+            pass # Ignored
+
+        # PRIO 3: Archived AND added to seeds
+        elif priority == PRIO_3_DETECTED_OR_ERROR:
+            # Add to seeds 
+            self.corpus.add_seed(command, original_tag, priority, parent_id=seed_id, source=cid)
+                
+            # print(f"  [!] Detected (Prio 3). Saved & added to seeds.")
 
     def main_loop(self):
         sleep_time = config.CONSUMER_SLEEP_TIME
@@ -205,9 +274,137 @@ class ConsumerSIEM:
             print("--- Woke up, starting to process the queue ---")
             self.process_queue()
 
+    def read_new_records(self, outstanding):
+        """
+        Moves every queue record past the last read position into the
+        outstanding index. Returns IDs whose alert arrived before the record.
+        """
+        already_alerted = []
+        while True:
+            batch = self.queue_reader.read_batch(QUEUE_BATCH_SIZE, start=self.read_position)
+            if not batch:
+                return already_alerted
+            RECORDS_READ.inc(len(batch))
+            for record, offset in batch:
+                self.read_position = offset
+                data = self.parse_record(record)
+                if data is None:
+                    # Malformed records are acknowledged without a verdict
+                    outstanding.skip(offset)
+                    continue
+                if outstanding.add(record["id"], data, offset, added=data["ts"]):
+                    already_alerted.append(record["id"])
+
+    def stats_line(self, rate):
+        verdicts = VERDICTS.total()
+        return (f"{rate('records', RECORDS_READ.total()):.1f} records/s read, "
+                f"{rate('verdicts', verdicts):.1f} verdicts/s ({VERDICTS.get(priority=PRIO_1_BYPASS_SUCCESS)} bypasses "
+                f"of {verdicts} total), {len(self.pending)} pending, "
+                f"SIEM query p95 {milliseconds(SIEM_QUERY_SECONDS.quantile(0.95))} "
+                f"({SIEM_QUERIES.get(result='error')} failed), "
+                f"time to verdict p50 {milliseconds(TIME_TO_VERDICT.quantile(0.5))} "
+                f"p95 {milliseconds(TIME_TO_VERDICT.quantile(0.95))}")
+
+    # --- Streaming mode ---
+
+    def stream_cycle(self, outstanding):
+        detected = {cid: None for cid in self.read_new_records(outstanding)}
+
+        for source in self.alert_tailer.poll():
+            seen_at = alert_time(source)
+            for cid in candidate_ids(source):
+                if cid in outstanding:
+                    detected.setdefault(cid, seen_at)
+                else:
+                    outstanding.remember_unclaimed(cid)
+
+        for cid, seen_at in detected.items():
+            entry = outstanding.resolve(cid)
+            if entry is not None:
+                latency = self.observe_detection(entry, seen_at)
+                self.record_verdict(cid, entry["data"], True)
+                log.info("  [!] Detected ...%s (%.1fs after execution)", cid[-6:], latency)
+
+        # No alert before the deadline: not detected
+        deadline = self.verdict_policy.deadline()
+        expired = outstanding.older_than(deadline)
+        for cid in expired:
+            entry = outstanding.resolve(cid)
+            self.record_verdict(cid, entry["data"], False)
+        if expired:
+            print(f"  [+] {len(expired)} IDs without alert past the {deadline:.0f}s deadline.")
+            self.print_latency_summary(deadline)
+
+        outstanding.expire_unclaimed()
+        self.alert_tailer.save_checkpoint()
+        self.finish_cycle(deadline)
+
+    def stream_loop(self):
+        """
+        Tails the alerts index every CONSUMER_TAIL_INTERVAL seconds and matches
+        new alerts against all outstanding IDs, so a detection is recorded as
+        soon as its alert is indexed. IDs without an alert are declared not
+        detected at the verdict deadline (see VerdictPolicy). The queue
+        offset only advances past records that have a verdict.
+        """
+        interval = config.CONSUMER_TAIL_INTERVAL
+        print(f"--- STARTING CONSUMER (stream mode, poll every {interval} seconds) ---")
+        self.alert_tailer = AlertTailer(self.query_planner, CHECKPOINT_FILE)
+        while True:
+            try:
+                self.stream_cycle(self.pending)
+            except Exception as e:
+                print(f"[ERROR] Stream cycle failed: {e}")
+            time.sleep(interval)
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="PurpleFuzz - Detection-Guided Fuzzer (Consumer)")
+    parser.add_argument(
+        "-s", "--stream",
+        action="store_true",
+        help="Tail the alerts index continuously instead of querying the queue every CONSUMER_SLEEP_TIME seconds"
+    )
+    parser.add_argument(
+        "--metrics-port",
+        type=int,
+        default=None,
+        help="Serve Prometheus metrics on 127.0.0.1:PORT/metrics"
+    )
+    parser.add_argument(
+        "--stats-interval",
+        type=float,
+        default=0,
+        help="Print a throughput/latency stats line every N seconds (0=off)"
+    )
+    parser.add_argument(
+        "--log-level",
+        default="info",
+        choices=LOG_LEVELS,
+        help="Per-verdict and per-query messages are 'info' (rate-limited); 'warning' hides them"
+    )
+    parser.add_argument(
+        "--archive-all",
+        action="store_true",
+        help="Also archive PRIO_2 verdicts (bypassed but failed to run)"
+    )
+    parser.add_argument(
+        "--legacy-files",
+        action="store_true",
+        help="Also write one file per PRIO_1/PRIO_3 verdict into interesting_finds/ and alerts/"
+    )
+    args = parser.parse_args()
+    setup_logging(args.log_level)
+
+    consumer = None
     try:
-        consumer = ConsumerSIEM()
-        consumer.main_loop()
+        archived = ARCHIVED_PRIORITIES + (PRIO_2_BYPASS_FAIL,) if args.archive_all else ARCHIVED_PRIORITIES
+        consumer = ConsumerSIEM(archived_priorities=archived, legacy_files=args.legacy_files)
+        start_monitoring(args.metrics_port, args.stats_interval, consumer.stats_line)
+        if args.stream:
+            consumer.stream_loop()
+        else:
+            consumer.main_loop()
     except KeyboardInterrupt:
         print("\n[!] Consumer is stopping...")
+        if consumer is not None:
+            consumer.archive.close()
@@ -0,0 +1,521 @@
+"""
+Central coordinator for a fleet of producers.
+
+It owns what used to be per-directory files, so any number of producer
+processes (on one host or several) can share them:
+
+  - the corpus store: producers fetch seed changes with a long poll, so new
+    high-priority seeds reach every producer as soon as the consumer adds them
+  - the dedup store and the canonical budget, split into hash-space shards
+    with one lock each
+  - the queue log: producers send their result records here, and a single
+    consumer reads them as before
+
+Protocol: one JSON object per line in each direction over TCP or a Unix
+socket. Requests are {"op": ..., ...}; responses are {"ok": true, ...} or
+{"ok": false, "error": ...}. Requests that change state (claim, results)
+carry a "request_id"; a retry with the same id gets the first reply again
+instead of being applied twice.
+
+    python coordinator.py --listen 127.0.0.1:7070
+    python coordinator.py --listen unix:/tmp/purplefuzz.sock
+    python producer.py --coordinator 127.0.0.1:7070
+"""
+import os
+import json
+import time
+import hashlib
+import uuid
+import socket
+import argparse
+import threading
+import socketserver
+from collections import OrderedDict
+
+from corpus_store import CorpusStore, CORPUS_DB
+from queue_log import QueueLogWriter
+from hash_store import DedupStore, digest_key
+from canonicalize import CanonicalBudget, CANONICAL_BUDGET, BUDGET_SLOTS
+
+# --- Coordinator Defaults ---
+DEFAULT_ADDRESS = "127.0.0.1:7070"
+DEFAULT_SHARDS = 4
+SEED_DIR = "seeds"
+QUEUE_DIR = "queue_log"
+HASH_STORE = "tested_hashes"
+REV_POLL_INTERVAL = 0.5     # Seconds between corpus revision checks (the consumer writes directly)
+MAX_LONG_POLL = 30          # Upper bound for a client's long-poll wait
+CLIENT_RETRIES = 5
+CLIENT_RETRY_BACKOFF = 0.5
+RESULT_BATCH = 100          # Records per 'results' request
+RESULT_FLUSH_INTERVAL = 1.0 # Seconds a record may wait for its batch
+REPLY_CACHE_SIZE = 4096     # Replies kept by request id to answer retried requests
+IDEMPOTENT_OPS = ("claim", "results")  # Ops the client tags with a request id
+
+
+def parse_address(address):
+    """
+    'unix:/path/to.sock' or 'host:port' -> (family, address).
+    """
+    if address.startswith("unix:"):
+        return socket.AF_UNIX, address[len("unix:"):]
+    host, _, port = address.rpartition(":")
+    return socket.AF_INET, (host or "127.0.0.1", int(port))
+
+
+def row_dict(row):
+    return {key: row[key].hex() if isinstance(row[key], bytes) else row[key] for key in row.keys()}
+
+
+class Shard:
+    """
+    One hash-space partition: the dedup keys and canonical budget counts
+    whose first key byte falls in it, behind its own lock.
+    """
+    def __init__(self, path, canonical_budget, budget_slots):
+        self.dedup = DedupStore(path)
+        self.budget = CanonicalBudget(canonical_budget, path + ".budget", slots=budget_slots)
+        self.lock = threading.Lock()
+
+    def close(self):
+        self.dedup.close()
+        self.budget.close()
+
+
+class Coordinator:
+    """
+    Shared state behind the socket server. Every request handler thread
+    gets its own SQLite connection to the corpus.
+    """
+    def __init__(self, corpus_path=CORPUS_DB, queue_dir=QUEUE_DIR, hash_store=HASH_STORE,
+                 shards=DEFAULT_SHARDS, canonical_budget=CANONICAL_BUDGET, seed_dir=SEED_DIR):
+        self.corpus_path = corpus_path
+        self.local = threading.local()
+
+        corpus = self.corpus()
+        if len(corpus) == 0 and os.path.isdir(seed_dir):
+            print(f"Imported {corpus.import_dir(seed_dir)} seed files from directory: {seed_dir}")
+        self.rev = corpus.current_rev()
+        self.rev_changed = threading.Condition()
+
+        self.queue_log = QueueLogWriter(queue_dir)
+        self.queue_lock = threading.Lock()
+
+        # Hash-space sharding: the first key byte picks the shard
+        shards = max(1, shards)
+        self.shards = [Shard(f"{hash_store}.shard{i}", canonical_budget, BUDGET_SLOTS // shards)
+                       for i in range(shards)]
+
+        self.replies = OrderedDict()    # request id -> {"done", "response"}, oldest first
+        self.replies_lock = threading.Lock()
+
+        self.producers = {}     # producer id -> {"seen", "results"}
+        self.producers_lock = threading.Lock()
+        self.stop = threading.Event()
+        threading.Thread(target=self.watch_corpus, daemon=True).start()
+
+    def corpus(self):
+        store = getattr(self.local, "corpus", None)
+        if store is None:
+            store = self.local.corpus = CorpusStore(self.corpus_path)
+        return store
+
+    def watch_corpus(self):
+        """
+        Wakes up long-polling producers when the consumer changed the corpus.
+        """
+        corpus = CorpusStore(self.corpus_path)
+        while not self.stop.wait(REV_POLL_INTERVAL):
+            rev = corpus.current_rev()
+            if rev != self.rev:
+                with self.rev_changed:
+                    self.rev = rev
+                    self.rev_changed.notify_all()
+        corpus.close()
+
+    def shard_for(self, key):
+        # A hash of its own: the key bytes also index the bloom filter and the budget
+        # counters, which would then only see 1/shards of their slots in each shard
+        shard = int.from_bytes(hashlib.blake2b(key, digest_size=4).digest(), "little")
+        return self.shards[shard % len(self.shards)]
+
+    # --- Operations ---
+
+    def op_hello(self, request):
+        producer_id = request["producer_id"]
+        with self.producers_lock:
+            self.producers.setdefault(producer_id, {"seen": time.time(), "results": 0})
+        print(f"  [+] Producer connected: {producer_id}")
+        return {"rev": self.rev, "seeds": len(self.corpus())}
+
+    def op_seeds(self, request):
+        """
+        Corpus rows changed after 'since'. With 'wait', blocks until there is
+        a change (long poll) so new seeds are pushed without polling the DB.
+        """
+        since = request.get("since", 0)
+        wait = min(float(request.get("wait", 0)), MAX_LONG_POLL)
+        if wait > 0:
+            with self.rev_changed:
+                self.rev_changed.wait_for(lambda: self.rev > since or self.stop.is_set(), timeout=wait)
+        rows, latest = self.corpus().changes_since(since)
+        return {"rows": [row_dict(r) for r in rows], "rev": latest}
+
+    def op_arm_stats(self, request):
+        return {"rows": [row_dict(r) for r in self.corpus().arm_stats()]}
+
+    def op_claim(self, request):
+        """
+        Central dedup for a batch of candidates: [[text digest hex, canonical key hex], ...].
+        A candidate is claimed (True) if its canonical form still has budget
+        and its digest was never seen; claiming records both. The budget is
+        checked and spent under the lock of the canonical key's shard only;
+        dedup stores lock themselves.
+        """
+        claimed = []
+        for digest_hex, canonical_hex in request["items"]:
+            key = bytes.fromhex(digest_hex)
+            dedup = self.shard_for(key).dedup
+            if not canonical_hex:
+                claimed.append(dedup.add(key))
+                continue
+            canonical_key = bytes.fromhex(canonical_hex)
+            shard = self.shard_for(canonical_key)
+            with shard.lock:
+                fresh = shard.budget.allows(canonical_key) and dedup.add(key)
+                if fresh:
+                    shard.budget.spend(canonical_key)
+            claimed.append(fresh)
+        return {"claimed": claimed}
+
+    def op_results(self, request):
+        records = request["records"]
+        with self.queue_lock:
+            self.queue_log.append_many(records)
+        with self.producers_lock:
+            info = self.producers.setdefault(request.get("producer_id"), {"seen": 0, "results": 0})
+            info["seen"] = time.time()
+            info["results"] += len(records)
+        return {"accepted": len(records)}
+
+    def op_stats(self, request):
+        with self.producers_lock:
+            producers = {pid: dict(info) for pid, info in self.producers.items()}
+        return {
+            "rev": self.rev,
+            "seeds": len(self.corpus()),
+            "dedup": [len(shard.dedup) for shard in self.shards],
+            "producers": producers,
+        }
+
+    def handle(self, request):
+        handler = getattr(self, "op_" + str(request.get("op")), None)
+        if handler is None:
+            return {"ok": False, "error": f"unknown op {request.get('op')!r}"}
+        request_id = request.get("request_id")
+        if request_id is None:
+            return self.respond(handler, request)
+        with self.replies_lock:
+            entry = self.replies.get(request_id)
+            first = entry is None
+            if first:
+                entry = self.replies[request_id] = {"done": threading.Event(), "response": None}
+                if len(self.replies) > REPLY_CACHE_SIZE:
+                    self.replies.popitem(last=False)
+        if not first:
+            # Retry of a request whose reply was lost: answer as the first attempt did
+            entry["done"].wait()
+            if entry["response"] is not None:
+                return entry["response"]
+            return self.handle(request)
+        try:
+            entry["response"] = self.respond(handler, request)
+            return entry["response"]
+        finally:
+            if entry["response"] is None:
+                # Failed: a retry runs it again
+                with self.replies_lock:
+                    self.replies.pop(request_id, None)
+            entry["done"].set()
+
+    def respond(self, handler, request):
+        response = handler(request)
+        response["ok"] = True
+        return response
+
+    def close(self):
+        self.stop.set()
+        with self.rev_changed:
+            self.rev_changed.notify_all()
+        with self.queue_lock:
+            self.queue_log.close()
+        for shard in self.shards:
+            shard.close()
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        coordinator = self.server.coordinator
+        try:
+            for line in self.rfile:
+                if not line.strip():
+                    continue
+                try:
+                    response = coordinator.handle(json.loads(line))
+                except Exception as e:
+                    response = {"ok": False, "error": f"{type(e).__name__}: {e}"}
+                self.wfile.write(json.dumps(response).encode("utf-8") + b"\n")
+                self.wfile.flush()
+        except ConnectionError:
+            pass  # Producer went away; its state lives in the shared stores
+
+    def finish(self):
+        try:
+            super().finish()
+        except ConnectionError:
+            pass
+
+
+class ThreadingTCPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+if hasattr(socketserver, "ThreadingUnixStreamServer"):
+    class ThreadingUnixServer(socketserver.ThreadingUnixStreamServer):
+        daemon_threads = True
+
+
+def serve(coordinator, address=DEFAULT_ADDRESS):
+    family, bind = parse_address(address)
+    if family == socket.AF_UNIX:
+        if os.path.exists(bind):
+            os.unlink(bind)
+        server = ThreadingUnixServer(bind, RequestHandler)
+    else:
+        server = ThreadingTCPServer(bind, RequestHandler)
+    server.coordinator = coordinator
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+# --- Client side (used by producer.py --coordinator) ---
+
+class CoordinatorError(Exception):
+    pass
+
+
+class CoordinatorClient:
+    """
+    One connection to the coordinator; requests are serialized by a lock
+    and retried with a fresh connection if it drops. IDEMPOTENT_OPS get a
+    request id, kept across the retries, so the coordinator applies them once.
+    """
+    def __init__(self, address=DEFAULT_ADDRESS, timeout=MAX_LONG_POLL + 30):
+        self.address = address
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.sock = None
+        self.reader = None
+
+    def connect(self):
+        family, target = parse_address(self.address)
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        sock.connect(target)
+        self.sock = sock
+        self.reader = sock.makefile("rb")
+
+    def disconnect(self):
+        for closable in (self.reader, self.sock):
+            try:
+                if closable is not None:
+                    closable.close()
+            except OSError:
+                pass
+        self.sock = None
+        self.reader = None
+
+    def request(self, op, **params):
+        params["op"] = op
+        if op in IDEMPOTENT_OPS:
+            params.setdefault("request_id", uuid.uuid4().hex)
+        payload = json.dumps(params).encode("utf-8") + b"\n"
+        with self.lock:
+            for attempt in range(CLIENT_RETRIES):
+                try:
+                    if self.sock is None:
+                        self.connect()
+                    self.sock.sendall(payload)
+                    line = self.reader.readline()
+                    if not line:
+                        raise ConnectionError("coordinator closed the connection")
+                    break
+                except OSError as e:
+                    self.disconnect()
+                    if attempt == CLIENT_RETRIES - 1:
+                        raise CoordinatorError(f"{op}: {e}") from e
+                    time.sleep(CLIENT_RETRY_BACKOFF * (2 ** attempt))
+        response = json.loads(line)
+        if not response.get("ok"):
+            raise CoordinatorError(f"{op}: {response.get('error')}")
+        return response
+
+    def close(self):
+        with self.lock:
+            self.disconnect()
+
+
+class RemoteCorpus:
+    """
+    Read side of CorpusStore backed by the coordinator. A background long
+    poll collects pushed seed changes; 'news' is set when some arrived.
+    """
+    def __init__(self, address, producer_id):
+        self.client = CoordinatorClient(address)
+        hello = self.client.request("hello", producer_id=producer_id)
+        self.count = hello["seeds"]
+        self.poll_client = CoordinatorClient(address)
+        self.pushed = []
+        self.pushed_rev = 0
+        self.pushed_lock = threading.Lock()
+        self.news = threading.Event()
+        self.polling = False
+
+    def __len__(self):
+        return self.count
+
+    def fetch(self, since, wait=0):
+        response = self.poll_client.request("seeds", since=since, wait=wait)
+        return response["rows"], response["rev"]
+
+    def changes_since(self, rev):
+        """
+        Same contract as CorpusStore.changes_since. The first call fetches
+        directly and starts the long poll; later calls drain pushed rows.
+        """
+        if not self.polling:
+            rows, latest = self.fetch(rev)
+            self.count = max(self.count, len(rows))
+            self.pushed_rev = latest
+            self.polling = True
+            threading.Thread(target=self.long_poll, daemon=True).start()
+            return rows, latest
+        with self.pushed_lock:
+            rows, self.pushed = self.pushed, []
+            self.news.clear()
+            return rows, self.pushed_rev
+
+    def long_poll(self):
+        while True:
+            try:
+                rows, latest = self.fetch(self.pushed_rev, wait=MAX_LONG_POLL)
+            except CoordinatorError as e:
+                print(f"  [!] Seed long poll failed: {e}")
+                time.sleep(CLIENT_RETRY_BACKOFF * 4)
+                continue
+            with self.pushed_lock:
+                self.pushed.extend(rows)
+                self.pushed_rev = latest
+                if rows:
+                    self.news.set()
+
+    def arm_stats(self):
+        return self.client.request("arm_stats")["rows"]
+
+    def claim(self, items):
+        """
+        items: [(command, canonical key bytes or None)] -> [claimed?]
+        """
+        if not items:
+            return []
+        wire = [[digest_key(cmd).hex(), key.hex() if key is not None else None] for cmd, key in items]
+        return self.client.request("claim", items=wire)["claimed"]
+
+    def close(self):
+        self.client.close()
+        self.poll_client.close()
+
+
+class RemoteQueueLog:
+    """
+    Stand-in for QueueLogWriter that sends records to the coordinator's
+    central queue log in batches (at most RESULT_FLUSH_INTERVAL late).
+    """
+    def __init__(self, address, producer_id):
+        self.client = CoordinatorClient(address)
+        self.producer_id = producer_id
+        self.buffer = []
+        self.unsent = None      # (request id, records) of the batch being sent
+        self.lock = threading.Lock()
+        self.closed = threading.Event()
+        self.flusher = threading.Thread(target=self.flush_periodically, daemon=True)
+        self.flusher.start()
+
+    def append(self, record):
+        with self.lock:
+            self.buffer.append(record)
+            full = len(self.buffer) >= RESULT_BATCH
+        if full:
+            self.flush()
+
+    def flush(self):
+        """
+        Sends the buffered records as one batch. A batch that failed is sent
+        again, first and under the same request id, so the coordinator
+        records it once even if only its reply was lost. Returns True if a
+        batch went out.
+        """
+        with self.lock:
+            if self.unsent is None and self.buffer:
+                self.unsent = (uuid.uuid4().hex, self.buffer)
+                self.buffer = []
+            batch = self.unsent
+        if batch is None:
+            return False
+        request_id, records = batch
+        try:
+            self.client.request("results", records=records, producer_id=self.producer_id, request_id=request_id)
+        except CoordinatorError as e:
+            print(f"[ERROR] Could not send {len(records)} results to the coordinator: {e}")
+            return False
+        with self.lock:
+            if self.unsent is batch:
+                self.unsent = None
+        return True
+
+    def flush_periodically(self):
+        while not self.closed.wait(RESULT_FLUSH_INTERVAL):
+            self.flush()
+
+    def close(self):
+        self.closed.set()
+        while self.flush():
+            pass
+        self.client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="PurpleFuzz - Producer fleet coordinator")
+    parser.add_argument("--listen", default=DEFAULT_ADDRESS, help="host:port or unix:/path/to.sock")
+    parser.add_argument("--shards", type=int, default=DEFAULT_SHARDS, help="Dedup store shards (hash-space partitions)")
+    parser.add_argument("-b", "--canon-budget", type=int, default=CANONICAL_BUDGET,
+                        help="Max executions per canonical form across all producers; 0=unlimited")
+    parser.add_argument("--db", default=CORPUS_DB, help="Corpus database file")
+    args = parser.parse_args()
+
+    coordinator = Coordinator(corpus_path=args.db, shards=args.shards, canonical_budget=args.canon_budget)
+    server = serve(coordinator, args.listen)
+    print(f"[+] Coordinator listening on {args.listen} ({len(coordinator.shards)} dedup shards, "
+          f"{len(coordinator.corpus())} seeds)")
+    try:
+        while True:
+            time.sleep(60)
+            stats = coordinator.op_stats({})
+            print(f"  [i] rev {stats['rev']}, {stats['seeds']} seeds, {sum(stats['dedup'])} tested, "
+                  f"{len(stats['producers'])} producers")
+    except KeyboardInterrupt:
+        print("\n[!] Coordinator is stopping...")
+    finally:
+        server.shutdown()
+        coordinator.close()
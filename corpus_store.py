@@ -0,0 +1,513 @@
+import os
+import time
+import sqlite3
+import argparse
+from bisect import bisect_left, bisect_right
+
+from canonicalize import canonical_form, canonical_key
+from scheduler import seed_energy, BANDIT_WINDOW
+
+# --- Corpus Store Defaults ---
+CORPUS_DB = "corpus.db"
+
+# --- Priority Flags ---
+PRIO_1_BYPASS_SUCCESS = 1
+PRIO_2_BYPASS_FAIL = 2
+PRIO_3_DETECTED_OR_ERROR = 3
+
+# --- Corpus Bounds ---
+# Live seeds kept per priority bin (0 = unlimited); seeds from the 'seeds' directory are never evicted
+BIN_CAPS = {PRIO_1_BYPASS_SUCCESS: 10000, PRIO_2_BYPASS_FAIL: 5000, PRIO_3_DETECTED_OR_ERROR: 2000}
+EVICT_SLACK = 0.1                  # Online eviction trims a full bin to this far below its cap
+NEAR_DUPLICATE_DISTANCE = 0.05     # distill: edit distance (relative to length) that counts as a near-duplicate
+
+# Seed filename prefix <-> tag (the 'seeds/' naming convention)
+TAG_PREFIXES = {"powershell": "ps", "cmd": "cmd", "generic": "generic"}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS seeds (
+    id          INTEGER PRIMARY KEY AUTOINCREMENT,
+    cmd         TEXT NOT NULL,
+    tag         TEXT NOT NULL,
+    priority    INTEGER NOT NULL,
+    execs       INTEGER NOT NULL DEFAULT 0,
+    bypasses    INTEGER NOT NULL DEFAULT 0,
+    detections  INTEGER NOT NULL DEFAULT 0,
+    parent_id   INTEGER,
+    source      TEXT,
+    added_at    REAL NOT NULL,
+    rev         INTEGER NOT NULL,
+    canon       BLOB,
+    evicted     INTEGER NOT NULL DEFAULT 0,
+    initial     INTEGER NOT NULL DEFAULT 0,
+    UNIQUE (cmd, tag)
+);
+CREATE INDEX IF NOT EXISTS seeds_rev ON seeds (rev);
+CREATE TABLE IF NOT EXISTS meta (
+    key   TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO meta (key, value) VALUES ('rev', 0);
+CREATE TABLE IF NOT EXISTS mutator_stats (
+    tag         TEXT NOT NULL,
+    arm         TEXT NOT NULL,
+    trials      INTEGER NOT NULL DEFAULT 0,
+    bypasses    INTEGER NOT NULL DEFAULT 0,
+    detections  INTEGER NOT NULL DEFAULT 0,
+    recent_trials    REAL NOT NULL DEFAULT 0,
+    recent_bypasses  REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY (tag, arm)
+);
+"""
+
+# Columns added to 'seeds' after the first release, added to older databases on open
+ADDED_COLUMNS = [
+    ("canon", "BLOB"),                          # canonical_key() of cmd: near-duplicates share it
+    ("evicted", "INTEGER NOT NULL DEFAULT 0"),  # Soft delete: producers drop the seed at its new rev
+    ("initial", "INTEGER NOT NULL DEFAULT 0"),  # Initial seed from the 'seeds' directory: never evicted
+]
+
+# Columns added to 'mutator_stats': counts that decay with every verdict of the tag (see record_arm_results)
+ADDED_ARM_COLUMNS = [
+    ("recent_trials", "REAL NOT NULL DEFAULT 0"),
+    ("recent_bypasses", "REAL NOT NULL DEFAULT 0"),
+]
+
+INDEXES = """
+CREATE INDEX IF NOT EXISTS seeds_canon ON seeds (tag, canon);
+CREATE INDEX IF NOT EXISTS seeds_bin ON seeds (evicted, priority);
+"""
+
+
+def tag_from_filename(filename):
+    name = filename.lower()
+    if name.startswith("ps_") or name.startswith("powershell_"):
+        return "powershell"
+    if name.startswith("cmd_"):
+        return "cmd"
+    return "generic"
+
+
+def edit_distance(a, b, limit):
+    """
+    Levenshtein distance, or limit + 1 as soon as it must exceed 'limit'.
+    """
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != char_b)))
+        if min(current) > limit:
+            return limit + 1
+        previous = current
+    return previous[-1]
+
+
+def priority_from_filename(filename):
+    if "_fuzzed_prio_1" in filename:
+        return PRIO_1_BYPASS_SUCCESS
+    if "_fuzzed_prio_2" in filename:
+        return PRIO_2_BYPASS_FAIL
+    return PRIO_3_DETECTED_OR_ERROR
+
+
+class CorpusStore:
+    """
+    Single SQLite file holding every seed with its tag, priority and stats.
+
+    Every insert or update stamps the row with a new revision number, so a
+    running producer can pick up changes incrementally with changes_since().
+    WAL mode lets the consumer write while producers read.
+    """
+    def __init__(self, path=CORPUS_DB):
+        self.path = path
+        self.conn = sqlite3.connect(path, timeout=30)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        self.migrate()
+        self.conn.executescript(INDEXES)
+        self.conn.commit()
+
+    def migrate(self):
+        columns = {row["name"] for row in self.conn.execute("PRAGMA table_info(seeds)")}
+        for name, definition in ADDED_COLUMNS:
+            if name not in columns:
+                self.conn.execute(f"ALTER TABLE seeds ADD COLUMN {name} {definition}")
+        if "initial" not in columns:
+            # Initial seeds were imported from seed files that are not exported finds
+            with self.conn:
+                self.conn.execute("UPDATE seeds SET initial = 1 WHERE parent_id IS NULL AND source LIKE '%.txt' "
+                                  "AND source NOT LIKE '%\\_fuzzed\\_prio\\_%' ESCAPE '\\'")
+        columns = {row["name"] for row in self.conn.execute("PRAGMA table_info(mutator_stats)")}
+        for name, definition in ADDED_ARM_COLUMNS:
+            if name not in columns:
+                self.conn.execute(f"ALTER TABLE mutator_stats ADD COLUMN {name} {definition}")
+        if "recent_trials" not in columns:
+            # All-time counts, scaled down to one window, as the starting point
+            with self.conn:
+                self.conn.execute("UPDATE mutator_stats SET recent_trials = MIN(trials, ?), "
+                                  "recent_bypasses = bypasses * MIN(trials, ?) * 1.0 / MAX(trials, 1)",
+                                  (BANDIT_WINDOW, BANDIT_WINDOW))
+        missing = self.conn.execute("SELECT id, cmd, tag FROM seeds WHERE canon IS NULL").fetchall()
+        if missing:
+            with self.conn:
+                self.conn.executemany("UPDATE seeds SET canon = ? WHERE id = ?",
+                                      [(canonical_key(row["cmd"], [row["tag"]]), row["id"]) for row in missing])
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM seeds WHERE evicted = 0").fetchone()[0]
+
+    def next_rev(self):
+        # Must run inside a write transaction
+        self.conn.execute("UPDATE meta SET value = value + 1 WHERE key = 'rev'")
+        return self.conn.execute("SELECT value FROM meta WHERE key = 'rev'").fetchone()[0]
+
+    def add_seed(self, cmd, tag, priority, parent_id=None, source=None, initial=False):
+        """
+        Inserts a seed, or raises the priority of an existing identical one.
+        A seed with the same canonical form as a live seed of the same or
+        better priority is not inserted (the corpus keeps one of them).
+        'initial' seeds (from the 'seeds' directory) are never evicted.
+        Returns the seed id (of the kept seed).
+        """
+        return self.add_seeds([(cmd, tag, priority, parent_id, source, initial)])[0]
+
+    def add_seeds(self, seeds):
+        """
+        Batch version of add_seed for (cmd, tag, priority, parent_id, source, initial) tuples.
+        """
+        ids = []
+        with self.conn:
+            self.conn.execute("BEGIN IMMEDIATE")
+            rev = self.next_rev()
+            now = time.time()
+            for cmd, tag, priority, parent_id, source, initial in seeds:
+                row = self.conn.execute(
+                    "SELECT id, priority FROM seeds WHERE cmd = ? AND tag = ?", (cmd, tag)
+                ).fetchone()
+                if row is not None:
+                    if initial:
+                        self.conn.execute("UPDATE seeds SET initial = 1 WHERE id = ?", (row["id"],))
+                    if priority < row["priority"]:
+                        # A better verdict also brings an evicted seed back
+                        self.conn.execute("UPDATE seeds SET priority = ?, evicted = 0, rev = ? WHERE id = ?",
+                                          (priority, rev, row["id"]))
+                    ids.append(row["id"])
+                    continue
+                canon = canonical_key(cmd, [tag])
+                twin = self.conn.execute(
+                    "SELECT id FROM seeds WHERE tag = ? AND canon = ? AND evicted = 0 AND priority <= ? "
+                    "ORDER BY priority LIMIT 1", (tag, canon, priority)
+                ).fetchone()
+                if twin is not None:
+                    ids.append(twin["id"])
+                    continue
+                cursor = self.conn.execute(
+                    "INSERT INTO seeds (cmd, tag, priority, parent_id, source, added_at, rev, canon, initial) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (cmd, tag, priority, parent_id, source, now, rev, canon, int(bool(initial)))
+                )
+                ids.append(cursor.lastrowid)
+        return ids
+
+    def record_results(self, results):
+        """
+        Adds execution feedback for parent seeds: (seed_id, bypassed, detected)
+        tuples, one per verdict. Touched seeds get a new revision so producers
+        re-weight them.
+        """
+        totals = {}
+        for seed_id, bypassed, detected in results:
+            if seed_id is None:
+                continue
+            execs, bypasses, detections = totals.get(seed_id, (0, 0, 0))
+            totals[seed_id] = (execs + 1, bypasses + int(bool(bypassed)), detections + int(bool(detected)))
+        if not totals:
+            return 0
+        with self.conn:
+            self.conn.execute("BEGIN IMMEDIATE")
+            rev = self.next_rev()
+            self.conn.executemany(
+                "UPDATE seeds SET execs = execs + ?, bypasses = bypasses + ?, detections = detections + ?, rev = ? "
+                "WHERE id = ?",
+                [(execs, bypasses, detections, rev, seed_id) for seed_id, (execs, bypasses, detections) in totals.items()]
+            )
+        return len(totals)
+
+    def record_arm_results(self, results):
+        """
+        Adds verdicts to the mutator bandit arms: (tag, arms, bypassed,
+        detected) tuples, where 'arms' are the arm names credited with
+        the verdict (mutators of the chain and its depth).
+
+        Besides the all-time counts, every arm of a tag keeps recent_trials
+        and recent_bypasses, which shrink by (1 - 1/BANDIT_WINDOW) per
+        verdict of that tag, whether the arm was used or not. The bandit
+        draws from these, so it follows rule changes within about
+        BANDIT_WINDOW verdicts and arms it stopped picking get explored again.
+        """
+        totals = {}
+        verdicts = {}
+        for tag, arms, bypassed, detected in results:
+            verdicts[tag] = verdicts.get(tag, 0) + 1
+            for arm in set(arms):
+                trials, bypasses, detections = totals.get((tag, arm), (0, 0, 0))
+                totals[(tag, arm)] = (trials + 1, bypasses + int(bool(bypassed)), detections + int(bool(detected)))
+        if not totals:
+            return 0
+        with self.conn:
+            self.conn.executemany(
+                "UPDATE mutator_stats SET recent_trials = recent_trials * ?, recent_bypasses = recent_bypasses * ? "
+                "WHERE tag = ?",
+                [((1 - 1 / BANDIT_WINDOW) ** n,) * 2 + (tag,) for tag, n in verdicts.items()]
+            )
+            self.conn.executemany(
+                "INSERT INTO mutator_stats (tag, arm, trials, bypasses, detections, recent_trials, recent_bypasses) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (tag, arm) DO UPDATE SET trials = trials + excluded.trials, "
+                "bypasses = bypasses + excluded.bypasses, detections = detections + excluded.detections, "
+                "recent_trials = recent_trials + excluded.recent_trials, "
+                "recent_bypasses = recent_bypasses + excluded.recent_bypasses",
+                [(tag, arm, trials, bypasses, detections, trials, bypasses)
+                 for (tag, arm), (trials, bypasses, detections) in totals.items()]
+            )
+        return len(totals)
+
+    def arm_stats(self):
+        return self.conn.execute("SELECT * FROM mutator_stats ORDER BY tag, arm").fetchall()
+
+    def current_rev(self):
+        return self.conn.execute("SELECT value FROM meta WHERE key = 'rev'").fetchone()[0]
+
+    def changes_since(self, rev):
+        """
+        Returns (rows inserted or updated after 'rev', latest rev). Evicted
+        rows are included (evicted = 1) so readers can drop them, except on
+        a full load from rev 0.
+        """
+        latest = self.current_rev()
+        live_only = "AND evicted = 0 " if rev == 0 else ""
+        rows = self.conn.execute(
+            f"SELECT * FROM seeds WHERE rev > ? AND rev <= ? {live_only}ORDER BY id", (rev, latest)
+        ).fetchall()
+        return rows, latest
+
+    def get(self, seed_id):
+        """
+        One seed row by id, evicted or not (None if unknown).
+        """
+        return self.conn.execute("SELECT * FROM seeds WHERE id = ?", (seed_id,)).fetchone()
+
+    def find(self, cmd, tag=None):
+        """
+        The seed row with this exact command (and tag), best priority first.
+        """
+        if tag is None:
+            return self.conn.execute("SELECT * FROM seeds WHERE cmd = ? ORDER BY priority, id LIMIT 1", (cmd,)).fetchone()
+        return self.conn.execute("SELECT * FROM seeds WHERE cmd = ? AND tag = ?", (cmd, tag)).fetchone()
+
+    def seeds(self, priority=None):
+        if priority is None:
+            return self.conn.execute("SELECT * FROM seeds WHERE evicted = 0 ORDER BY id").fetchall()
+        return self.conn.execute("SELECT * FROM seeds WHERE evicted = 0 AND priority = ? ORDER BY id",
+                                 (priority,)).fetchall()
+
+    def stats(self):
+        return self.conn.execute(
+            "SELECT tag, priority, SUM(evicted = 0) AS n, SUM(evicted) AS evicted, "
+            "SUM(execs) AS execs, SUM(bypasses) AS bypasses "
+            "FROM seeds GROUP BY tag, priority ORDER BY tag, priority"
+        ).fetchall()
+
+    # --- Eviction and distillation ---
+
+    def evict(self, seed_ids):
+        """
+        Soft-deletes seeds with a new revision, so running producers drop them.
+        """
+        seed_ids = list(seed_ids)
+        if not seed_ids:
+            return 0
+        with self.conn:
+            self.conn.execute("BEGIN IMMEDIATE")
+            rev = self.next_rev()
+            self.conn.executemany("UPDATE seeds SET evicted = 1, rev = ? WHERE id = ? AND evicted = 0",
+                                  [(rev, seed_id) for seed_id in seed_ids])
+        return len(seed_ids)
+
+    def evictable(self, priority, now):
+        """
+        Live seeds of a bin that may be evicted (not initial ones), least
+        productive first.
+        """
+        rows = self.conn.execute(
+            "SELECT id, execs, bypasses, added_at FROM seeds "
+            "WHERE evicted = 0 AND priority = ? AND initial = 0", (priority,)
+        ).fetchall()
+        return sorted(rows, key=lambda row: (seed_energy(dict(row), now), row["bypasses"], row["id"]))
+
+    def enforce_caps(self, caps=BIN_CAPS, now=None):
+        """
+        Online eviction: a bin over its cap is trimmed to EVICT_SLACK below
+        it, dropping the seeds with the lowest energy. Returns seeds evicted.
+        """
+        now = now if now is not None else time.time()
+        victims = []
+        for priority, cap in caps.items():
+            if not cap:
+                continue
+            live = self.conn.execute("SELECT COUNT(*) FROM seeds WHERE evicted = 0 AND priority = ?",
+                                     (priority,)).fetchone()[0]
+            if live <= cap:
+                continue
+            excess = live - int(cap * (1 - EVICT_SLACK))
+            victims += [row["id"] for row in self.evictable(priority, now)[:excess]]
+        return self.evict(victims)
+
+    def distill(self, caps=BIN_CAPS, max_distance=NEAR_DUPLICATE_DISTANCE, now=None, dry_run=False):
+        """
+        Corpus minimization. Within each tag and priority bin, best seeds
+        first (energy, then bypasses), a seed is evicted if it has the
+        canonical form of a kept seed or is within 'max_distance' (edit
+        distance relative to length) of one; then bins over their cap lose
+        their lowest-energy seeds. Seeds from the 'seeds' directory are
+        always kept. Returns {reason: evicted count}.
+        """
+        now = now if now is not None else time.time()
+        rows = self.conn.execute("SELECT * FROM seeds WHERE evicted = 0").fetchall()
+        rows.sort(key=lambda row: (row["priority"], not row["initial"],
+                                   -seed_energy(dict(row), now), -row["bypasses"], row["id"]))
+        kept_canon = set()
+        kept_forms = {}     # (tag, priority, first word) -> sorted [(length, form)]
+        kept = {}           # priority -> evictable kept ids, best first
+        victims = {"canonical": [], "near-duplicate": [], "cap": []}
+        for row in rows:
+            bin_key = (row["tag"], row["priority"])
+            if (bin_key, row["canon"]) in kept_canon and not row["initial"]:
+                victims["canonical"].append(row["id"])
+                continue
+            form = canonical_form(row["cmd"], [row["tag"]])
+            bucket = kept_forms.setdefault(bin_key + (form.split(" ", 1)[0],), [])
+            if not row["initial"] and max_distance > 0:
+                limit = int(max_distance * len(form))
+                lengths = [length for length, _ in bucket]
+                nearby = bucket[bisect_left(lengths, len(form) - limit):bisect_right(lengths, len(form) + limit)]
+                if any(edit_distance(form, other, limit) <= limit for _, other in nearby):
+                    victims["near-duplicate"].append(row["id"])
+                    continue
+            kept_canon.add((bin_key, row["canon"]))
+            bucket.insert(bisect_left(bucket, (len(form), form)), (len(form), form))
+            if not row["initial"]:
+                kept.setdefault(row["priority"], []).append(row["id"])
+
+        for priority, cap in caps.items():
+            protected = self.conn.execute(
+                "SELECT COUNT(*) FROM seeds WHERE evicted = 0 AND priority = ? AND initial = 1", (priority,)
+            ).fetchone()[0]
+            ids = kept.get(priority, [])
+            if cap and protected + len(ids) > cap:
+                victims["cap"] += ids[max(0, cap - protected):]
+
+        if not dry_run:
+            self.evict(seed_id for ids in victims.values() for seed_id in ids)
+        return {reason: len(ids) for reason, ids in victims.items()}
+
+    # --- seeds/ directory compatibility ---
+
+    def import_dir(self, seed_dir):
+        """
+        Imports '<prefix>_*.txt' seed files ('ps_', 'cmd_', '*_fuzzed_prio_N').
+        """
+        batch = []
+        for filename in sorted(os.listdir(seed_dir)):
+            if not filename.endswith(".txt"):
+                continue
+            try:
+                with open(os.path.join(seed_dir, filename), 'r', encoding='utf-8') as f:
+                    command = f.read().strip()
+            except Exception as e:
+                print(f"  [!] Error reading file {filename}: {e}")
+                continue
+            if command:
+                # Exported finds ('*_fuzzed_prio_N') can be evicted again like any other find
+                initial = "_fuzzed_prio_" not in filename
+                batch.append((command, tag_from_filename(filename), priority_from_filename(filename), None, filename,
+                              initial))
+        if batch:
+            self.add_seeds(batch)
+        return len(batch)
+
+    def export_dir(self, out_dir, priority=None):
+        """
+        Writes seeds back out as one file each, named so that import_dir
+        (and the old directory loader) recover tag and priority.
+        """
+        os.makedirs(out_dir, exist_ok=True)
+        count = 0
+        for row in self.seeds(priority):
+            source = row["source"] or ""
+            if source.endswith(".txt") and tag_from_filename(source) == row["tag"] \
+                    and priority_from_filename(source) == row["priority"]:
+                filename = source
+            else:
+                prefix = TAG_PREFIXES.get(row["tag"], "generic")
+                if source or row["parent_id"] is not None:
+                    # Produced by the fuzzer (source is the correlation ID)
+                    filename = f"{prefix}_fuzzed_prio_{row['priority']}__{row['id']}.txt"
+                else:
+                    filename = f"{prefix}_seed__{row['id']}.txt"
+            with open(os.path.join(out_dir, filename), 'w', encoding='utf-8') as f:
+                f.write(row["cmd"])
+            count += 1
+        return count
+
+    def close(self):
+        self.conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="PurpleFuzz - Corpus store maintenance")
+    parser.add_argument("--db", default=CORPUS_DB, help="Corpus database file")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_import = sub.add_parser("import", help="Import seed files from a directory")
+    p_import.add_argument("directory", nargs="?", default="seeds")
+
+    p_export = sub.add_parser("export", help="Export seeds as files into a directory")
+    p_export.add_argument("directory")
+    p_export.add_argument("--prio", type=int, choices=[1, 2, 3], help="Only export this priority")
+
+    sub.add_parser("stats", help="Show seed counts per tag and priority, and mutator arm stats")
+
+    p_distill = sub.add_parser("distill", help="Evict near-duplicate and unproductive seeds down to the bin caps")
+    p_distill.add_argument("--caps", type=int, nargs=3, metavar=("PRIO1", "PRIO2", "PRIO3"),
+                           default=[BIN_CAPS[p] for p in sorted(BIN_CAPS)], help="Max live seeds per priority bin (0=unlimited)")
+    p_distill.add_argument("--distance", type=float, default=NEAR_DUPLICATE_DISTANCE,
+                           help="Relative edit distance below which seeds collapse (0=canonical form only)")
+    p_distill.add_argument("--dry-run", action="store_true", help="Only report what would be evicted")
+    args = parser.parse_args()
+
+    store = CorpusStore(args.db)
+    if args.command == "import":
+        print(f"Imported {store.import_dir(args.directory)} seed files from {args.directory}/ ({len(store)} seeds in store)")
+    elif args.command == "export":
+        print(f"Exported {store.export_dir(args.directory, args.prio)} seeds to {args.directory}/")
+    elif args.command == "stats":
+        for row in store.stats():
+            print(f"  {row['tag']:<11} prio {row['priority']}: {row['n']:>8} seeds ({row['evicted']} evicted), "
+                  f"{row['execs'] or 0} execs, {row['bypasses'] or 0} bypasses")
+        for row in store.arm_stats():
+            print(f"  {row['tag']:<11} {row['arm']:<28} {row['trials']:>8} trials, {row['bypasses']} bypasses, {row['detections']} detections, "
+                  f"recent {row['recent_bypasses']:.0f}/{row['recent_trials']:.0f}")
+    elif args.command == "distill":
+        before = len(store)
+        evicted = store.distill(caps=dict(zip(sorted(BIN_CAPS), args.caps)), max_distance=args.distance,
+                                dry_run=args.dry_run)
+        verb = "Would evict" if args.dry_run else "Evicted"
+        print(f"{verb} {sum(evicted.values())} of {before} seeds "
+              f"({', '.join(f'{n} {reason}' for reason, n in evicted.items())})")
+    store.close()
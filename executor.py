@@ -0,0 +1,458 @@
+import os
+import sys
+import time
+import queue
+import shutil
+import signal
+import itertools
+import selectors
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import psutil
+except ImportError:  # psutil is optional; without it only wall time is recorded where os.wait4 is missing
+    psutil = None
+
+# --- Execution Defaults ---
+DEFAULT_WORKERS = 1
+DEFAULT_TIMEOUT = 10
+OUTPUT_CAP = 2048               # Bytes of stdout/stderr kept per stream (the tail); 0 = keep everything
+READ_CHUNK = 65536
+KILL_GRACE = 5                  # Seconds to collect a killed process tree's output and exit status
+WORKDIR_SPARES = 64             # Empty run directories created ahead of time
+WORKDIR_CLEANUP_RETRIES = 3     # Attempts to remove a run directory before giving up on it
+
+
+class RunResult:
+    """
+    Outcome of a single command execution.
+    """
+    def __init__(self, returncode, stdout="", stderr="", timed_out=False, error=None, output_bytes=None, usage=None):
+        self.returncode = returncode
+        self.stdout = stdout
+        self.stderr = stderr
+        self.timed_out = timed_out
+        self.error = error
+        self.output_bytes = output_bytes  # [stdout, stderr] bytes written, including what the cap dropped
+        self.usage = usage                # wall, cpu (seconds) and max_rss_kb, where measurable
+
+    @property
+    def success(self):
+        return self.returncode == 0 and not self.timed_out and self.error is None
+
+
+def kill_process_tree(proc):
+    """
+    Kills a shell process started by run_command together with everything it spawned.
+    """
+    try:
+        if os.name == "nt":
+            subprocess.run(
+                ["taskkill", "/F", "/T", "/PID", str(proc.pid)],
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL
+            )
+        else:
+            os.killpg(proc.pid, signal.SIGKILL)
+    except Exception:
+        pass
+    try:
+        proc.kill()
+    except Exception:
+        pass
+
+
+def run_details(result):
+    """
+    Per-run fields stored with the queue record for triage: exit status,
+    the capped output and how much was written, and resource usage.
+    """
+    return {
+        "returncode": result.returncode,
+        "timed_out": result.timed_out,
+        "error": str(result.error) if result.error is not None else None,
+        "stdout": result.stdout,
+        "stderr": result.stderr,
+        "output_bytes": result.output_bytes,
+        "usage": result.usage,
+    }
+
+
+class RingBuffer:
+    """
+    Keeps the last 'capacity' bytes written to it (everything if capacity
+    is 0); 'total' counts every byte.
+    """
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.buffer = bytearray(capacity)
+        self.position = 0
+        self.full = False
+        self.total = 0
+
+    def write(self, chunk):
+        self.total += len(chunk)
+        if not self.capacity:
+            self.buffer += chunk
+            return
+        if len(chunk) >= self.capacity:
+            self.buffer[:] = chunk[-self.capacity:]
+            self.position, self.full = 0, True
+            return
+        end = self.position + len(chunk)
+        if end <= self.capacity:
+            self.buffer[self.position:end] = chunk
+        else:
+            split = self.capacity - self.position
+            self.buffer[self.position:] = chunk[:split]
+            self.buffer[:end - self.capacity] = chunk[split:]
+        self.full = self.full or end >= self.capacity
+        self.position = end % self.capacity
+
+    def getvalue(self):
+        if not self.capacity:
+            return bytes(self.buffer)
+        if not self.full:
+            return bytes(self.buffer[:self.position])
+        return bytes(self.buffer[self.position:] + self.buffer[:self.position])
+
+    def text(self):
+        return self.getvalue().decode("utf-8", errors="replace")
+
+
+def stream_output(proc, buffers, deadline, sample=None):
+    """
+    Reads the process's stdout and stderr into 'buffers' until both reach
+    EOF. Returns False if 'deadline' (time.monotonic()) passes first.
+    """
+    if os.name == "nt":
+        # No select() on pipes: one reader thread per stream
+        readers = [threading.Thread(target=drain_pipe, args=(stream, buffer), daemon=True)
+                   for stream, buffer in zip((proc.stdout, proc.stderr), buffers)]
+        for reader in readers:
+            reader.start()
+        for reader in readers:
+            while reader.is_alive():
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                reader.join(min(remaining, 0.05))
+                if sample is not None:
+                    sample()
+        return True
+
+    with selectors.DefaultSelector() as selector:
+        for stream, buffer in zip((proc.stdout, proc.stderr), buffers):
+            selector.register(stream, selectors.EVENT_READ, buffer)
+        while selector.get_map():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            for key, _ in selector.select(remaining):
+                chunk = os.read(key.fd, READ_CHUNK)
+                if chunk:
+                    key.data.write(chunk)
+                else:
+                    selector.unregister(key.fileobj)
+    return True
+
+
+def drain_pipe(stream, buffer):
+    try:
+        while True:
+            chunk = os.read(stream.fileno(), READ_CHUNK)
+            if not chunk:
+                return
+            buffer.write(chunk)
+    except (OSError, ValueError):
+        pass
+
+
+def reap(proc, deadline):
+    """
+    Waits for the shell to exit and returns its resource usage (os.wait4;
+    covers the children it waited for), or None where that is unavailable.
+    """
+    if not hasattr(os, "wait4"):
+        try:
+            proc.wait(timeout=max(0.0, deadline - time.monotonic()))
+        except subprocess.TimeoutExpired:
+            pass
+        return None
+    delay = 0.0005
+    while True:
+        try:
+            pid, status, rusage = os.wait4(proc.pid, os.WNOHANG)
+        except ChildProcessError:
+            proc.poll()
+            return None
+        if pid:
+            proc.returncode = os.waitstatus_to_exitcode(status)
+            return rusage
+        if time.monotonic() >= deadline:
+            return None
+        time.sleep(delay)
+        delay = min(delay * 2, 0.05)
+
+
+class UsageSampler:
+    """
+    psutil fallback for platforms without os.wait4: the last CPU times and
+    the peak memory seen while the command ran.
+    """
+    def __init__(self, pid):
+        self.cpu = None
+        self.max_rss_kb = None
+        try:
+            self.process = psutil.Process(pid)
+        except Exception:
+            self.process = None
+
+    def sample(self):
+        if self.process is None:
+            return
+        try:
+            with self.process.oneshot():
+                times = self.process.cpu_times()
+                memory = self.process.memory_info()
+        except Exception:
+            return
+        self.cpu = times.user + times.system
+        rss = getattr(memory, "peak_wset", memory.rss) // 1024
+        self.max_rss_kb = max(self.max_rss_kb or 0, rss)
+
+
+def resource_usage(wall, rusage, sampler):
+    usage = {"wall": round(wall, 4)}
+    if rusage is not None:
+        usage["cpu"] = round(rusage.ru_utime + rusage.ru_stime, 4)
+        # ru_maxrss is in kilobytes on Linux, in bytes on macOS. It also covers the child
+        # before exec, so it never reads below the forking process's own footprint.
+        usage["max_rss_kb"] = rusage.ru_maxrss // 1024 if sys.platform == "darwin" else rusage.ru_maxrss
+    elif sampler is not None and sampler.cpu is not None:
+        usage["cpu"] = round(sampler.cpu, 4)
+        usage["max_rss_kb"] = sampler.max_rss_kb
+    return usage
+
+
+def run_command(command_string, cwd=None, timeout=DEFAULT_TIMEOUT, output_cap=OUTPUT_CAP):
+    """
+    Runs a command through the shell in its own process group so that a
+    timeout kills the whole tree, not only the top-level shell. Output is
+    streamed into ring buffers that keep the last 'output_cap' bytes of
+    each stream, so a chatty command costs no memory.
+    """
+    popen_kwargs = {}
+    if os.name == "nt":
+        popen_kwargs["creationflags"] = subprocess.CREATE_NEW_PROCESS_GROUP
+    else:
+        popen_kwargs["start_new_session"] = True
+
+    started = time.monotonic()
+    try:
+        proc = subprocess.Popen(
+            command_string,
+            shell=True,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            cwd=cwd,
+            **popen_kwargs
+        )
+    except Exception as e:
+        return RunResult(None, error=e)
+
+    buffers = (RingBuffer(output_cap), RingBuffer(output_cap))
+    sampler = UsageSampler(proc.pid) if psutil is not None and not hasattr(os, "wait4") else None
+    timed_out = False
+    error = None
+    try:
+        finished = stream_output(proc, buffers, started + timeout, sampler.sample if sampler else None)
+        if finished:
+            rusage = reap(proc, started + timeout)
+            finished = proc.returncode is not None
+        if not finished:
+            timed_out = True
+            kill_process_tree(proc)
+            if os.name != "nt":
+                # (The reader threads of the Windows path are still running and finish on their own)
+                stream_output(proc, buffers, time.monotonic() + KILL_GRACE)
+            rusage = reap(proc, time.monotonic() + KILL_GRACE)
+    except Exception as e:
+        kill_process_tree(proc)
+        rusage = None
+        error = e
+    finally:
+        for stream in (proc.stdout, proc.stderr):
+            stream.close()
+
+    return RunResult(proc.returncode, buffers[0].text(), buffers[1].text(), timed_out=timed_out, error=error,
+                     output_bytes=[buffers[0].total, buffers[1].total],
+                     usage=resource_usage(time.monotonic() - started, rusage, sampler))
+
+
+class OrderedWriter:
+    """
+    Commits results in submission order, no matter in which order the
+    workers finish. Each sequence number is handed out by next_seq() and
+    must be committed exactly once (pass None to skip it).
+    """
+    def __init__(self, write_fn):
+        self.write_fn = write_fn
+        self.lock = threading.Lock()
+        self.next_to_write = 0
+        self.next_to_assign = 0
+        self.pending = {}
+
+    def next_seq(self):
+        with self.lock:
+            seq = self.next_to_assign
+            self.next_to_assign += 1
+            return seq
+
+    def commit(self, seq, item):
+        with self.lock:
+            self.pending[seq] = item
+            while self.next_to_write in self.pending:
+                ready = self.pending.pop(self.next_to_write)
+                self.next_to_write += 1
+                if ready is not None:
+                    self.write_fn(ready)
+
+
+class ExecutionEngine:
+    """
+    Bounded worker pool that keeps up to 'workers' commands in flight.
+    submit() blocks while every worker is busy, so the caller never
+    generates more candidates than can be executed.
+
+    With an 'interpreter_pool' (see interp_pool.InterpreterPool) commands
+    of the tags it handles run in long-lived interpreters instead of a
+    fresh shell each. Results carry at most 'output_cap' bytes per stream
+    (the pool's own cap for pooled runs).
+    """
+    def __init__(self, workers=DEFAULT_WORKERS, timeout=DEFAULT_TIMEOUT, interpreter_pool=None, output_cap=OUTPUT_CAP):
+        self.workers = max(1, workers)
+        self.timeout = timeout
+        self.interpreter_pool = interpreter_pool
+        self.output_cap = output_cap
+        self.slots = threading.BoundedSemaphore(self.workers)
+        self.pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="exec")
+
+    def submit(self, fn, *args, **kwargs):
+        self.slots.acquire()
+        try:
+            future = self.pool.submit(fn, *args, **kwargs)
+        except Exception:
+            self.slots.release()
+            raise
+        future.add_done_callback(lambda _: self.slots.release())
+        return future
+
+    def run(self, command_string, cwd=None, tag="generic"):
+        if self.interpreter_pool is None or not self.interpreter_pool.handles(tag):
+            return run_command(command_string, cwd=cwd, timeout=self.timeout, output_cap=self.output_cap)
+        started = time.monotonic()
+        # The pool keeps the tail of each stream itself (its output_cap)
+        result = self.interpreter_pool.run(command_string, cwd, tag)
+        # Runs inside a shared interpreter: only wall time is attributable to the command
+        result.usage = {"wall": round(time.monotonic() - started, 4)}
+        return result
+
+    def shutdown(self, wait=True):
+        self.pool.shutdown(wait=wait, cancel_futures=not wait)
+        if self.interpreter_pool is not None:
+            self.interpreter_pool.close()
+
+
+class WorkdirPool:
+    """
+    Per-run working directories under 'root', named by correlation ID.
+    Empty directories are created ahead of time by a background thread;
+    acquire() only renames one to the correlation ID. release() hands the
+    directory back to that thread, which removes it together with anything
+    the command left in it and tops the spares up again.
+    """
+    def __init__(self, root, spares=WORKDIR_SPARES):
+        self.root = os.path.abspath(root)
+        # Per process, so pools of concurrent tools sharing 'root' never take each other's spares
+        self.spare_dir = os.path.join(self.root, f".spare-{os.getpid()}")
+        os.makedirs(self.spare_dir, exist_ok=True)
+        self.target = spares
+        self.spares = queue.Queue()
+        self.released = queue.Queue()
+        self.names = itertools.count()
+        self.failed = 0
+        self.fill()
+        self.cleaner = threading.Thread(target=self.clean_loop, daemon=True, name="workdir-cleaner")
+        self.cleaner.start()
+
+    def fill(self):
+        while self.spares.qsize() < self.target:
+            path = os.path.join(self.spare_dir, str(next(self.names)))
+            os.mkdir(path)
+            self.spares.put(path)
+
+    def acquire(self, correlation_id):
+        path = os.path.join(self.root, correlation_id)
+        try:
+            os.rename(self.spares.get_nowait(), path)
+        except (queue.Empty, OSError):
+            os.makedirs(path, exist_ok=True)
+        return path
+
+    def release(self, path):
+        self.released.put((path, 0))
+
+    def take_released(self, timeout):
+        items = []
+        try:
+            items.append(self.released.get(timeout=timeout))
+            while True:
+                items.append(self.released.get_nowait())
+        except queue.Empty:
+            pass
+        return items
+
+    @staticmethod
+    def remove(path):
+        try:
+            os.rmdir(path)  # Usually empty
+        except FileNotFoundError:
+            pass
+        except OSError:
+            shutil.rmtree(path, ignore_errors=True)
+        return not os.path.exists(path)
+
+    def clean_loop(self):
+        retry = []
+        while True:
+            items = self.take_released(1.0 if retry else None)
+            closing = None in items
+            leftover = []
+            for path, attempts in retry + [item for item in items if item is not None]:
+                if self.remove(path):
+                    continue
+                if attempts + 1 < WORKDIR_CLEANUP_RETRIES and not closing:
+                    # e.g. a file still held open by a process the command left behind
+                    leftover.append((path, attempts + 1))
+                else:
+                    self.failed += 1
+                    print(f"[WARN] Could not remove temp dir: {path}")
+            retry = leftover
+            if closing:
+                shutil.rmtree(self.spare_dir, ignore_errors=True)
+                return
+            try:
+                self.fill()
+            except OSError as e:
+                print(f"[WARN] Could not create spare temp dirs: {e}")
+
+    def close(self):
+        """
+        Removes the directories still queued and the unused spares.
+        """
+        self.released.put(None)
+        self.cleaner.join(timeout=30)
@@ -0,0 +1,331 @@
+"""
+Local stand-in for the Elasticsearch search API, for measuring the consumer
+without a live cluster. It implements the subset PurpleFuzz uses:
+
+  HEAD/GET /                      ping / cluster info
+  POST /<index>/_doc              index an alert document
+  POST [/<index>]/_search         bool/terms/term/prefix/match_phrase/range/exists/match_all,
+                                  sort + search_after, point in time
+  POST [/<index>]/_msearch        NDJSON multi-search
+  POST /<index>/_pit, DELETE /_pit
+
+With --rule/--rules it also acts as the sensor: it tails the producer's queue
+log (and any other --queue-dir, e.g. verify_log) and indexes an alert for
+every command matching a rule, after a configurable ingestion lag.
+--latency-ms and --reject-rate inject slowness and 429 rejections so retries
+and parallelism can be exercised.
+
+    python fake_siem.py --port 9200 --rule "vssadmin.*delete" --ingest-lag 5
+"""
+import re
+import json
+import time
+import uuid
+import random
+import argparse
+import threading
+from datetime import datetime, timezone
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+from queue_log import QueueLogReader
+from siem_query import get_field, iter_strings
+
+ALERT_INDEX = ".internal.alerts-security.alerts-default-000001"
+
+
+def utc_iso(ts=None):
+    ts = time.time() if ts is None else ts
+    return datetime.fromtimestamp(ts, timezone.utc).isoformat(timespec="milliseconds").replace("+00:00", "Z")
+
+
+def field_values(source, field):
+    value = get_field(source, field)
+    if value is None:
+        return []
+    return value if isinstance(value, list) else [value]
+
+
+class FakeSiem:
+    """
+    In-memory document store plus the query evaluator.
+    """
+    def __init__(self, latency=0.0, reject_rate=0.0):
+        self.docs = []
+        self.lock = threading.Lock()
+        self.latency = latency
+        self.reject_rate = reject_rate
+        self.stats = {"search": 0, "msearch": 0, "rejected": 0, "indexed": 0}
+
+    def index(self, source, visible_at=None):
+        with self.lock:
+            self.docs.append({
+                "_id": uuid.uuid4().hex,
+                "_seq": len(self.docs),
+                "_source": source,
+                "_visible_at": visible_at or 0,
+            })
+            self.stats["indexed"] += 1
+
+    # --- Query evaluation ---
+
+    def matches(self, query, source):
+        if not query or "match_all" in query:
+            return True
+        if "bool" in query:
+            clause = query["bool"]
+            for sub in clause.get("must", []) + clause.get("filter", []):
+                if not self.matches(sub, source):
+                    return False
+            for sub in clause.get("must_not", []):
+                if self.matches(sub, source):
+                    return False
+            should = clause.get("should", [])
+            if should:
+                needed = clause.get("minimum_should_match", 0 if clause.get("must") or clause.get("filter") else 1)
+                if sum(1 for sub in should if self.matches(sub, source)) < needed:
+                    return False
+            return True
+        if "terms" in query:
+            field, values = next(iter(query["terms"].items()))
+            wanted = set(values)
+            return any(v in wanted for v in field_values(source, field))
+        if "term" in query:
+            field, value = next(iter(query["term"].items()))
+            if isinstance(value, dict):
+                value = value.get("value")
+            return value in field_values(source, field)
+        if "prefix" in query:
+            field, value = next(iter(query["prefix"].items()))
+            if isinstance(value, dict):
+                value = value.get("value")
+            return any(isinstance(v, str) and v.startswith(value) for v in field_values(source, field))
+        if "match_phrase" in query:
+            field, phrase = next(iter(query["match_phrase"].items()))
+            if isinstance(phrase, dict):
+                phrase = phrase.get("query", "")
+            phrase = str(phrase).lower()
+            return any(phrase in text.lower() for v in field_values(source, field) for text in iter_strings(v))
+        if "exists" in query:
+            return bool(field_values(source, query["exists"]["field"]))
+        if "range" in query:
+            field, bounds = next(iter(query["range"].items()))
+            for value in field_values(source, field):
+                if "gte" in bounds and not value >= bounds["gte"]:
+                    continue
+                if "gt" in bounds and not value > bounds["gt"]:
+                    continue
+                if "lte" in bounds and not value <= bounds["lte"]:
+                    continue
+                if "lt" in bounds and not value < bounds["lt"]:
+                    continue
+                return True
+            return False
+        raise ValueError(f"unsupported query: {list(query)}")
+
+    def sort_key(self, doc, sort_spec):
+        key = []
+        for spec in sort_spec:
+            field = spec if isinstance(spec, str) else next(iter(spec))
+            if field in ("_shard_doc", "_doc"):
+                key.append(doc["_seq"])
+            else:
+                values = field_values(doc["_source"], field)
+                key.append(values[0] if values else "")
+        return key
+
+    def search(self, body):
+        self.stats["search"] += 1
+        if self.reject_rate and random.random() < self.reject_rate:
+            self.stats["rejected"] += 1
+            return 429, {"error": {"type": "es_rejected_execution_exception", "reason": "fake rejection"}, "status": 429}
+
+        now = time.time()
+        with self.lock:
+            docs = [d for d in self.docs if d["_visible_at"] <= now]
+        try:
+            hits = [d for d in docs if self.matches(body.get("query"), d["_source"])]
+        except ValueError as e:
+            return 400, {"error": {"type": "parsing_exception", "reason": str(e)}, "status": 400}
+
+        sort_spec = body.get("sort") or [{"_doc": "asc"}]
+        hits.sort(key=lambda d: self.sort_key(d, sort_spec))
+        if "search_after" in body:
+            after = body["search_after"]
+            hits = [d for d in hits if self.sort_key(d, sort_spec) > after]
+        hits = hits[:body.get("size", 10)]
+
+        includes = body.get("_source")
+        out = []
+        for d in hits:
+            source = d["_source"]
+            if isinstance(includes, list):
+                source = {f: get_field(source, f) for f in includes if get_field(source, f) is not None}
+            out.append({"_index": ALERT_INDEX, "_id": d["_id"], "_source": source, "sort": self.sort_key(d, sort_spec)})
+
+        response = {"took": 1, "timed_out": False, "hits": {"hits": out}}
+        if "pit" in body:
+            response["pit_id"] = body["pit"]["id"]
+        return 200, response
+
+
+class Sensor(threading.Thread):
+    """
+    Tails the producer's queue log (without committing an offset) and raises
+    an alert for each command that matches one of the rules.
+    """
+    def __init__(self, siem, queue_dir, rules, ingest_lag=0.0, ingest_jitter=0.0):
+        super().__init__(daemon=True)
+        self.siem = siem
+        self.reader = QueueLogReader(queue_dir, name="fake_siem")
+        self.position = self.reader.committed
+        self.rules = rules
+        self.ingest_lag = ingest_lag
+        self.ingest_jitter = ingest_jitter
+
+    def run(self):
+        while True:
+            batch = self.reader.read_batch(1000, start=self.position)
+            if not batch:
+                time.sleep(0.2)
+                continue
+            for record, offset in batch:
+                self.position = offset
+                self.observe(record)
+
+    def observe(self, record):
+        cmd = record.get("cmd", "")
+        cwd = record.get("cwd") or ("C:\\fuzz\\temp_workdirs\\" + record.get("id", ""))
+        for name, pattern in self.rules:
+            if not pattern.search(cmd):
+                continue
+            executed_at = record.get("ts", time.time())
+            lag = self.ingest_lag + random.uniform(0, self.ingest_jitter)
+            # Like the Kibana alerts index: @timestamp is when the alert was written
+            self.siem.index({
+                "@timestamp": utc_iso(executed_at + lag),
+                "event": {"ingested": utc_iso(executed_at + lag)},
+                "kibana": {"alert": {"uuid": uuid.uuid4().hex, "original_time": utc_iso(executed_at), "rule": {"name": name}}},
+                "winlog": {"event_data": {"CurrentDirectory": cwd.rstrip("\\") + "\\", "CommandLine": cmd}},
+                "process": {"working_directory": cwd, "command_line": cmd},
+                "message": f"Process Create: CommandLine: {cmd} CurrentDirectory: {cwd}",
+            }, visible_at=executed_at + lag)
+            return
+
+
+def make_handler(siem):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, fmt, *args):
+            pass
+
+        def send_json(self, status, payload):
+            data = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("X-Elastic-Product", "Elasticsearch")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            if self.command != "HEAD":
+                self.wfile.write(data)
+
+        def read_body(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            return self.rfile.read(length).decode("utf-8") if length else ""
+
+        def do_HEAD(self):
+            self.send_json(200, {})
+
+        def do_GET(self):
+            path = urlparse(self.path).path
+            if path.endswith("/_search"):
+                return self.do_POST()
+            if path == "/_fake/stats":
+                return self.send_json(200, siem.stats)
+            self.send_json(200, {
+                "name": "fake-siem",
+                "cluster_name": "purplefuzz-local",
+                "version": {"number": "8.11.0", "build_flavor": "default"},
+                "tagline": "You Know, for Search",
+            })
+
+        def do_DELETE(self):
+            self.read_body()
+            self.send_json(200, {"succeeded": True, "num_freed": 1})
+
+        def do_POST(self):
+            url = urlparse(self.path)
+            path = url.path
+            raw = self.read_body()
+            if siem.latency:
+                time.sleep(siem.latency)
+
+            if path.endswith("/_pit"):
+                keep_alive = parse_qs(url.query).get("keep_alive", ["1m"])[0]
+                return self.send_json(200, {"id": f"fake-pit-{uuid.uuid4().hex}-{keep_alive}"})
+            if path.endswith("/_doc"):
+                siem.index(json.loads(raw))
+                return self.send_json(201, {"result": "created", "_id": uuid.uuid4().hex})
+            if path.endswith("/_msearch"):
+                siem.stats["msearch"] += 1
+                lines = [line for line in raw.splitlines() if line.strip()]
+                responses = []
+                for body_line in lines[1::2]:
+                    status, response = siem.search(json.loads(body_line))
+                    response["status"] = status
+                    responses.append(response)
+                return self.send_json(200, {"took": 1, "responses": responses})
+            if path.endswith("/_search"):
+                status, response = siem.search(json.loads(raw) if raw else {})
+                return self.send_json(status, response)
+            self.send_json(404, {"error": {"type": "not_found", "reason": path}, "status": 404})
+
+    return Handler
+
+
+def load_rules(rule_patterns, rules_file):
+    rules = [(f"cli_rule_{i}", re.compile(p, re.IGNORECASE)) for i, p in enumerate(rule_patterns)]
+    if rules_file:
+        with open(rules_file, "r", encoding="utf-8") as f:
+            for entry in json.load(f):
+                rules.append((entry.get("name", entry["pattern"]), re.compile(entry["pattern"], re.IGNORECASE)))
+    return rules
+
+
+def serve(host, port, siem):
+    server = ThreadingHTTPServer((host, port), make_handler(siem))
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="PurpleFuzz - Local fake SIEM (Elasticsearch search API stub)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9200)
+    parser.add_argument("--queue-dir", action="append", default=None,
+                        help="Queue log tailed by the sensor (repeatable; default: queue_log)")
+    parser.add_argument("--rule", action="append", default=[], help="Regex; matching commands raise an alert")
+    parser.add_argument("--rules", help="JSON file: [{\"name\": ..., \"pattern\": ...}, ...]")
+    parser.add_argument("--ingest-lag", type=float, default=0.0, help="Seconds before an alert becomes searchable")
+    parser.add_argument("--ingest-jitter", type=float, default=0.0, help="Extra random lag, uniform in [0, jitter]")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Added latency per request")
+    parser.add_argument("--reject-rate", type=float, default=0.0, help="Fraction of searches rejected with 429")
+    args = parser.parse_args()
+
+    siem = FakeSiem(latency=args.latency_ms / 1000.0, reject_rate=args.reject_rate)
+    rules = load_rules(args.rule, args.rules)
+    if rules:
+        for queue_dir in args.queue_dir or ["queue_log"]:
+            Sensor(siem, queue_dir, rules, args.ingest_lag, args.ingest_jitter).start()
+            print(f"[+] Sensor tailing {queue_dir}/ with {len(rules)} rule(s)")
+    serve(args.host, args.port, siem)
+    print(f"[+] Fake SIEM listening on http://{args.host}:{args.port}")
+    try:
+        while True:
+            time.sleep(60)
+            print(f"  [i] {siem.stats}")
+    except KeyboardInterrupt:
+        print("\n[!] Fake SIEM is stopping...")
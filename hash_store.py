@@ -0,0 +1,282 @@
+import os
+import mmap
+import struct
+import hashlib
+import threading
+
+# --- Dedup Store Defaults ---
+KEY_BYTES = 16                  # Truncated SHA-256 digest stored per tested mutant
+FLUSH_EVERY = 1024              # Pending keys buffered before one append to the log
+COMPACT_EVERY = 1_000_000       # Log size (keys) that triggers a merge into the sorted index
+BLOOM_BITS_PER_KEY = 10         # ~1% false positives with 7 probes
+BLOOM_PROBES = 7
+BLOOM_MIN_CAPACITY = 1_000_000
+
+BLOOM_HEADER = struct.Struct("<QQ")  # <capacity><number of keys covered>
+
+
+def digest_key(text, key_bytes=KEY_BYTES):
+    return hashlib.sha256(text.encode()).digest()[:key_bytes]
+
+
+class BloomFilter:
+    """
+    Fixed-size Bloom filter over keys that are already uniformly distributed
+    (truncated SHA-256), so probe positions are derived from the key itself.
+    """
+    def __init__(self, capacity, bits_per_key=BLOOM_BITS_PER_KEY, probes=BLOOM_PROBES, bits=None):
+        self.capacity = capacity
+        self.num_bits = max(64, capacity * bits_per_key)
+        self.probes = probes
+        self.bits = bits if bits is not None else bytearray((self.num_bits + 7) // 8)
+
+    def positions(self, key):
+        h1 = int.from_bytes(key[:8], "little")
+        h2 = int.from_bytes(key[8:16], "little") | 1
+        for i in range(self.probes):
+            yield (h1 + i * h2) % self.num_bits
+
+    def add(self, key):
+        for pos in self.positions(key):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, key):
+        for pos in self.positions(key):
+            if not self.bits[pos >> 3] & (1 << (pos & 7)):
+                return False
+        return True
+
+
+class DedupStore:
+    """
+    Set of tested mutants stored as binary digests.
+
+    <base>.idx   sorted fixed-size keys, memory-mapped and binary-searched
+    <base>.log   keys appended since the last compaction (loaded into memory)
+    <base>.bloom optional Bloom filter in front of both, saved on close
+
+    New keys are buffered and appended in batches; once the log grows past
+    'compact_every' keys it is merged into a new sorted index.
+    """
+    def __init__(self, base_path, key_bytes=KEY_BYTES, use_bloom=True,
+                 flush_every=FLUSH_EVERY, compact_every=COMPACT_EVERY):
+        self.base_path = base_path
+        self.idx_path = base_path + ".idx"
+        self.log_path = base_path + ".log"
+        self.bloom_path = base_path + ".bloom"
+        self.key_bytes = key_bytes
+        self.use_bloom = use_bloom
+        self.flush_every = flush_every
+        self.compact_every = compact_every
+        self.lock = threading.RLock()
+
+        self.index_map = None
+        self.index_count = 0
+        self.open_index()
+
+        # Keys in the log and keys not yet written to it
+        self.recent = set()
+        self.unflushed = []
+        self.load_log()
+        self.log_handle = open(self.log_path, "ab")
+
+        self.bloom = None
+        if use_bloom:
+            self.load_bloom()
+
+    def __len__(self):
+        return self.index_count + len(self.recent)
+
+    # --- Loading ---
+
+    def open_index(self):
+        if self.index_map is not None:
+            self.index_map.close()
+            self.index_map = None
+        self.index_count = 0
+        if os.path.exists(self.idx_path) and os.path.getsize(self.idx_path) > 0:
+            with open(self.idx_path, "rb") as f:
+                self.index_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self.index_count = len(self.index_map) // self.key_bytes
+
+    def load_log(self):
+        if not os.path.exists(self.log_path):
+            return
+        with open(self.log_path, "rb") as f:
+            data = f.read()
+        kb = self.key_bytes
+        usable = len(data) - len(data) % kb
+        self.recent = {data[i:i + kb] for i in range(0, usable, kb)}
+        if usable != len(data):
+            # Partial key from an interrupted append
+            with open(self.log_path, "r+b") as f:
+                f.truncate(usable)
+
+    def load_bloom(self):
+        try:
+            with open(self.bloom_path, "rb") as f:
+                capacity, covered = BLOOM_HEADER.unpack(f.read(BLOOM_HEADER.size))
+                bits = bytearray(f.read())
+            bloom = BloomFilter(capacity, bits=bits)
+            if covered == len(self) and len(bits) == (bloom.num_bits + 7) // 8 and capacity >= len(self):
+                self.bloom = bloom
+                return
+        except (FileNotFoundError, struct.error):
+            pass
+        self.rebuild_bloom()
+
+    def rebuild_bloom(self):
+        capacity = max(BLOOM_MIN_CAPACITY, 2 * len(self))
+        if len(self):
+            print(f"  [~] Building dedup Bloom filter for {len(self)} keys...")
+        bloom = BloomFilter(capacity)
+        kb = self.key_bytes
+        for i in range(self.index_count):
+            bloom.add(self.index_map[i * kb:(i + 1) * kb])
+        for key in self.recent:
+            bloom.add(key)
+        self.bloom = bloom
+
+    def save_bloom(self):
+        if self.bloom is None:
+            return
+        tmp_path = self.bloom_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(BLOOM_HEADER.pack(self.bloom.capacity, len(self)))
+            f.write(self.bloom.bits)
+        os.replace(tmp_path, self.bloom_path)
+
+    # --- Lookup / insert ---
+
+    def index_position(self, key):
+        """
+        Binary search in the memory-mapped index; returns the insertion point.
+        """
+        kb = self.key_bytes
+        lo, hi = 0, self.index_count
+        mm = self.index_map
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if mm[mid * kb:(mid + 1) * kb] < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def in_index(self, key):
+        if not self.index_count:
+            return False
+        pos = self.index_position(key)
+        kb = self.key_bytes
+        return pos < self.index_count and self.index_map[pos * kb:(pos + 1) * kb] == key
+
+    def __contains__(self, key):
+        with self.lock:
+            if self.bloom is not None and key not in self.bloom:
+                return False
+            return key in self.recent or self.in_index(key)
+
+    def add(self, key):
+        """
+        Records 'key'; returns False if it was already present.
+        """
+        with self.lock:
+            if key in self:
+                return False
+            self.recent.add(key)
+            self.unflushed.append(key)
+            if self.bloom is not None:
+                self.bloom.add(key)
+            if len(self.unflushed) >= self.flush_every:
+                self.flush()
+            return True
+
+    def add_text(self, text):
+        return self.add(digest_key(text, self.key_bytes))
+
+    def flush(self):
+        with self.lock:
+            if self.unflushed:
+                self.log_handle.write(b"".join(self.unflushed))
+                self.log_handle.flush()
+                self.unflushed = []
+            if len(self.recent) >= self.compact_every:
+                self.compact()
+
+    # --- Maintenance ---
+
+    def compact(self):
+        """
+        Merges the log into a new sorted index. Only the (small) log is sorted;
+        the existing index is copied slice by slice between insertion points.
+        """
+        with self.lock:
+            if self.unflushed:
+                self.log_handle.write(b"".join(self.unflushed))
+                self.log_handle.flush()
+                self.unflushed = []
+            if not self.recent:
+                return
+
+            kb = self.key_bytes
+            tmp_path = self.idx_path + ".tmp"
+            with open(tmp_path, "wb") as out:
+                copied = 0
+                for key in sorted(self.recent):
+                    pos = self.index_position(key) if self.index_count else 0
+                    if pos > copied:
+                        out.write(self.index_map[copied * kb:pos * kb])
+                        copied = pos
+                    out.write(key)
+                if copied < self.index_count:
+                    out.write(self.index_map[copied * kb:self.index_count * kb])
+                out.flush()
+                os.fsync(out.fileno())
+
+            if self.index_map is not None:
+                self.index_map.close()
+                self.index_map = None
+            os.replace(tmp_path, self.idx_path)
+            self.log_handle.close()
+            self.log_handle = open(self.log_path, "wb")
+            self.recent = set()
+            self.open_index()
+
+            if self.bloom is not None and self.bloom.capacity < len(self):
+                self.rebuild_bloom()
+            self.save_bloom()
+
+    def import_text_file(self, path):
+        """
+        One-time import of the legacy 'tested_hashes.txt' (64-char hex lines).
+        """
+        imported = 0
+        with open(path, "r") as f:
+            for line in f:
+                line = line.strip()
+                if len(line) < self.key_bytes * 2:
+                    continue
+                try:
+                    key = bytes.fromhex(line)[:self.key_bytes]
+                except ValueError:
+                    continue
+                with self.lock:
+                    if key not in self.recent:
+                        self.recent.add(key)
+                        self.unflushed.append(key)
+                        imported += 1
+                        if self.bloom is not None:
+                            self.bloom.add(key)
+        self.compact()
+        return imported
+
+    def close(self):
+        with self.lock:
+            if self.unflushed:
+                self.log_handle.write(b"".join(self.unflushed))
+                self.unflushed = []
+            self.log_handle.close()
+            self.save_bloom()
+            if self.index_map is not None:
+                self.index_map.close()
+                self.index_map = None
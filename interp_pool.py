@@ -0,0 +1,314 @@
+import os
+import time
+import queue
+import uuid
+import tempfile
+import threading
+import subprocess
+
+from executor import RunResult, RingBuffer, kill_process_tree, DEFAULT_TIMEOUT, OUTPUT_CAP
+
+# --- Interpreter Pool Defaults ---
+MAX_COMMANDS_PER_WORKER = 200   # Recycle an interpreter after this many commands
+MAX_WORKER_AGE = 600            # ... or after this many seconds
+READ_CHUNK = 4096
+
+# Seed tags run in persistent interpreters by default. A command run by a
+# persistent interpreter is read from its stdin, so its text never shows up
+# as a process CommandLine, which is what most cmd/PowerShell detection rules
+# match on. Those tags only run there when asked for (--persistent-tags).
+PERSISTENT_TAGS = ("generic",)
+
+# Interpreter used for each seed tag
+if os.name == "nt":
+    TAG_INTERPRETERS = {"powershell": "powershell", "cmd": "cmd", "generic": "cmd"}
+else:
+    TAG_INTERPRETERS = {"powershell": "sh", "cmd": "sh", "generic": "sh"}
+
+
+def sh_quote(text):
+    return "'" + text.replace("'", "'\"'\"'") + "'"
+
+
+def ps_quote(text):
+    return "'" + text.replace("'", "''") + "'"
+
+
+class Interpreter:
+    """
+    How to start one kind of interpreter and frame a command for it.
+
+    frame() returns the stdin text that changes to the correlation directory,
+    runs the command and then prints '<token> <exit status>' on stdout and
+    '<token>' on stderr, so the worker knows where the command's output ends.
+    With a 'script_suffix' each worker writes the command to a script file of
+    its own with that suffix, and frame() gets the script's path instead of
+    the command text.
+    """
+    def __init__(self, name, argv, frame, script_suffix=None):
+        self.name = name
+        self.argv = argv
+        self.frame = frame
+        self.script_suffix = script_suffix
+
+
+def frame_sh(command, cwd, token):
+    # Subshell: a syntax error, 'exit' or 'cd' in the command does not leak into the worker
+    return (f"(cd {sh_quote(cwd)} && eval {sh_quote(command)}) </dev/null\n"
+            f"printf '\\n{token} %d\\n' $?; printf '\\n{token}\\n' >&2\n")
+
+
+def frame_cmd(script, cwd, token):
+    # The command is called from a script file: inline, a stray ')' in it would end a
+    # parenthesized block early. It reads nul, so 'set /p', 'more' or 'choice' cannot swallow
+    # the marker lines from stdin. The script is parsed as a batch file (for-variables are %%i)
+    return (f"cd /d \"{cwd}\" & call \"{script}\" <nul\r\n"
+            f"echo.& echo {token} %ERRORLEVEL%\r\n"
+            f"echo.1>&2& echo {token} 1>&2\r\n")
+
+
+def frame_powershell(command, cwd, token):
+    # Location and command in one line, so it carries the correlation directory. Empty pipeline
+    # input for the command (Read-Host fails under -NonInteractive), so it cannot read the marker lines
+    return (f"$global:LASTEXITCODE = 0; Set-Location -LiteralPath {ps_quote(cwd)}; $null | & {{ {command} }}\n"
+            f"$__pf = if ($?) {{ $global:LASTEXITCODE }} else {{ 1 }}; "
+            f"[Console]::Out.WriteLine(\"`n{token} $__pf\"); [Console]::Error.WriteLine(\"`n{token}\")\n")
+
+
+INTERPRETERS = {
+    "sh": Interpreter("sh", ["/bin/sh"], frame_sh),
+    "cmd": Interpreter("cmd", ["cmd.exe", "/Q", "/D"], frame_cmd, script_suffix=".cmd"),
+    "powershell": Interpreter("powershell", ["powershell.exe", "-NoLogo", "-NoProfile", "-NonInteractive",
+                                             "-ExecutionPolicy", "Bypass", "-Command", "-"], frame_powershell),
+}
+
+
+class StreamCollector(threading.Thread):
+    """
+    Reads one pipe of a worker into a queue of byte chunks (None on EOF).
+    """
+    def __init__(self, stream):
+        super().__init__(daemon=True)
+        self.stream = stream
+        self.chunks = queue.Queue()
+        self.pending = bytearray()   # Bytes read past the last marker
+
+    def run(self):
+        try:
+            while True:
+                chunk = self.stream.read1(READ_CHUNK)
+                if not chunk:
+                    break
+                self.chunks.put(chunk)
+        except (OSError, ValueError):
+            pass
+        self.chunks.put(None)
+
+    def read_until(self, marker, deadline, sink):
+        """
+        Writes output up to 'marker' into 'sink' (a RingBuffer, which keeps
+        the tail and counts every byte). Returns False on timeout or EOF.
+        """
+        window = self.pending
+        self.pending = bytearray()
+        while True:
+            found = window.find(marker)
+            if found >= 0:
+                sink.write(bytes(window[:found]))
+                self.pending = window[found + len(marker):]
+                return True
+            # Move everything that cannot be part of the marker out of the search window
+            spill = len(window) - (len(marker) - 1)
+            if spill > 0:
+                sink.write(bytes(window[:spill]))
+                del window[:spill]
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return False
+            try:
+                chunk = self.chunks.get(timeout=remaining)
+            except queue.Empty:
+                return False
+            if chunk is None:
+                self.chunks.put(None)
+                sink.write(bytes(window))
+                return False
+            window += chunk
+
+
+class InterpreterWorker:
+    """
+    One long-lived interpreter process fed commands over stdin.
+    """
+    def __init__(self, interpreter):
+        self.interpreter = interpreter
+        self.token = f"__PF_DONE_{uuid.uuid4().hex}__"
+        self.script = None
+        if interpreter.script_suffix:
+            self.script = os.path.join(tempfile.gettempdir(), f"purplefuzz_{self.token}{interpreter.script_suffix}")
+        popen_kwargs = {}
+        if os.name == "nt":
+            popen_kwargs["creationflags"] = subprocess.CREATE_NEW_PROCESS_GROUP
+        else:
+            popen_kwargs["start_new_session"] = True
+        self.proc = subprocess.Popen(
+            interpreter.argv,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            **popen_kwargs
+        )
+        self.stdout = StreamCollector(self.proc.stdout)
+        self.stderr = StreamCollector(self.proc.stderr)
+        self.stdout.start()
+        self.stderr.start()
+        self.started = time.time()
+        self.commands = 0
+        self.alive = True
+
+    def expired(self, max_commands, max_age):
+        return not self.alive or self.proc.poll() is not None \
+            or self.commands >= max_commands or time.time() - self.started >= max_age
+
+    def run(self, command_string, cwd, timeout, output_cap=OUTPUT_CAP):
+        self.commands += 1
+        marker = self.token.encode("ascii")
+        try:
+            if self.script is not None:
+                with open(self.script, "w", encoding="utf-8") as f:
+                    f.write(command_string + "\n")
+                command_string = self.script
+            self.proc.stdin.write(self.interpreter.frame(command_string, cwd, self.token).encode("utf-8"))
+            self.proc.stdin.flush()
+        except (OSError, ValueError) as e:
+            self.close(force=True)
+            return RunResult(None, error=e)
+
+        # '<token> <status>' line on stdout, then the bare token on stderr
+        deadline = time.time() + timeout
+        stdout, stderr, status = RingBuffer(output_cap), RingBuffer(output_cap), RingBuffer(0)
+        if not self.stdout.read_until(marker, deadline, stdout) \
+                or not self.stdout.read_until(b"\n", deadline, status) \
+                or not self.stderr.read_until(marker, deadline, stderr):
+            return self.abort(stdout, stderr)
+        self.stderr.read_until(b"\n", deadline, RingBuffer(0))
+        try:
+            returncode = int(status.getvalue().strip())
+        except ValueError:
+            returncode = None
+        return self.result(returncode, stdout, stderr)
+
+    def abort(self, stdout, stderr):
+        """
+        Timeout or the interpreter died mid-command: kill it together with
+        whatever the command spawned; the pool starts a fresh one.
+        """
+        timed_out = self.proc.poll() is None
+        self.close(force=True)
+        error = None if timed_out else RuntimeError(f"{self.interpreter.name} worker exited (code {self.proc.returncode})")
+        return self.result(self.proc.returncode, stdout, stderr, timed_out=timed_out, error=error)
+
+    def result(self, returncode, stdout, stderr, **kwargs):
+        (out_text, out_bytes), (err_text, err_bytes) = self.decode(stdout), self.decode(stderr)
+        return RunResult(returncode, out_text, err_text, output_bytes=[out_bytes, err_bytes], **kwargs)
+
+    @staticmethod
+    def decode(buffer):
+        """
+        Captured tail as text without the newline written in front of the
+        marker, and the bytes the command wrote in total.
+        """
+        data = buffer.getvalue()
+        stripped = data[:-2] if data.endswith(b"\r\n") else data[:-1] if data.endswith(b"\n") else data
+        return stripped.decode("utf-8", errors="replace"), buffer.total - (len(data) - len(stripped))
+
+    def close(self, force=False):
+        self.alive = False
+        self.stop(force)
+        if self.script is not None:
+            try:
+                os.remove(self.script)
+            except OSError:
+                pass
+
+    def stop(self, force):
+        if not force and self.proc.poll() is None:
+            try:
+                self.proc.stdin.write(b"exit\n")
+                self.proc.stdin.flush()
+                self.proc.stdin.close()
+                self.proc.wait(timeout=2)
+                return
+            except Exception:
+                pass
+        kill_process_tree(self.proc)
+        try:
+            self.proc.wait(timeout=2)
+        except Exception:
+            pass
+
+
+class InterpreterPool:
+    """
+    Long-lived interpreter workers, one per concurrent execution and
+    interpreter kind. run() takes an idle worker for the seed's tag (or
+    starts one), runs the command in the per-run correlation directory and
+    returns it to the pool. Workers are recycled after MAX_COMMANDS_PER_WORKER
+    commands or MAX_WORKER_AGE seconds, and replaced after a timeout.
+
+    The command runs with the correlation directory as working directory, so
+    processes it starts carry it in process telemetry as with a fresh shell.
+    Its own text, however, is fed to the interpreter over stdin and never
+    appears as a CommandLine; only seeds with one of 'tags' are run here
+    (handles()), the engine runs the others in a fresh shell.
+    """
+    def __init__(self, timeout=DEFAULT_TIMEOUT, max_commands=MAX_COMMANDS_PER_WORKER, max_age=MAX_WORKER_AGE,
+                 interpreters=None, tags=PERSISTENT_TAGS, output_cap=OUTPUT_CAP):
+        self.timeout = timeout
+        self.max_commands = max_commands
+        self.max_age = max_age
+        self.interpreters = interpreters or TAG_INTERPRETERS
+        self.tags = tuple(tags)
+        self.output_cap = output_cap
+        self.idle = {}              # interpreter name -> [InterpreterWorker]
+        self.lock = threading.Lock()
+        self.closed = False
+
+    def acquire(self, name):
+        with self.lock:
+            workers = self.idle.setdefault(name, [])
+            while workers:
+                worker = workers.pop()
+                if not worker.expired(self.max_commands, self.max_age):
+                    return worker
+                threading.Thread(target=worker.close, daemon=True).start()
+        return InterpreterWorker(INTERPRETERS[name])
+
+    def release(self, worker):
+        with self.lock:
+            if not self.closed and not worker.expired(self.max_commands, self.max_age):
+                self.idle.setdefault(worker.interpreter.name, []).append(worker)
+                return
+        worker.close(force=not worker.alive)
+
+    def handles(self, tag):
+        return tag in self.tags
+
+    def run(self, command_string, cwd, tag="generic"):
+        name = self.interpreters.get(tag, self.interpreters.get("generic", "sh"))
+        try:
+            worker = self.acquire(name)
+        except Exception as e:
+            return RunResult(None, error=e)
+        try:
+            return worker.run(command_string, cwd or os.getcwd(), self.timeout, self.output_cap)
+        finally:
+            self.release(worker)
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+            workers = [w for idle in self.idle.values() for w in idle]
+            self.idle = {}
+        for worker in workers:
+            worker.close()
@@ -0,0 +1,343 @@
+"""
+Counters, gauges and latency histograms for the producer and consumer,
+served in the Prometheus text format on a local HTTP endpoint:
+
+    python producer.py --metrics-port 9464
+    curl http://127.0.0.1:9464/metrics
+
+Also the optional periodic stats line (StatsLine) and the logging setup for
+per-command and per-verdict messages: leveled, and rate-limited per message
+so a flood of identical lines costs nothing.
+"""
+import sys
+import time
+import logging
+import threading
+from bisect import bisect_left
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# --- Metrics Defaults ---
+DEFAULT_METRICS_HOST = "127.0.0.1"
+LATENCY_BUCKETS = [0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800]
+LOG_RATE_LIMIT = 5            # Identical log messages let through per interval ...
+LOG_RATE_INTERVAL = 10        # ... of this many seconds
+LOG_LEVELS = ("debug", "info", "warning", "error")
+
+
+def label_text(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(f'{n}="{str(v).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+                     for n, v in zip(names, values))
+    return "{" + pairs + "}"
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self.values = {}        # label values tuple -> value
+        self.lock = threading.Lock()
+
+    def key(self, labels):
+        return tuple(labels.get(name, "") for name in self.labels)
+
+    def get(self, **labels):
+        return self.values.get(self.key(labels), 0)
+
+    def total(self):
+        return sum(self.values.values())
+
+    def samples(self):
+        with self.lock:
+            return [(self.name, key, value) for key, value in sorted(self.values.items())]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        for name, key, value in self.samples():
+            lines.append(f"{name}{label_text(self.labels, key)} {value}")
+        return lines
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    """
+    Set directly, or read from a function at scrape time (set_function).
+    """
+    kind = "gauge"
+
+    def __init__(self, name, help_text, labels=()):
+        super().__init__(name, help_text, labels)
+        self.function = None
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.values[self.key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set_function(self, function):
+        self.function = function
+
+    def get(self, **labels):
+        if self.function is not None:
+            try:
+                return self.function()
+            except Exception:
+                return 0
+        return super().get(**labels)
+
+    def samples(self):
+        if self.function is not None:
+            return [(self.name, (), self.get())]
+        return super().samples()
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = list(buckets)
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        with self.lock:
+            entry = self.values.get(key)
+            if entry is None:
+                entry = self.values[key] = {"counts": [0] * (len(self.buckets) + 1), "sum": 0.0, "count": 0}
+            entry["counts"][bisect_left(self.buckets, value)] += 1
+            entry["sum"] += value
+            entry["count"] += 1
+
+    def time(self, **labels):
+        return Timer(self, labels)
+
+    def count(self):
+        with self.lock:
+            return sum(entry["count"] for entry in self.values.values())
+
+    def quantile(self, q):
+        """
+        Upper bound of the bucket holding the q-quantile, over all label sets.
+        """
+        with self.lock:
+            counts = [sum(c) for c in zip(*(entry["counts"] for entry in self.values.values()))]
+        total = sum(counts)
+        if not total:
+            return None
+        running = 0
+        for i, count in enumerate(counts):
+            running += count
+            if running >= q * total:
+                return self.buckets[i] if i < len(self.buckets) else float("inf")
+        return None
+
+    def samples(self):
+        samples = []
+        with self.lock:
+            for key, entry in sorted(self.values.items()):
+                running = 0
+                for bound, count in zip(self.buckets + ["+Inf"], entry["counts"]):
+                    running += count
+                    samples.append((self.name + "_bucket", key + (bound,), running))
+                samples.append((self.name + "_sum", key, entry["sum"]))
+                samples.append((self.name + "_count", key, entry["count"]))
+        return samples
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        for name, key, value in self.samples():
+            names = self.labels + ("le",) if name.endswith("_bucket") else self.labels
+            lines.append(f"{name}{label_text(names, key)} {value}")
+        return lines
+
+
+class Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.started, **self.labels)
+        return False
+
+
+class Registry:
+    """
+    Metrics by name; asking for an existing name returns the same metric.
+    """
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def register(self, cls, name, help_text, labels=(), **kwargs):
+        with self.lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = cls(name, help_text, labels, **kwargs)
+            return metric
+
+    def counter(self, name, help_text, labels=()):
+        return self.register(Counter, name, help_text, labels)
+
+    def gauge(self, name, help_text, labels=()):
+        return self.register(Gauge, name, help_text, labels)
+
+    def histogram(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram, name, help_text, labels, buckets=buckets)
+
+    def render(self):
+        with self.lock:
+            metrics = list(self.metrics.values())
+        lines = []
+        for metric in metrics:
+            lines += metric.render()
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def serve_metrics(port, host=DEFAULT_METRICS_HOST, registry=REGISTRY):
+    """
+    Serves GET /metrics from a daemon thread. Returns the server.
+    """
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?", 1)[0] not in ("/metrics", "/"):
+                self.send_error(404)
+                return
+            body = registry.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class StatsLine(threading.Thread):
+    """
+    Prints format_line(rate) every 'interval' seconds. rate(name, value)
+    turns a running total into a per-second rate since the last line.
+    """
+    def __init__(self, interval, format_line):
+        super().__init__(daemon=True, name="stats-line")
+        self.interval = interval
+        self.format_line = format_line
+        self.previous = {}
+        self.elapsed = 0.0
+
+    def rate(self, name, value):
+        last = self.previous.get(name, 0)
+        self.previous[name] = value
+        return (value - last) / self.elapsed if self.elapsed > 0 else 0.0
+
+    def run(self):
+        last = time.time()
+        while True:
+            time.sleep(self.interval)
+            now = time.time()
+            self.elapsed = now - last
+            last = now
+            try:
+                print(f"  [stats] {self.format_line(self.rate)}")
+            except Exception as e:
+                print(f"  [stats] unavailable: {e}")
+
+
+def start_monitoring(metrics_port=None, stats_interval=0, format_line=None, host=DEFAULT_METRICS_HOST):
+    """
+    Starts the metrics endpoint and the stats line, each only if asked for.
+    """
+    if metrics_port:
+        serve_metrics(metrics_port, host)
+        print(f"Metrics: http://{host}:{metrics_port}/metrics")
+    if stats_interval and format_line is not None:
+        StatsLine(stats_interval, format_line).start()
+
+
+def milliseconds(seconds):
+    """
+    Histogram quantile (a bucket bound) for the stats line.
+    """
+    if seconds is None:
+        return "n/a"
+    if seconds == float("inf"):
+        return f">{LATENCY_BUCKETS[-1]:g}s"
+    return f"<={seconds:g}s" if seconds >= 1 else f"<={seconds * 1000:g}ms"
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Lets at most 'limit' records with the same message template through per
+    'interval' seconds; the next one let through reports how many were
+    suppressed.
+    """
+    def __init__(self, limit=LOG_RATE_LIMIT, interval=LOG_RATE_INTERVAL):
+        super().__init__()
+        self.limit = limit
+        self.interval = interval
+        self.windows = {}       # template -> [window start, passed, suppressed]
+        self.lock = threading.Lock()
+
+    def filter(self, record):
+        now = time.time()
+        with self.lock:
+            window = self.windows.get(record.msg)
+            if window is None or now - window[0] >= self.interval:
+                suppressed = window[2] if window is not None else 0
+                window = self.windows[record.msg] = [now, 0, 0]
+                if suppressed:
+                    record.msg = f"{record.msg} ({suppressed} similar suppressed)"
+            if window[1] >= self.limit:
+                window[2] += 1
+                return False
+            window[1] += 1
+            return True
+
+
+def setup_logging(level="info", limit=LOG_RATE_LIMIT, interval=LOG_RATE_INTERVAL):
+    """
+    Configures the 'purplefuzz' loggers: plain messages on stdout (like the
+    prints around them), at 'level', rate-limited per message.
+    """
+    logger = logging.getLogger("purplefuzz")
+    logger.setLevel(getattr(logging, level.upper()))
+    logger.propagate = False
+    if not logger.handlers:
+        handler = logging.StreamHandler(sys.stdout)
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        handler.addFilter(RateLimitFilter(limit, interval))
+        logger.addHandler(handler)
+    return logger
@@ -0,0 +1,231 @@
+"""
+Delta-debugging minimizer for confirmed bypasses.
+
+A PRIO_1 find is diffed against its origin seed; edits within one token of
+the find (command_ir) form one change. ddmin then searches for the smallest
+set of changes that, applied to the seed, still executes successfully and is
+not detected. All candidates of a ddmin step are executed in parallel and
+verified together (verifier.py), so a step costs one verdict deadline, not
+one per candidate.
+
+    python minimize.py interesting_finds/prio_1__1718000000__ab12.txt
+    python minimize.py --seed-id 1234 --local-oracle -w 16
+"""
+import os
+import json
+import argparse
+from bisect import bisect_right
+from difflib import SequenceMatcher
+
+from executor import ExecutionEngine, DEFAULT_TIMEOUT
+from interp_pool import InterpreterPool
+from corpus_store import CorpusStore, CORPUS_DB
+from command_ir import lex
+from oracle import DetectionOracle, RULES_DIR
+from verifier import Verifier, connect_siem
+
+# --- Minimizer Defaults ---
+MINIMIZED_DIR = "minimized"
+DEFAULT_WORKERS = 8
+
+
+def token_changes(seed_cmd, find_cmd, find_tokens):
+    """
+    Differences between seed and find as (seed start, seed end, replacement
+    text), in seed order. The alignment is per character, so inserted
+    escapes and quotes line up with the seed word they obfuscate; edits that
+    touch the same token of the find are merged into one change.
+    """
+    starts, ends, position = [], [], 0
+    for token in find_tokens:
+        starts.append(position)
+        position += len(token.text)
+        ends.append(position)
+
+    def touched(j1, j2):
+        if j2 > j1:
+            return set(range(bisect_right(starts, j1) - 1, bisect_right(starts, j2 - 1)))
+        k = bisect_right(starts, j1) - 1
+        return {k} if k >= 0 and starts[k] < j1 < ends[k] else set()
+
+    groups = []     # [seed start, seed end, find start, find end, find tokens]
+    matcher = SequenceMatcher(None, seed_cmd, find_cmd, autojunk=False)
+    for op, i1, i2, j1, j2 in matcher.get_opcodes():
+        if op == "equal":
+            continue
+        tokens = touched(j1, j2)
+        if groups and groups[-1][4] & tokens:
+            groups[-1][1], groups[-1][3] = i2, j2
+            groups[-1][4] |= tokens
+        else:
+            groups.append([i1, i2, j1, j2, tokens])
+    return [(i1, i2, find_cmd[j1:j2]) for i1, i2, j1, j2, _ in groups]
+
+
+def apply_changes(seed_cmd, changes):
+    parts = []
+    position = 0
+    for start, end, replacement in sorted(changes, key=lambda change: change[:2]):
+        parts.append(seed_cmd[position:start])
+        parts.append(replacement)
+        position = end
+    parts.append(seed_cmd[position:])
+    return "".join(parts)
+
+
+def split(items, n):
+    size, extra = divmod(len(items), n)
+    chunks, start = [], 0
+    for i in range(n):
+        end = start + size + (1 if i < extra else 0)
+        chunks.append(items[start:end])
+        start = end
+    return [chunk for chunk in chunks if chunk]
+
+
+class Minimizer:
+    def __init__(self, verifier, seed_cmd, find_cmd, tags):
+        self.verifier = verifier
+        self.tags = tags
+        self.seed_cmd = seed_cmd
+        self.changes = token_changes(seed_cmd, find_cmd, lex(find_cmd, tags[0]))
+        self.results = {}   # command -> passed
+        self.executions = 0
+        self.steps = 0
+
+    def test(self, configurations):
+        """
+        Verdicts for several change sets at once; each distinct command is
+        executed once (results are cached across steps).
+        """
+        commands = [apply_changes(self.seed_cmd, changes) for changes in configurations]
+        new = list(dict.fromkeys(c for c in commands if c not in self.results))
+        if new:
+            self.steps += 1
+            self.executions += len(new)
+            print(f"  [>] Step {self.steps}: verifying {len(new)} candidate(s)...")
+            for run in self.verifier.verify(new, self.tags):
+                self.results[run["cmd"]] = run["success"] and not run["detected"]
+        return [self.results[c] for c in commands]
+
+    def run(self):
+        """
+        ddmin over the changes. Returns the smallest passing command, or
+        None if the find itself no longer passes.
+        """
+        changes = list(self.changes)
+        n = 2
+        first = True
+        while True:
+            chunks = split(changes, n) if len(changes) >= 2 else []
+            complements = [[c for c in changes if c not in chunk] for chunk in chunks] if n > 2 else []
+            candidates = chunks + complements
+            # The find itself is verified along with the first step
+            verdicts = self.test(([changes] if first else []) + candidates)
+            if first:
+                first = False
+                if not verdicts.pop(0):
+                    return None
+            if not candidates:
+                break
+            passing = [candidate for candidate, ok in zip(candidates, verdicts) if ok]
+            if passing:
+                smaller = min(passing, key=len)
+                # A passing chunk restarts at granularity 2, a complement keeps its granularity
+                n = 2 if smaller in chunks else max(n - 1, 2)
+                changes = smaller
+            elif n < len(changes):
+                n = min(n * 2, len(changes))
+            else:
+                break
+            print(f"  [+] {len(changes)} change(s) left")
+        return apply_changes(self.seed_cmd, changes)
+
+
+def origin_of(corpus, row, parent_only=False):
+    """
+    Walks the parent chain to the seed the find was derived from.
+    """
+    seen = set()
+    while row is not None and row["parent_id"] is not None and row["id"] not in seen:
+        seen.add(row["id"])
+        parent = corpus.get(row["parent_id"])
+        if parent is None:
+            break
+        row = parent
+        if parent_only:
+            break
+    return row
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="PurpleFuzz - Delta-debugging minimizer for bypasses")
+    parser.add_argument("find", nargs="?", help="File with the find's command (e.g. from results_archive.py export --legacy)")
+    parser.add_argument("--seed-id", type=int, help="Minimize this corpus seed instead of a file")
+    parser.add_argument("--origin-id", type=int, help="Diff against this seed (default: the find's root ancestor)")
+    parser.add_argument("--parent", action="store_true", help="Diff against the direct parent, not the root ancestor")
+    parser.add_argument("--tag", help="Seed tag, if the find is not in the corpus")
+    parser.add_argument("-w", "--workers", type=int, default=DEFAULT_WORKERS, help="Candidates executed in parallel")
+    parser.add_argument("-t", "--timeout", type=int, default=DEFAULT_TIMEOUT, help="Per-command timeout in seconds")
+    parser.add_argument("-P", "--persistent", action="store_true", help="Run generic seeds in long-lived interpreters (see interp_pool.PERSISTENT_TAGS)")
+    parser.add_argument("--local-oracle", action="store_true",
+                        help="Judge detection with the local rules instead of the SIEM (fast, approximate)")
+    parser.add_argument("--rules-dir", default=RULES_DIR, help="Rules for --local-oracle")
+    parser.add_argument("--db", default=CORPUS_DB, help="Corpus database file")
+    args = parser.parse_args()
+
+    corpus = CorpusStore(args.db)
+    if args.seed_id is not None:
+        row = corpus.get(args.seed_id)
+        if row is None:
+            parser.error(f"no seed with id {args.seed_id}")
+        find_cmd = row["cmd"]
+    elif args.find:
+        with open(args.find, "r", encoding="utf-8") as f:
+            find_cmd = f.read().strip()
+        row = corpus.find(find_cmd, args.tag)
+    else:
+        parser.error("give a find file or --seed-id")
+
+    tag = args.tag or (row["tag"] if row is not None else None)
+    origin = corpus.get(args.origin_id) if args.origin_id is not None else origin_of(corpus, row, args.parent)
+    if tag is None or origin is None or origin["cmd"] == find_cmd:
+        parser.error("origin seed unknown: the find is not in the corpus with a parent (use --origin-id and --tag)")
+
+    engine = ExecutionEngine(workers=args.workers, timeout=args.timeout,
+                             interpreter_pool=InterpreterPool(timeout=args.timeout) if args.persistent else None)
+    if args.local_oracle:
+        verifier = Verifier(engine, oracle=DetectionOracle(args.rules_dir, mode="drop"))
+    else:
+        try:
+            verifier = Verifier(engine, siem_client=connect_siem())
+        except Exception as e:
+            print(f"[ERROR] Could not connect to Elasticsearch: {e}")
+            engine.shutdown()
+            exit(1)
+
+    minimizer = Minimizer(verifier, origin["cmd"], find_cmd, [tag])
+    print(f"Find:   {find_cmd}")
+    print(f"Origin: {origin['cmd']} (seed {origin['id']})")
+    print(f"{len(minimizer.changes)} token change(s) between them; verdicts from "
+          f"{'local rules in ' + args.rules_dir + '/' if args.local_oracle else 'the SIEM'}")
+    try:
+        minimized = minimizer.run()
+    finally:
+        engine.shutdown()
+        verifier.close()
+        corpus.close()
+
+    if minimized is None:
+        print("[ERROR] The find no longer executes undetected; nothing to minimize.")
+        exit(1)
+
+    print(f"\n[+] Minimized in {minimizer.steps} step(s), {minimizer.executions} execution(s):")
+    print(f"    {minimized}")
+    os.makedirs(MINIMIZED_DIR, exist_ok=True)
+    name = os.path.splitext(os.path.basename(args.find))[0] if args.find else f"seed_{args.seed_id}"
+    with open(os.path.join(MINIMIZED_DIR, name + ".min.txt"), "w", encoding="utf-8") as f:
+        f.write(minimized)
+    with open(os.path.join(MINIMIZED_DIR, "minimized.jsonl"), "a", encoding="utf-8") as f:
+        f.write(json.dumps({"find": find_cmd, "origin_id": origin["id"], "tag": tag, "minimized": minimized,
+                            "changes": len(minimizer.changes), "executions": minimizer.executions}) + "\n")
@@ -0,0 +1,317 @@
+"""
+Mutator plugin registry for the producer.
+
+Plugins are the .py files in a mutator directory; each BaseMutator subclass
+defined in a file is one mutator, registered under its 'tags'. What every
+file defines is cached in MUTATOR_CACHE by mtime, size and content hash, so
+at startup files are only executed when a tag they serve is first asked
+for (registry[tag]) or when they changed since the cache was written.
+
+watch() polls the directory: a changed or new file is loaded in isolation
+and swapped in atomically (callers keep the tuple they already hold), a
+broken one keeps its previous version, a deleted one is dropped. A mutator
+that keeps raising or running slowly (record()) is quarantined until its
+file changes or QUARANTINE_COOLDOWN passes; it then gets a fresh window of
+calls and goes back to quarantine (for twice as long) if it fails again.
+"""
+import os
+import sys
+import json
+import time
+import hashlib
+import threading
+import importlib.util
+from pathlib import Path
+
+import base_mutator
+from base_mutator import BaseMutator
+from metrics import REGISTRY
+
+# Older plugins import the base class through the package path
+sys.modules.setdefault("mutators.base_mutator", base_mutator)
+
+# --- Registry Defaults ---
+MUTATOR_TAGS = ("generic", "cmd", "powershell")
+MUTATOR_CACHE = "mutator_cache.json"   # Per-file mtime/size/hash and the classes it defines (next to the directory)
+MUTATOR_RELOAD_INTERVAL = 2            # Seconds between directory scans; 0 = no hot reload
+QUARANTINE_WINDOW = 100                # Calls per mutator between health checks
+QUARANTINE_ERROR_RATE = 0.5            # Share of raising calls in a window that quarantines
+QUARANTINE_SLOW_RATE = 0.5             # Share of slow calls in a window that quarantines
+MUTATOR_SLOW_SECONDS = 0.01            # A mutate() call slower than this counts as slow
+QUARANTINE_COOLDOWN = 300              # Seconds before a quarantined mutator is probed again ...
+QUARANTINE_COOLDOWN_MAX = 3600         # ... doubled each time it is quarantined again, up to this
+
+QUARANTINED = REGISTRY.gauge("purplefuzz_mutators_quarantined", "Mutators quarantined for errors or slowness")
+
+
+def file_digest(path):
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+class MutatorRegistry:
+    """
+    registry[tag] is the tuple of active mutators for a tag; for_tags()
+    the list a havoc chain chooses from (generic ones first, as before).
+    """
+    def __init__(self, directory, tags=MUTATOR_TAGS, cache_path=None):
+        # Absolute, so a later chdir does not move the directory or its cache
+        self.directory = os.path.abspath(directory)
+        self.tags = tags
+        self.cache_path = cache_path or os.path.join(os.path.dirname(self.directory), MUTATOR_CACHE)
+        self.lock = threading.RLock()
+        self.files = {}          # file name -> mtime_ns, size, sha256, classes [(name, tags)], error
+        self.instances = {}      # file name -> mutator instances, once loaded
+        self.views = {}          # tag -> tuple of active mutators; replaced, never mutated
+        self.health = {}         # class name -> [calls, errors, slow]
+        self.quarantined = {}    # class name -> (file name, reason, release time)
+        self.strikes = {}        # class name -> quarantines since its file last changed
+        self.next_release = float("inf")
+        self.loads = 0
+        self.watcher = None
+        self.stopped = threading.Event()
+
+    # --- Discovery ---
+
+    def load_cache(self):
+        try:
+            with open(self.cache_path, "r", encoding="utf-8") as f:
+                return json.load(f).get(self.directory, {})
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def save_cache(self):
+        try:
+            with open(self.cache_path, "r", encoding="utf-8") as f:
+                cache = json.load(f)
+        except (FileNotFoundError, ValueError):
+            cache = {}
+        cache[self.directory] = {
+            name: {k: v for k, v in entry.items() if k != "error"}
+            for name, entry in self.files.items() if entry["error"] is None
+        }
+        tmp_path = self.cache_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(cache, f, indent=1)
+        os.replace(tmp_path, self.cache_path)
+
+    def scan(self):
+        """
+        Brings the registry in line with the directory. Unchanged files
+        keep their metadata (and instances); changed and new files are
+        loaded now. Returns the number of files loaded or dropped.
+        """
+        with self.lock:
+            known = self.files or {name: dict(entry, error=None) for name, entry in self.load_cache().items()}
+            seen = {}
+            for path in sorted(Path(self.directory).glob("*.py")):
+                if path.name == "__init__.py":
+                    continue
+                try:
+                    stat = path.stat()
+                except OSError:
+                    continue
+                entry = known.get(path.name)
+                if entry is not None and (entry["mtime_ns"], entry["size"]) == (stat.st_mtime_ns, stat.st_size):
+                    seen[path.name] = entry
+                    continue
+                digest = file_digest(path)
+                if entry is not None and entry["sha256"] == digest and entry["error"] is None:
+                    # Touched but not modified
+                    seen[path.name] = dict(entry, mtime_ns=stat.st_mtime_ns, size=stat.st_size)
+                    continue
+                seen[path.name] = {"mtime_ns": stat.st_mtime_ns, "size": stat.st_size, "sha256": digest,
+                                   "classes": [], "error": None, "changed": True}
+
+            changed = [name for name, entry in seen.items() if entry.pop("changed", False)]
+            dropped = [name for name in self.files if name not in seen]
+            loaded = {}
+            for name in changed:
+                instances, error = self.load_file(name)
+                if error is not None and name in self.instances:
+                    print(f"  [!] Error reloading {name}, keeping the previous version: {error}")
+                    # Not retried until the file changes again
+                    seen[name] = dict(self.files[name], mtime_ns=seen[name]["mtime_ns"], size=seen[name]["size"])
+                    continue
+                seen[name]["error"] = error
+                if error is not None:
+                    print(f"  [!] Error loading {name}: {error}")
+                    continue
+                seen[name]["classes"] = [(m.__class__.__name__, list(m.tags)) for m in instances]
+                loaded[name] = instances
+
+            if not loaded and not dropped and seen.keys() == self.files.keys():
+                self.files = seen
+                return 0
+            instances = {name: mutators for name, mutators in self.instances.items() if name in seen}
+            instances.update(loaded)
+            for name in loaded:
+                # A new version gets a fresh start
+                for class_name, (file_name, _, _) in list(self.quarantined.items()):
+                    if file_name == name:
+                        del self.quarantined[class_name]
+                        self.strikes.pop(class_name, None)
+                        print(f"  [+] {class_name} released from quarantine ({name} changed)")
+            QUARANTINED.set(len(self.quarantined))
+            self.next_release = min((until for _, _, until in self.quarantined.values()), default=float("inf"))
+            self.files = seen
+            self.instances = instances
+            self.views = {}
+            self.save_cache()
+            return len(loaded) + len(dropped)
+
+    def load_file(self, name):
+        """
+        Executes one plugin file as a fresh module. Returns (instances,
+        None) or (None, error).
+        """
+        path = Path(self.directory) / name
+        self.loads += 1
+        module_name = f"purplefuzz_mutator_{path.stem}_{self.loads}"
+        try:
+            spec = importlib.util.spec_from_file_location(module_name, path)
+            module = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(module)
+            instances = []
+            for attribute_name in dir(module):
+                attribute = getattr(module, attribute_name)
+                # Classes imported from elsewhere belong to their own file
+                if isinstance(attribute, type) and issubclass(attribute, BaseMutator) and \
+                        attribute is not BaseMutator and attribute.__module__ == module_name:
+                    instance = attribute()
+                    for tag in instance.tags:
+                        if tag in self.tags:
+                            print(f"  [+] Loaded: {path.stem} (Tag: {tag})")
+                        else:
+                            print(f"  [!] Undefined tag '{tag}' in {path.stem}")
+                    instances.append(instance)
+            return instances, None
+        except Exception as e:
+            return None, e
+
+    # --- Lookup ---
+
+    def __getitem__(self, tag):
+        view = self.views.get(tag)
+        if view is not None:
+            return view
+        with self.lock:
+            for name, entry in self.files.items():
+                if name not in self.instances and entry["error"] is None and \
+                        any(tag in tags for _, tags in entry["classes"]):
+                    # Known from the cache only: executed on first use of the tag
+                    instances, error = self.load_file(name)
+                    if error is not None:
+                        print(f"  [!] Error loading {name}: {error}")
+                        entry["error"] = error
+                        continue
+                    self.instances[name] = instances
+            view = tuple(m for name in sorted(self.instances) for m in self.instances[name]
+                         if tag in m.tags and m.__class__.__name__ not in self.quarantined)
+            self.views = dict(self.views, **{tag: view})
+            return view
+
+    def __contains__(self, tag):
+        return tag in self.tags
+
+    def for_tags(self, command_tags):
+        self.release_due()
+        valid_mutators = list(self["generic"])
+        for tag in command_tags:
+            if tag in self.tags:
+                valid_mutators.extend(self[tag])
+        return valid_mutators
+
+    def available(self, tag=None):
+        """
+        Number of mutators for 'tag' (any tag if None), from file metadata,
+        without loading anything.
+        """
+        return sum(1 for entry in self.files.values() if entry["error"] is None
+                   for class_name, tags in entry["classes"]
+                   if (tag is None or tag in tags) and class_name not in self.quarantined)
+
+    def all(self):
+        return list({id(m): m for tag in self.tags for m in self[tag]}.values())
+
+    # --- Health ---
+
+    def record(self, mutator, seconds, failed=False, calls=1):
+        """
+        Called after mutate calls with the time spent inside them ('calls'
+        calls of seconds / calls each for a batch). Every QUARANTINE_WINDOW
+        calls the mutator is checked, and quarantined if too many of them
+        raised or were slow.
+        """
+        name = mutator.__class__.__name__
+        health = self.health.get(name)
+        if health is None:
+            health = self.health[name] = [0, 0, 0]
+        health[0] += calls
+        health[1] += calls if failed else 0
+        health[2] += calls if seconds / calls > MUTATOR_SLOW_SECONDS else 0
+        if health[0] < QUARANTINE_WINDOW:
+            return
+        calls, errors, slow = health
+        self.health[name] = [0, 0, 0]
+        if errors >= calls * QUARANTINE_ERROR_RATE:
+            self.quarantine(mutator, f"{errors}/{calls} calls raised")
+        elif slow >= calls * QUARANTINE_SLOW_RATE:
+            self.quarantine(mutator, f"{slow}/{calls} calls took over {MUTATOR_SLOW_SECONDS * 1000:g}ms")
+
+    def quarantine(self, mutator, reason):
+        name = mutator.__class__.__name__
+        with self.lock:
+            file_name = next((f for f, mutators in self.instances.items() if mutator in mutators), None)
+            if name in self.quarantined or file_name is None:
+                return
+            strikes = self.strikes[name] = self.strikes.get(name, 0) + 1
+            cooldown = min(QUARANTINE_COOLDOWN * 2 ** (strikes - 1), QUARANTINE_COOLDOWN_MAX)
+            until = time.time() + cooldown
+            self.quarantined[name] = (file_name, reason, until)
+            self.next_release = min(self.next_release, until)
+            self.views = {}
+            QUARANTINED.set(len(self.quarantined))
+        print(f"  [!] Quarantined mutator {name}: {reason} (probed again in {cooldown:g}s or when {file_name} changes)")
+
+    def release_due(self, now=None):
+        """
+        Puts mutators whose quarantine expired back in use, with a fresh
+        health window. Cheap when nothing is due, so it runs on every lookup.
+        """
+        now = now if now is not None else time.time()
+        if now < self.next_release:
+            return
+        with self.lock:
+            for name, (file_name, reason, until) in list(self.quarantined.items()):
+                if until <= now:
+                    del self.quarantined[name]
+                    self.health.pop(name, None)
+                    print(f"  [+] {name} released from quarantine for another probe (was: {reason})")
+            self.next_release = min((until for _, _, until in self.quarantined.values()), default=float("inf"))
+            self.views = {}
+            QUARANTINED.set(len(self.quarantined))
+
+    # --- Hot reload ---
+
+    def watch(self, interval=MUTATOR_RELOAD_INTERVAL):
+        if not interval or self.watcher is not None:
+            return
+        self.watcher = threading.Thread(target=self.watch_loop, args=(interval,), daemon=True,
+                                        name="mutator-watcher")
+        self.watcher.start()
+
+    def watch_loop(self, interval):
+        while not self.stopped.wait(interval):
+            try:
+                self.release_due()
+                if self.scan():
+                    print(f"  [+] Mutators reloaded from {self.directory}/: "
+                          + ", ".join(f"{tag}={len(self[tag])}" for tag in self.tags))
+            except Exception as e:
+                print(f"  [!] Mutator reload failed: {e}")
+
+    def close(self):
+        self.stopped.set()
+        if self.watcher is not None and self.watcher is not threading.current_thread():
+            self.watcher.join()
@@ -1,16 +1,25 @@
 import random
-from mutators.base_mutator import BaseMutator
+from base_mutator import BaseMutator
+from command_ir import lex, render, mutable_indices, WORD, SWITCH, VAR
 
 class ObfuscateCase(BaseMutator):
     tags = ["generic"]
     
     def mutate(self, data):
-        mutated_list = []
-        for char in data:
-            if char.isalpha():
-                #case sensitive and non-sensitive
-                mutated_list.append(random.choice([char.lower(), char.upper()]))
-            else:
-                mutated_list.append(char)
+        return render(self.mutate_tokens(lex(data)))
+
+    def mutate_tokens(self, tokens):
+        # Case is not significant in bare words, switches and variable names;
+        # quoted strings are left alone
+        mutated = list(tokens)
+        for i in mutable_indices(tokens, kinds=(WORD, SWITCH, VAR)):
+            mutated_list = []
+            for char in tokens[i].text:
+                if char.isalpha():
+                    #case sensitive and non-sensitive
+                    mutated_list.append(random.choice([char.lower(), char.upper()]))
+                else:
+                    mutated_list.append(char)
+            mutated[i] = tokens[i]._replace(text="".join(mutated_list))
         
-        return "".join(mutated_list)
\ No newline at end of file
+        return mutated
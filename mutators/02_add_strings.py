@@ -1,5 +1,6 @@
 import random
 from base_mutator import BaseMutator
+from command_ir import lex, render, mutable_indices
 
 class AddEscapeChars(BaseMutator):
     """
@@ -8,22 +9,29 @@ class AddEscapeChars(BaseMutator):
     tags = ["cmd"]
     
     def mutate(self, data):
-        parts = data.split(' ')
-        if not parts:
-            return data
+        return render(self.mutate_tokens(lex(data, "cmd")))
+
+    def mutate_tokens(self, tokens):
+        # Carets are only escapes outside "..." strings, so only bare words are touched
+        candidates = [i for i in mutable_indices(tokens) if len(tokens[i].text) > 1]
+        if not candidates:
+            return list(tokens)
+        mutated = list(tokens)
 
         # Insert words that have 1-3 word length
         for _ in range(random.randint(1, 3)):
-            idx_to_mutate = random.randint(0, len(parts) - 1)
-            word = parts[idx_to_mutate]
+            idx_to_mutate = random.choice(candidates)
+            word = mutated[idx_to_mutate].text
             
-            # Longer than 1
-            if len(word) > 1:
-                # Add one or two syntax
-                for _ in range(random.randint(1, 2)):
-                    split_point = random.randint(1, len(word) - 1)
-                    word = word[:split_point] + '^' + word[split_point:]
+            # Add one or two syntax
+            for _ in range(random.randint(1, 2)):
+                # Never split an escape pair (^x) or put a caret next to one ('^^' is a literal caret)
+                split_points = [p for p in range(1, len(word)) if word[p - 1] != "^" and word[p] != "^"]
+                if not split_points:
+                    break
+                split_point = random.choice(split_points)
+                word = word[:split_point] + '^' + word[split_point:]
             
-            parts[idx_to_mutate] = word
+            mutated[idx_to_mutate] = mutated[idx_to_mutate]._replace(text=word)
             
-        return " ".join(parts)
\ No newline at end of file
+        return mutated
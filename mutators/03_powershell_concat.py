@@ -1,5 +1,6 @@
 import random
 from base_mutator import BaseMutator
+from command_ir import Token, lex, render, WORD, STRING, OP, WS
 
 class PowerShellConcat(BaseMutator):
     """
@@ -9,24 +10,29 @@ class PowerShellConcat(BaseMutator):
     tags = ["powershell"]
 
     def mutate(self, data):
-        parts = data.split(' ')
-        if not parts: 
-            return data
+        return render(self.mutate_tokens(lex(data, "powershell")))
 
-        # Try to find a word to mutate
-        for _ in range(5): # Try 5 times
-            idx_to_mutate = random.randint(0, len(parts) - 1)
-            word = parts[idx_to_mutate]
-            
-            # Only mutate long words, not switches (starting with '-')
-            # and not already strings (starting with "'")
-            if len(word) > 4 and not word.startswith("-") and not word.startswith("'"):
-                split_point = random.randint(2, len(word) - 2) # Split in the middle
-                part1 = word[:split_point]
-                part2 = word[split_point:]
-                
-                # PowerShell string concatenation syntax
-                parts[idx_to_mutate] = f"('{part1}' + '{part2}')"
-                return " ".join(parts) # Return immediately when mutation succeeds
+    def mutate_tokens(self, tokens):
+        # Only mutate long bare words: switches, strings, variables and existing
+        # concatenations are separate tokens and never split. Escapes, member
+        # access and static calls would change meaning inside a string.
+        candidates = [
+            i for i, token in enumerate(tokens)
+            if token.kind == WORD and len(token.text) > 4
+            and "`" not in token.text and "::" not in token.text and not token.text.startswith(".")
+        ]
+        if not candidates:
+            return list(tokens) # Return original if no suitable word found
+
+        idx_to_mutate = random.choice(candidates)
+        word = tokens[idx_to_mutate].text
+        split_point = random.randint(2, len(word) - 2) # Split in the middle
+        part1 = word[:split_point]
+        part2 = word[split_point:]
         
-        return data # Return original if no suitable word found
\ No newline at end of file
+        # PowerShell string concatenation syntax
+        concat = [
+            Token(OP, "("), Token(STRING, f"'{part1}'"), Token(WS, " "), Token(OP, "+"),
+            Token(WS, " "), Token(STRING, f"'{part2}'"), Token(OP, ")"),
+        ]
+        return list(tokens[:idx_to_mutate]) + concat + list(tokens[idx_to_mutate + 1:])
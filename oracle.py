@@ -0,0 +1,331 @@
+"""
+Local detection oracle: a small Sigma-style rule engine that predicts
+whether a candidate command would be detected, before it is executed.
+
+Rules are read from RULES_DIR, one rule per .yml/.yaml file (needs PyYAML)
+or .json file (same structure), using the Sigma subset below:
+
+    title: Shadow copy deletion
+    detection:
+      selection_img:
+        Image|endswith: '\\vssadmin.exe'
+      selection_cli:
+        CommandLine|contains|all: ['delete', 'shadows']
+      keywords:
+        - 'wmic shadowcopy delete'
+      condition: (selection_img and selection_cli) or keywords
+
+Fields: CommandLine, Image, OriginalFileName (derived from the command).
+Modifiers: contains, startswith, endswith, re, all, windash. Matching is
+case-insensitive. Conditions: and / or / not, parentheses,
+'1 of <prefix>*', 'all of <prefix>*', '1 of them', 'all of them'.
+
+Each rule is evaluated against the raw command and its canonical form
+(carets removed, concatenations folded; see canonicalize.py), which is
+roughly what the launched process sees.
+"""
+import os
+import re
+import json
+import random
+
+from canonicalize import canonical_form
+
+try:
+    import yaml
+except ImportError:  # PyYAML is optional; JSON rules work without it
+    yaml = None
+
+# --- Oracle Defaults ---
+RULES_DIR = "rules"
+ORACLE_MODES = ("off", "drop", "defer")
+ORACLE_EXPLORATION_RATE = 0.05   # Share of predicted-detected candidates executed anyway
+ORACLE_DEFER_LIMIT = 10000       # Deferred candidates kept at most (oldest dropped)
+
+CONDITION_TOKEN_RE = re.compile(r"\(|\)|[^\s()]+")
+
+
+class RuleError(ValueError):
+    pass
+
+
+def command_fields(command):
+    """
+    Sigma fields for a command line: the process image is its first word.
+    """
+    command = command.strip()
+    if command.startswith('"'):
+        end = command.find('"', 1)
+        first = command[1:end if end > 0 else None]
+    else:
+        first = command.split(None, 1)[0] if command else ""
+    image = first.replace("/", "\\").rsplit("\\", 1)[-1]
+    if image and "." not in image:
+        image += ".exe"
+    return {
+        "CommandLine": command,
+        "Image": "\\" + image,
+        "OriginalFileName": image,
+    }
+
+
+def compile_value(value, modifiers):
+    """
+    One Sigma value with its modifiers as a predicate on a lowercased string.
+    """
+    if value is None:
+        return lambda text: text == ""
+    value = str(value)
+    if "re" in modifiers:
+        pattern = re.compile(value, re.IGNORECASE)
+        return lambda text: pattern.search(text) is not None
+    needle = value.lower()
+    variants = [needle]
+    if "windash" in modifiers and needle[:1] in "-/":
+        variants = ["-" + needle[1:], "/" + needle[1:]]
+    if "contains" in modifiers:
+        return lambda text: any(v in text for v in variants)
+    if "startswith" in modifiers:
+        return lambda text: any(text.startswith(v) for v in variants)
+    if "endswith" in modifiers:
+        return lambda text: any(text.endswith(v) for v in variants)
+    if "*" in needle or "?" in needle:
+        pattern = re.compile("^" + re.escape(needle).replace(r"\*", ".*").replace(r"\?", ".") + "$", re.DOTALL)
+        return lambda text: pattern.search(text) is not None
+    return lambda text: any(text == v for v in variants)
+
+
+def compile_field(key, values):
+    field, *modifiers = key.split("|")
+    values = values if isinstance(values, list) else [values]
+    predicates = [compile_value(v, modifiers) for v in values]
+    combine = all if "all" in modifiers else any
+
+    def match(fields):
+        text = fields.get(field)
+        if text is None:
+            return False  # Field not derivable from a command line: never predicted
+        text = text.lower()
+        return combine(p(text) for p in predicates)
+    return match
+
+
+def compile_search(definition):
+    """
+    A named search: a map (all fields must match), a list of maps (any),
+    or a list of keywords matched anywhere in the command line.
+    """
+    if isinstance(definition, dict):
+        fields = [compile_field(k, v) for k, v in definition.items()]
+        return lambda f: all(m(f) for m in fields)
+    if isinstance(definition, list):
+        if all(isinstance(item, dict) for item in definition):
+            alternatives = [compile_search(item) for item in definition]
+            return lambda f: any(m(f) for m in alternatives)
+        keyword = compile_field("CommandLine|contains", [str(k) for k in definition])
+        return keyword
+    return compile_field("CommandLine|contains", [str(definition)])
+
+
+class Rule:
+    def __init__(self, data, source=""):
+        self.title = data.get("title") or data.get("id") or source
+        self.source = source
+        detection = data.get("detection")
+        if not isinstance(detection, dict) or "condition" not in detection:
+            raise RuleError(f"{source}: missing detection/condition")
+        self.searches = {name: compile_search(d) for name, d in detection.items() if name != "condition"}
+        conditions = detection["condition"]
+        conditions = conditions if isinstance(conditions, list) else [conditions]
+        self.conditions = [self.parse_condition(c) for c in conditions]
+
+    def expand(self, pattern):
+        if pattern == "them":
+            names = list(self.searches)
+        elif pattern.endswith("*"):
+            names = [n for n in self.searches if n.startswith(pattern[:-1])]
+        else:
+            names = [pattern]
+        for name in names:
+            if name not in self.searches:
+                raise RuleError(f"{self.source}: unknown search '{name}'")
+        return [self.searches[n] for n in names]
+
+    def parse_condition(self, text):
+        """
+        Recursive descent over: or > and > not > (…) | 'N of X' | name.
+        """
+        tokens = CONDITION_TOKEN_RE.findall(str(text))
+        pos = [0]
+
+        def peek():
+            return tokens[pos[0]].lower() if pos[0] < len(tokens) else None
+
+        def take():
+            pos[0] += 1
+            return tokens[pos[0] - 1]
+
+        def parse_or():
+            terms = [parse_and()]
+            while peek() == "or":
+                take()
+                terms.append(parse_and())
+            return terms[0] if len(terms) == 1 else (lambda f: any(t(f) for t in terms))
+
+        def parse_and():
+            terms = [parse_not()]
+            while peek() == "and":
+                take()
+                terms.append(parse_not())
+            return terms[0] if len(terms) == 1 else (lambda f: all(t(f) for t in terms))
+
+        def parse_not():
+            if peek() == "not":
+                take()
+                inner = parse_not()
+                return lambda f: not inner(f)
+            return parse_atom()
+
+        def parse_atom():
+            token = peek()
+            if token is None:
+                raise RuleError(f"{self.source}: incomplete condition '{text}'")
+            if token == "(":
+                take()
+                inner = parse_or()
+                if peek() != ")":
+                    raise RuleError(f"{self.source}: unbalanced condition '{text}'")
+                take()
+                return inner
+            if token in ("1", "all", "any") and pos[0] + 1 < len(tokens) and tokens[pos[0] + 1].lower() == "of":
+                quantifier = take().lower()
+                take()
+                searches = self.expand(take())
+                if quantifier == "all":
+                    return lambda f: all(s(f) for s in searches)
+                return lambda f: any(s(f) for s in searches)
+            search = self.expand(take())[0]
+            return search
+
+        condition = parse_or()
+        if pos[0] != len(tokens):
+            raise RuleError(f"{self.source}: unexpected '{tokens[pos[0]]}' in condition '{text}'")
+        return condition
+
+    def matches(self, fields):
+        return any(condition(fields) for condition in self.conditions)
+
+
+def load_rules(rules_dir=RULES_DIR):
+    """
+    Loads every rule file in 'rules_dir'. Returns (rules, errors).
+    """
+    rules, errors = [], []
+    if not os.path.isdir(rules_dir):
+        return rules, errors
+    for filename in sorted(os.listdir(rules_dir)):
+        path = os.path.join(rules_dir, filename)
+        lower = filename.lower()
+        try:
+            if lower.endswith((".yml", ".yaml")):
+                if yaml is None:
+                    errors.append(f"{filename}: PyYAML is not installed (use .json rules or 'pip install pyyaml')")
+                    continue
+                with open(path, "r", encoding="utf-8") as f:
+                    documents = [d for d in yaml.safe_load_all(f) if d]
+            elif lower.endswith(".json"):
+                with open(path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                documents = data if isinstance(data, list) else [data]
+            else:
+                continue
+            for document in documents:
+                rules.append(Rule(document, filename))
+        except Exception as e:
+            errors.append(f"{filename}: {e}")
+    return rules, errors
+
+
+class DetectionOracle:
+    """
+    Predicts detection of a candidate from the local rules. predict()
+    returns the titles of the rules that match (empty if none).
+    """
+    def __init__(self, rules_dir=RULES_DIR, mode="drop", exploration_rate=ORACLE_EXPLORATION_RATE):
+        self.rules_dir = rules_dir
+        self.mode = mode
+        self.exploration_rate = exploration_rate
+        self.rules, self.errors = load_rules(rules_dir)
+        self.stats = {"screened": 0, "predicted": 0, "dropped": 0, "explored": 0, "deferred": 0}
+
+    def __len__(self):
+        return len(self.rules)
+
+    def predict(self, command, tags):
+        self.stats["screened"] += 1
+        views = [command_fields(command)]
+        canonical = canonical_form(command, tags)
+        if canonical != command.lower():
+            views.append(command_fields(canonical))
+        matched = [rule.title for rule in self.rules if any(rule.matches(v) for v in views)]
+        if matched:
+            self.stats["predicted"] += 1
+        return matched
+
+    def explore(self):
+        """
+        True for the share of predicted-detected candidates that are executed
+        anyway, so the oracle's accuracy keeps being measured.
+        """
+        if random.random() < self.exploration_rate:
+            self.stats["explored"] += 1
+            return True
+        return False
+
+
+class OracleAccuracy:
+    """
+    Confusion matrix of oracle predictions against SIEM verdicts, overall
+    and per rule. Persisted like the latency histogram.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.matrix = {"tp": 0, "fp": 0, "tn": 0, "fn": 0}
+        self.per_rule = {}      # title -> {"predicted": n, "confirmed": n}
+        self.dirty = False
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            self.matrix.update(data.get("matrix", {}))
+            self.per_rule = data.get("per_rule", {})
+        except (FileNotFoundError, ValueError):
+            pass
+
+    def observe(self, rules, detected):
+        predicted = bool(rules)
+        key = ("tp" if detected else "fp") if predicted else ("fn" if detected else "tn")
+        self.matrix[key] += 1
+        for title in rules:
+            counts = self.per_rule.setdefault(title, {"predicted": 0, "confirmed": 0})
+            counts["predicted"] += 1
+            counts["confirmed"] += int(bool(detected))
+        self.dirty = True
+
+    def summary(self):
+        m = self.matrix
+        total = sum(m.values())
+        if not total:
+            return "no samples"
+        precision = m["tp"] / (m["tp"] + m["fp"]) if m["tp"] + m["fp"] else 0.0
+        recall = m["tp"] / (m["tp"] + m["fn"]) if m["tp"] + m["fn"] else 0.0
+        return (f"{total} samples, precision {precision:.2f}, recall {recall:.2f} "
+                f"(tp {m['tp']}, fp {m['fp']}, tn {m['tn']}, fn {m['fn']})")
+
+    def save(self):
+        if not self.dirty:
+            return
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"matrix": self.matrix, "per_rule": self.per_rule}, f, indent=2)
+        os.replace(tmp_path, self.path)
+        self.dirty = False
@@ -1,20 +1,40 @@
 import os
-import subprocess
+import json
 import random
 import time
-import importlib.util
-from pathlib import Path
-import hashlib
 import uuid
 import argparse 
+import socket
+import queue
+import logging
+import multiprocessing
+from executor import (ExecutionEngine, OrderedWriter, WorkdirPool, run_details,
+                      DEFAULT_WORKERS, DEFAULT_TIMEOUT, OUTPUT_CAP, WORKDIR_SPARES)
+from interp_pool import InterpreterPool, PERSISTENT_TAGS
+from oracle import DetectionOracle, RULES_DIR, ORACLE_MODES, ORACLE_EXPLORATION_RATE, ORACLE_DEFER_LIMIT
+from collections import deque
+from queue_log import QueueLogWriter, import_legacy_queue
+from hash_store import DedupStore
+from canonicalize import CanonicalBudget, CANONICAL_BUDGET
+from corpus_store import CorpusStore
+from coordinator import RemoteCorpus, RemoteQueueLog
+from scheduler import SeedScheduler, MutatorBandit
+from command_ir import lex, render
+from mutator_registry import MutatorRegistry
+from metrics import REGISTRY, LOG_LEVELS, setup_logging, start_monitoring, milliseconds
 
 # Configuration
-SEED_DIR = "seeds"
+SEED_DIR = "seeds"                 # Seed files, imported into the corpus store on first run
+CORPUS_DB = "corpus.db"            # Indexed corpus shared with the consumer
+CORPUS_RELOAD_INTERVAL = 5         # Seconds between incremental corpus refreshes
 MUTATOR_DIR = "mutators"           # Mode 0 (default)
 CUSTOM_MUTATOR_DIR = "custom_mutators" # Mode 1 (custom)
 TEMP_WORKDIR = "temp_workdirs"     # Temporary directory for tagging runs by ID
-INTERESTING_DIR = "interesting_finds"
-HAVOC_MUTATION_STEPS = 3 
+HAVOC_MUTATION_STEPS = 3          # Max stack depth; the bandit picks the depth per tag
+GENERATION_BATCH = 16              # Havoc chains derived from each chosen seed
+PIPELINE_QUEUE_SIZE = 512          # Pre-deduplicated candidates buffered ahead of the executors
+BUDGET_BACKOFF = 0.05              # Pause after a round with nothing to run (budget refused all, no mutators) ...
+BUDGET_BACKOFF_MAX = 2.0           # ... doubled per such round in a row, up to this many seconds
 
 # --- Priority Flags ---
 PRIO_1_BYPASS_SUCCESS = 1
@@ -22,257 +42,673 @@ PRIO_2_BYPASS_FAIL = 2
 PRIO_3_DETECTED_OR_ERROR = 3
 
 # --- Communication Files ---
-QUEUE_FILE = "queue.txt"
-HASH_FILE = "tested_hashes.txt"
+QUEUE_DIR = "queue_log"            # Append-only segment log read by the consumer
+QUEUE_FILE = "queue.txt"           # Legacy text queue, imported into QUEUE_DIR once
+HASH_STORE = "tested_hashes"       # Binary dedup store (.idx/.log/.bloom)
+HASH_FILE = "tested_hashes.txt"    # Legacy hex list, imported into HASH_STORE once
+BUDGET_FILE = "tested_hashes.budget" # Spent executions per canonical form (bounded counter table)
+PENDING_FILE = "pending_candidates.jsonl" # Pipeline candidates still queued at shutdown, resumed on the next start
+DEDUP_USE_BLOOM = True
+
+# --- Metrics (see metrics.py; served with --metrics-port) ---
+log = logging.getLogger("purplefuzz.producer")
+MUTATION_SECONDS = REGISTRY.histogram("purplefuzz_mutation_seconds", "Time to derive havoc chains from one seed",
+                                      ["call"])
+MUTANTS = REGISTRY.counter("purplefuzz_mutants_total", "Mutants derived from seeds")
+MUTATOR_ERRORS = REGISTRY.counter("purplefuzz_mutator_errors_total", "Mutator calls that raised", ["mutator"])
+CANDIDATES = REGISTRY.counter("purplefuzz_candidates_total", "Mutants by dedup and oracle outcome", ["result"])
+EXECS = REGISTRY.counter("purplefuzz_execs_total", "Executed candidates by outcome", ["result"])
+EXEC_SECONDS = REGISTRY.histogram("purplefuzz_exec_seconds", "Command execution time", ["tag"])
+IN_FLIGHT = REGISTRY.gauge("purplefuzz_execs_in_flight", "Candidates currently executing")
+QUEUE_WRITES = REGISTRY.counter("purplefuzz_queue_writes_total", "Records appended to the queue log")
+QUEUE_WRITE_SECONDS = REGISTRY.histogram("purplefuzz_queue_write_seconds", "Time to append one queue record")
+PIPELINE_DEPTH = REGISTRY.gauge("purplefuzz_pipeline_depth", "Candidates buffered between generation and execution")
+SEEDS = REGISTRY.gauge("purplefuzz_seeds", "Seeds in the scheduler's priority bins")
 
 class ProducerFuzzer:
-    def __init__(self, mutator_mode):
+    def __init__(self, mutator_mode, workers=DEFAULT_WORKERS, timeout=DEFAULT_TIMEOUT, canonical_budget=CANONICAL_BUDGET,
+                 execute=True, generate=True, persistent=False, persistent_tags=PERSISTENT_TAGS,
+                 oracle_mode="off", rules_dir=RULES_DIR, exploration_rate=ORACLE_EXPLORATION_RATE,
+                 coordinator=None, producer_id=None, output_cap=OUTPUT_CAP):
+        """
+        'execute' sets up the execution engine and queue log, 'generate' the
+        corpus, mutators and dedup stores. Inline mode does both in one
+        process; with --pipeline the generation stage runs in a separate
+        process (generation_stage) and feeds this one through a queue.
+
+        With a 'coordinator' address the corpus, dedup store, canonical
+        budget and queue log are the coordinator's (see coordinator.py), so
+        any number of producers can share them.
+        """
         print(f"Initializing Producer in Mutator Mode: {mutator_mode}")
         self.mutator_mode = mutator_mode
+        self.engine = None
+        self.dedup = None
+        self.canonical_budget = None
+        self.stalls = 0
+        self.oracle = None
+        self.coordinator = coordinator
+        self.producer_id = producer_id or f"{socket.gethostname()}-{os.getpid()}"
 
-        self.corpus_by_prio = {
-            PRIO_1_BYPASS_SUCCESS: [], # List for Prio 1
-            PRIO_2_BYPASS_FAIL: [],    # List for Prio 2
-            PRIO_3_DETECTED_OR_ERROR: [] # List for Prio 3 (original seeds)
-        }
-        
-        self.mutators = {
-            "generic": [],
-            "cmd": [],
-            "powershell": []
-        }
+        if execute:
+            # Bounded pool of concurrent executions; queue lines are committed in generation order
+            print(f"Execution engine: {workers} worker(s), {timeout}s timeout per command")
+            interpreter_pool = None
+            if persistent:
+                # Long-lived interpreters; each command still runs inside its correlation directory
+                interpreter_pool = InterpreterPool(timeout=timeout, tags=persistent_tags, output_cap=output_cap)
+                print(f"Persistent interpreters for {', '.join(interpreter_pool.tags)} seeds: "
+                      f"{interpreter_pool.interpreters}")
+                if set(interpreter_pool.tags) & {"cmd", "powershell"}:
+                    print("  [!] Persistent cmd/powershell runs never show the command as a process CommandLine; "
+                          "rules matching on it will not fire for them")
+            self.engine = ExecutionEngine(workers=workers, timeout=timeout, interpreter_pool=interpreter_pool,
+                                          output_cap=output_cap)
+            # Correlation directories: pre-created, renamed per run, removed in the background
+            self.workdirs = WorkdirPool(TEMP_WORKDIR, spares=max(WORKDIR_SPARES, 2 * workers))
+            if coordinator:
+                # Records go to the coordinator's central queue log, read by one consumer
+                self.queue_log = RemoteQueueLog(coordinator, self.producer_id)
+            else:
+                self.queue_log = QueueLogWriter(QUEUE_DIR)
+                for legacy_file in (QUEUE_FILE, "queue.processing.txt"):
+                    imported = import_legacy_queue(legacy_file, self.queue_log)
+                    if imported:
+                        print(f"Imported {imported} records from legacy {legacy_file} into {QUEUE_DIR}/")
+            self.queue_writer = OrderedWriter(self.write_record)
+
+        # Priority bins with per-seed energy (exec count, bypass yield, recency)
+        self.scheduler = SeedScheduler()
+        # Mutator and stack-depth choice per tag, learned from consumer verdicts
+        self.bandit = MutatorBandit(HAVOC_MUTATION_STEPS)
         
-        # Load "memory" of tested hashes
-        self.tested_hashes = set()
-        if os.path.exists(HASH_FILE):
-            with open(HASH_FILE, 'r') as f:
-                self.tested_hashes = set(line.strip() for line in f)
+        # Plugins by tag, loaded lazily and hot-reloaded (see load_mutators)
+        self.mutators = MutatorRegistry(MUTATOR_DIR if mutator_mode == 0 else CUSTOM_MUTATOR_DIR)
         
-        self.hash_file_handle = open(HASH_FILE, 'a') # Open file for appending
+        if generate and coordinator:
+            # Dedup happens centrally (claim()); the local budget only caches what was spent
+            self.canonical_budget = CanonicalBudget(canonical_budget)
+            print(f"Dedup store and canonical budget: coordinator at {coordinator}")
+        elif generate:
+            # Load "memory" of tested hashes (memory-mapped, no full read at startup)
+            first_run = not os.path.exists(HASH_STORE + ".idx") and not os.path.exists(HASH_STORE + ".log")
+            self.dedup = DedupStore(HASH_STORE, use_bloom=DEDUP_USE_BLOOM)
+            if first_run and os.path.exists(HASH_FILE):
+                imported = self.dedup.import_text_file(HASH_FILE)
+                print(f"Imported {imported} hashes from legacy {HASH_FILE}")
+            print(f"Dedup store holds {len(self.dedup)} tested mutants.")
+
+            # Semantic dedup: executions allowed per canonical form (per tag canonicalizer)
+            self.canonical_budget = CanonicalBudget(canonical_budget, BUDGET_FILE)
+
+        if generate and oracle_mode != "off":
+            # Local pre-screen: candidates the rules in 'rules_dir' predict as detected are
+            # dropped (or deferred) except for an exploration share
+            self.oracle = DetectionOracle(rules_dir, mode=oracle_mode, exploration_rate=exploration_rate)
+            self.deferred = deque(maxlen=ORACLE_DEFER_LIMIT)
+            print(f"Detection oracle ({oracle_mode}): {len(self.oracle)} rules from {rules_dir}/, "
+                  f"exploration rate {exploration_rate}")
+            for error in self.oracle.errors:
+                print(f"  [!] Rule not loaded: {error}")
         
         # Ensure all required directories exist
-        os.makedirs(INTERESTING_DIR, exist_ok=True)
         os.makedirs(MUTATOR_DIR, exist_ok=True)
         os.makedirs(CUSTOM_MUTATOR_DIR, exist_ok=True) # Custom mutators directory
         os.makedirs(SEED_DIR, exist_ok=True)
         os.makedirs(TEMP_WORKDIR, exist_ok=True) # Temporary workdir for per-run IDs
 
     def load_mutators(self):
-        try:
-            from base_mutator import BaseMutator
-            print("Loaded BaseMutator from root directory.")
-        except ImportError:
-            print("[ERROR] 'base_mutator.py' not found.")
-            print("Please move 'base_mutator.py' to the same directory as 'producer.py'.")
-            exit(1)
-
+        """
+        Scans the selected mutator directory. Files unchanged since the last
+        run are only executed once a seed with one of their tags is mutated;
+        edits are picked up while running.
+        """
         # Select which directory to scan based on mode
         if self.mutator_mode == 0:
-            mutator_dir_path = MUTATOR_DIR
             print(f"Loading DEFAULT mutators from: {MUTATOR_DIR}...")
         else: # mode == 1
-            mutator_dir_path = CUSTOM_MUTATOR_DIR
             print(f"Loading CUSTOM mutators from: {CUSTOM_MUTATOR_DIR}...")
-        
-        mutator_files = list(Path(mutator_dir_path).glob("*.py"))
-
-        for py_file in mutator_files:
-            if py_file.name in ["__init__.py"]: 
-                continue
-
-            try:
-                spec = importlib.util.spec_from_file_location(py_file.stem, py_file)
-                module = importlib.util.module_from_spec(spec)
-                spec.loader.exec_module(module)
-
-                for attribute_name in dir(module):
-                    attribute = getattr(module, attribute_name)
-                    if isinstance(attribute, type) and issubclass(attribute, BaseMutator) and attribute is not BaseMutator:
-                        instance = attribute()
-                        for tag in instance.tags:
-                            if tag in self.mutators:
-                                self.mutators[tag].append(instance)
-                                print(f"  [+] Loaded: {py_file.stem} (Tag: {tag})")
-                            else:
-                                print(f"  [!] Undefined tag '{tag}' in {py_file.stem}")
-            except Exception as e:
-                print(f"  [!] Error loading {py_file.name}: {e}")
+        self.mutators.scan()
+        print("  Mutators per tag: " + ", ".join(f"{tag}={self.mutators.available(tag)}" for tag in self.mutators.tags))
+        self.mutators.watch()
 
     def load_seeds(self):
-        print(f"\nLoading seeds from directory: {SEED_DIR}")
-        loaded_count = 0
-        for filename in os.listdir(SEED_DIR):
-            if not filename.endswith(".txt"): 
-                continue
-                
-            try:
-                tags = []
-                if filename.lower().startswith("ps_"):
-                    tags.append("powershell")
-                elif filename.lower().startswith("cmd_"):
-                    tags.append("cmd")
-                else:
-                    tags.append("generic")
-
-                with open(os.path.join(SEED_DIR, filename), 'r', encoding='utf-8') as f:
-                    command = f.read().strip()
-                    if command:
-                        
-                        priority = PRIO_3_DETECTED_OR_ERROR 
-                        if "_fuzzed_prio_1" in filename:
-                            priority = PRIO_1_BYPASS_SUCCESS
-                        elif "_fuzzed_prio_2" in filename:
-                            priority = PRIO_2_BYPASS_FAIL
-
-                        self.corpus_by_prio[priority].append({
-                            "cmd": command,
-                            "tags": tags
-                        })
-                        loaded_count += 1
-            except Exception as e:
-                print(f"  [!] Error reading file {filename}: {e}")
+        """
+        Loads the corpus store. On first use it is filled from the 'seeds'
+        directory (same filename conventions as before).
+        """
+        if self.coordinator:
+            # Seed changes are pushed by the coordinator (long poll) instead of read from the DB
+            print(f"\nLoading seeds from coordinator: {self.coordinator}")
+            self.corpus = RemoteCorpus(self.coordinator, self.producer_id)
+        else:
+            print(f"\nLoading seeds from corpus store: {CORPUS_DB}")
+            self.corpus = CorpusStore(CORPUS_DB)
+            if len(self.corpus) == 0:
+                imported = self.corpus.import_dir(SEED_DIR)
+                print(f"Imported {imported} seed files from directory: {SEED_DIR}")
+
+        self.seed_by_id = {}
+        self.corpus_rev = 0
+        loaded_count = self.refresh_seeds()
         
         if loaded_count == 0:
             print("[ERROR] No seeds found. Please add .txt files to the 'seeds' directory.")
             exit(1)
         print(f"Loaded {loaded_count} seeds into priority bins.")
 
+    def refresh_seeds(self):
+        """
+        Applies corpus rows added, re-prioritized or given new execution
+        feedback since the last refresh, so finds and stats written by the
+        consumer reach the running producer's scheduler.
+        """
+        rows, self.corpus_rev = self.corpus.changes_since(self.corpus_rev)
+        now = time.time()
+        self.last_corpus_refresh = now
+        added = removed = 0
+        for row in rows:
+            seed = self.seed_by_id.get(row["id"])
+            if row["evicted"]:
+                # Distilled away or evicted from a full bin
+                if seed is not None:
+                    self.scheduler.remove(seed)
+                    del self.seed_by_id[row["id"]]
+                    removed += 1
+                continue
+            if seed is None:
+                seed = {"id": row["id"], "cmd": row["cmd"], "tags": [row["tag"]], "priority": row["priority"],
+                        "execs": row["execs"], "bypasses": row["bypasses"], "added_at": row["added_at"]}
+                self.seed_by_id[row["id"]] = seed
+                self.scheduler.add(seed, now)
+                added += 1
+            else:
+                seed["priority"] = row["priority"]
+                seed["execs"] = row["execs"]
+                seed["bypasses"] = row["bypasses"]
+                self.scheduler.update(seed, now)
+        if removed:
+            print(f"  [-] Dropped {removed} evicted seeds.")
+        self.scheduler.refresh_recency(now)
+        self.bandit.load(self.corpus.arm_stats())
+        return added
+
     def choose_seed(self):
         """
         Chooses a seed by:
         1. Selecting a priority level (Prio 1, 2, 3) based on weights.
-        2. Randomly choosing a seed FROM that level.
+        2. Choosing a seed FROM that level proportionally to its energy.
         """
-        priority_levels = [PRIO_1_BYPASS_SUCCESS, PRIO_2_BYPASS_FAIL, PRIO_3_DETECTED_OR_ERROR]
-        priority_weights = [0.60, 0.30, 0.10]
-        
-        available_levels = []
-        available_weights = []
-        
-        for i in range(len(priority_levels)):
-            prio = priority_levels[i]
-            if self.corpus_by_prio[prio]: # Check if the list is not empty
-                available_levels.append(prio)
-                available_weights.append(priority_weights[i])
-
-        if not available_levels:
-            # This can happen if only Prio 1/2 exist and they get depleted
-            # Fallback to Prio 3
-            if self.corpus_by_prio[PRIO_3_DETECTED_OR_ERROR]:
-                available_levels = [PRIO_3_DETECTED_OR_ERROR]
-                available_weights = [1.0]
-            else:
-                print("[ERROR] All seed bins are empty. Stopping.")
-                exit(1)
-            
-        chosen_priority = random.choices(available_levels, weights=available_weights, k=1)[0]
-        chosen_seed_data = random.choice(self.corpus_by_prio[chosen_priority])
-        
+        chosen_seed_data = self.scheduler.sample()
+        if chosen_seed_data is None:
+            print("[ERROR] All seed bins are empty. Stopping.")
+            exit(1)
         return chosen_seed_data 
 
-    def apply_havoc_mutations(self, command, command_tags):
-        num_steps = random.randint(1, HAVOC_MUTATION_STEPS)
+    def valid_mutators(self, command_tags):
+        return self.mutators.for_tags(command_tags)
+
+    def plan_havoc(self, seed_tag, valid_mutators):
+        """
+        Mutators of one havoc chain: depth and each step chosen by the bandit.
+        """
+        num_steps = self.bandit.choose_depth(seed_tag)
+        return [self.bandit.choose_mutator(seed_tag, valid_mutators) for _ in range(num_steps)]
+
+    def run_havoc_chain(self, plan, seed_tag, command=None, tokens=None, chain=None):
+        """
+        Applies the mutators in 'plan' to a command given as a string or as
+        tokens. Token-level mutators pass the lexed command (command_ir) along
+        the chain; the string is only rendered and re-lexed around
+        string-only mutators. Returns (mutated command, names of the
+        mutators applied, in order).
+        """
         mutated_command = command
-        
-        valid_mutators = list(self.mutators["generic"])
-        for tag in command_tags:
-            if tag in self.mutators:
-                valid_mutators.extend(self.mutators[tag])
-        
+        chain = list(chain or [])
+        for selected_mutator in plan:
+            # Only the mutator's own calls count towards its health, not lexing and rendering
+            spent = 0.0
+            try:
+                mutated_tokens = None
+                if selected_mutator.supports_tokens():
+                    if tokens is None:
+                        tokens = lex(mutated_command, seed_tag)
+                    started = time.perf_counter()
+                    mutated_tokens = selected_mutator.mutate_tokens(tokens)
+                    spent += time.perf_counter() - started
+                if mutated_tokens is not None:
+                    tokens = mutated_tokens
+                    mutated_command = None
+                else:
+                    if mutated_command is None:
+                        mutated_command = render(tokens)
+                    started = time.perf_counter()
+                    mutated_command = selected_mutator.mutate(mutated_command)
+                    spent += time.perf_counter() - started
+                    tokens = None
+            except Exception as e:
+                self.mutators.record(selected_mutator, spent, failed=True)
+                MUTATOR_ERRORS.inc(mutator=selected_mutator.__class__.__name__)
+                log.error("[ERROR] Mutator %s failed: %s", selected_mutator.__class__.__name__, e)
+                break
+            self.mutators.record(selected_mutator, spent)
+            chain.append(selected_mutator.__class__.__name__)
+                
+        return (mutated_command if mutated_command is not None else render(tokens)), chain
+
+    def apply_havoc_mutations(self, command, command_tags, tokens=None):
+        """
+        Stacks mutators on the command. Depth and each mutator are chosen by
+        the bandit for the seed's tag. Returns (mutated command, chain).
+        """
+        seed_tag = command_tags[0] if command_tags else "generic"
+        valid_mutators = self.valid_mutators(command_tags)
+        if not valid_mutators:
+            return command, []
+        with MUTATION_SECONDS.time(call="single"):
+            plan = self.plan_havoc(seed_tag, valid_mutators)
+            if tokens is not None:
+                mutated = self.run_havoc_chain(plan, seed_tag, tokens=tokens)
+            else:
+                mutated = self.run_havoc_chain(plan, seed_tag, command=command)
+        MUTANTS.inc()
+        return mutated
+
+    def apply_havoc_batch(self, command, command_tags, tokens, count):
+        """
+        'count' havoc chains from one seed. Chains are planned up front and
+        grouped by their first mutator, whose step is done for the whole
+        group at once: token-level mutators reuse the seed's cached tokens,
+        string-only ones get a single mutate_batch() call.
+        """
+        seed_tag = command_tags[0] if command_tags else "generic"
+        valid_mutators = self.valid_mutators(command_tags)
         if not valid_mutators:
-            return mutated_command
+            return []
+        with MUTATION_SECONDS.time(call="batch"):
+            results = self.run_havoc_batch(command, seed_tag, valid_mutators, tokens, count)
+        MUTANTS.inc(len(results))
+        return results
+
+    def run_havoc_batch(self, command, seed_tag, valid_mutators, tokens, count):
+        groups = {}
+        for _ in range(count):
+            plan = self.plan_havoc(seed_tag, valid_mutators)
+            groups.setdefault(id(plan[0]), []).append(plan)
 
-        for _ in range(num_steps):
-            selected_mutator = random.choice(valid_mutators)
+        results = []
+        for plans in groups.values():
+            first = plans[0][0]
+            name = first.__class__.__name__
+            started = time.perf_counter()
             try:
-                mutated_command = selected_mutator.mutate(mutated_command)
+                if first.supports_tokens():
+                    # A declined token step (None) falls back to mutate() on the seed string
+                    starts = [(None, mutated) if mutated is not None else (first.mutate(command), None)
+                              for mutated in (first.mutate_tokens(tokens) for _ in plans)]
+                else:
+                    starts = [(text, None) for text in first.mutate_batch(command, len(plans), random)]
             except Exception as e:
-                print(f"[ERROR] Mutator {selected_mutator.__class__.__name__} failed: {e}")
-                return mutated_command
-                
-        return mutated_command
+                self.mutators.record(first, time.perf_counter() - started, failed=True)
+                MUTATOR_ERRORS.inc(mutator=name)
+                log.error("[ERROR] Mutator %s failed: %s", name, e)
+                continue
+            self.mutators.record(first, time.perf_counter() - started, calls=len(plans))
+            for plan, (text, start_tokens) in zip(plans, starts):
+                results.append(self.run_havoc_chain(plan[1:], seed_tag, text, start_tokens, chain=[name]))
+        return results
+
+    def generate_candidates(self, batch_size=GENERATION_BATCH):
+        """
+        One generation step: picks a seed, derives 'batch_size' havoc chains
+        from it and returns the mutants that pass both dedup stages, as
+        candidate dicts ready for execution.
+        """
+        seeds_pushed = self.coordinator and self.corpus.news.is_set()
+        if seeds_pushed or time.time() - self.last_corpus_refresh >= CORPUS_RELOAD_INTERVAL:
+            added = self.refresh_seeds()
+            if added:
+                print(f"  [+] Picked up {added} new seeds from the corpus store.")
+
+        seed_data = self.choose_seed()
+        original_command = seed_data["cmd"]
+        command_tags = seed_data["tags"]
+        if not self.valid_mutators(command_tags):
+            # Every mutator for these tags is quarantined or failed to load
+            self.backoff("No active mutators for tags %s (quarantined ones are probed again after a cooldown)",
+                         ", ".join(command_tags))
+            return []
+        if "tokens" not in seed_data:
+            # Lexed once per seed, shared by every havoc chain started from it
+            seed_data["tokens"] = lex(original_command, command_tags[0])
+
+        pending = []
+        changed = over_budget = 0
+        use_budget = self.coordinator or self.canonical_budget.budget > 0
+        for mutated_command, chain in self.apply_havoc_batch(original_command, command_tags, seed_data["tokens"], batch_size):
+            if mutated_command == original_command:
+                CANDIDATES.inc(result="unchanged")
+                continue
+            changed += 1
+
+            # --- Deduplication ---
+            # Skip mutants whose canonical form (case, carets, concatenations) used up its budget.
+            # Without a budget (the default) no key is needed, unless the coordinator applies its own.
+            canonical_key = None
+            if use_budget:
+                canonical_key = self.canonical_budget.key_for(mutated_command, command_tags)
+                if not self.canonical_budget.allows(canonical_key):
+                    CANDIDATES.inc(result="canonical_budget")
+                    over_budget += 1
+                    continue
+
+            candidate = {"cmd": mutated_command, "tags": command_tags, "seed_id": seed_data["id"], "mutators": chain}
+
+            # --- Local oracle ---
+            # Rules that match are recorded so the consumer can score the prediction
+            if self.oracle is not None:
+                candidate["oracle"] = self.oracle.predict(mutated_command, command_tags)
+                if candidate["oracle"] and not self.oracle.explore():
+                    if self.oracle.mode == "defer":
+                        self.deferred.append((candidate, canonical_key))
+                        self.oracle.stats["deferred"] += 1
+                        CANDIDATES.inc(result="oracle_defer")
+                    else:
+                        self.oracle.stats["dropped"] += 1
+                        CANDIDATES.inc(result="oracle_drop")
+                    continue
+
+            pending.append((candidate, canonical_key))
+
+        candidates = self.claim(pending)
+        if not candidates and self.oracle is not None and self.deferred:
+            # Nothing new from this seed: run one predicted-detected candidate instead
+            candidates = self.claim([self.deferred.popleft()])
+        if not candidates:
+            self.budget_backoff(changed, over_budget)
+        else:
+            self.stalls = 0
+        return candidates
+
+    def budget_backoff(self, changed, over_budget):
+        """
+        Pauses after a round in which the canonical budget refused every
+        mutant, doubling the pause while it keeps happening, instead of
+        spinning through seeds that have nothing left to run.
+        """
+        if not changed or over_budget < changed:
+            self.stalls = 0
+            return
+        self.backoff("Canonical budget (%s per form) refused every mutant "
+                     "(raise -b/--canon-budget, 0=unlimited, or add seeds)", self.canonical_budget.budget)
+
+    def backoff(self, reason, *args):
+        """
+        Logs why a round produced nothing to run and pauses, doubling the
+        pause for every such round in a row (see BUDGET_BACKOFF).
+        """
+        self.stalls += 1
+        delay = min(BUDGET_BACKOFF * 2 ** min(self.stalls - 1, 16), BUDGET_BACKOFF_MAX)
+        log.warning("  [!] " + reason + ", %s rounds in a row, pausing %.2fs", *args, self.stalls, delay)
+        time.sleep(delay)
+
+    def claim(self, pending):
+        """
+        Exact dedup and canonical budget for (candidate, canonical key) pairs,
+        in order. Returns the candidates that were never executed before; the
+        stores record them. With a coordinator the whole batch is claimed in
+        one round trip against the shared stores.
+        """
+        if not pending:
+            return []
+        claimed = self.corpus.claim([(c["cmd"], key) for c, key in pending]) if self.coordinator else None
+        candidates = []
+        for i, (candidate, canonical_key) in enumerate(pending):
+            if claimed is None:
+                if not self.canonical_budget.allows(canonical_key):
+                    CANDIDATES.inc(result="canonical_budget")
+                    continue
+                # Digest is appended to the store in batches
+                fresh = self.dedup.add_text(candidate["cmd"])
+            else:
+                fresh = claimed[i]
+            CANDIDATES.inc(result="new" if fresh else "duplicate")
+            if fresh:
+                self.canonical_budget.spend(canonical_key)
+                candidates.append(candidate)
+        return candidates
 
-    def execute_command(self, command_string, cwd=None):
+    def execute_command(self, command_string, cwd=None, tag="generic"):
         """
-        Executes a command in a specified directory (cwd).
+        Executes a command in a specified directory (cwd) and returns its
+        RunResult. The whole process tree is killed if it exceeds the
+        engine timeout.
         """
-        print(f"  [>] Executing (in dir {cwd}): {command_string[:100]}...")
+        log.debug("  [>] Executing (in dir %s): %s...", cwd, command_string[:100])
+        with EXEC_SECONDS.time(tag=tag):
+            result = self.engine.run(command_string, cwd=cwd, tag=tag)
+        if result.error is not None:
+            EXECS.inc(result="error")
+            log.warning("  [-] Execution error: %s", result.error)
+        elif result.timed_out:
+            EXECS.inc(result="timeout")
+            log.info("  [-] Execution error: timed out after %ss (process tree killed)", self.engine.timeout)
+        elif result.returncode != 0:
+            EXECS.inc(result="failed")
+            log.debug("  [-] Command failed (Error: %s...)", result.stderr[:100])
+        else:
+            EXECS.inc(result="success")
+        return result
+
+    def write_record(self, record):
+        # Called by the OrderedWriter, in generation order
+        with QUEUE_WRITE_SECONDS.time():
+            self.queue_log.append(record)
+        QUEUE_WRITES.inc()
+
+    def run_candidate(self, seq, correlation_id, mutated_command, command_tags, seed_id=None, chain=None, oracle=None):
+        """
+        Worker body: executes one mutant inside its correlation directory
+        and hands the queue record to the ordered writer.
+        """
+        record = None
+        IN_FLIGHT.inc()
         try:
-            result = subprocess.run(
-                command_string, 
-                shell=True, 
-                capture_output=True, 
-                text=True, 
-                timeout=10,
-                encoding='utf-8',
-                cwd=cwd 
-            )
-            if result.returncode != 0:
-                print(f"  [-] Command failed (Error: {result.stderr[:100]}...)")
-            return result.returncode == 0
+            # Temporary directory named by correlation ID
+            try:
+                temp_dir_path = self.workdirs.acquire(correlation_id)
+            except Exception as e:
+                log.error("[ERROR] Could not create temp dir: %s", e)
+                return
+
+            # --- Execute ---
+            result = self.execute_command(mutated_command, cwd=temp_dir_path,
+                                          tag=command_tags[0] if command_tags else "generic")
+
+            # Removed in the background, with anything the command wrote into it
+            self.workdirs.release(temp_dir_path)
+            # ------------------------------------
+
+            # Write the 'mutated_command' (the actual command) so the consumer can record it
+            record = {
+                "id": correlation_id,
+                "success": result.success,
+                "tags": command_tags,
+                "cmd": mutated_command,
+                "cwd": temp_dir_path,
+                "ts": time.time(),
+                "seed_id": seed_id,  # Parent seed, credited with the verdict
+                "mutators": chain or [],  # Mutator chain, credited in the bandit stats
+                "oracle": oracle,  # Rules the local oracle matched (None: oracle off)
+                **run_details(result)  # Exit status, capped output and resource usage, for triage
+            }
+            log.debug("  [+] Executed & queued (ID: ...%s)", correlation_id[-6:])
         except Exception as e:
-            print(f"  [-] Execution error: {e}")
-            return False
+            log.error("[ERROR] Worker failed for ID %s: %s", correlation_id, e)
+        finally:
+            IN_FLIGHT.dec()
+            self.queue_writer.commit(seq, record)
 
-    def main_loop(self):
+    def submit_candidate(self, candidate):
+        correlation_id = str(uuid.uuid4())
+
+        # --- Execute and enqueue (blocks while all workers are busy) ---
+        seq = self.queue_writer.next_seq()
+        self.engine.submit(self.run_candidate, seq, correlation_id, candidate["cmd"], candidate["tags"],
+                           candidate["seed_id"], candidate["mutators"], candidate.get("oracle"))
+
+    def prepare_generation(self):
         self.load_mutators()
         self.load_seeds()
+        SEEDS.set_function(lambda: len(self.scheduler))
 
-        if not self.mutators["generic"] and not self.mutators["cmd"] and not self.mutators["powershell"]:
+        if not self.mutators.available():
             print("[ERROR] No mutators found in selected directory.")
+            return False
+        return True
+
+    def main_loop(self):
+        if not self.prepare_generation():
             return
 
         print(f"\n--- START ---")
 
         while True:
-            seed_data = self.choose_seed()
-            original_command = seed_data["cmd"]
-            command_tags = seed_data["tags"]
-            
-            mutated_command = self.apply_havoc_mutations(original_command, command_tags)
-            
-            if mutated_command == original_command:
-                continue
+            for candidate in self.generate_candidates():
+                self.submit_candidate(candidate)
 
-            # --- Deduplication ---
-            cmd_hash = hashlib.sha256(mutated_command.encode()).hexdigest()
-            if cmd_hash in self.tested_hashes:
-                continue 
-            
-            self.tested_hashes.add(cmd_hash)
-            self.hash_file_handle.write(f"{cmd_hash}\n") # Write to file
-            self.hash_file_handle.flush()
-            
-            correlation_id = str(uuid.uuid4())
-            
-            # Create temporary directory named by correlation ID
-            temp_dir_path = os.path.join(os.getcwd(), TEMP_WORKDIR, correlation_id)
+    def pipeline_loop(self, generator_options, monitor_options=None):
+        """
+        Executes candidates produced by generation_stage in a separate
+        process, so mutation and dedup never wait for a running command and
+        the executors never wait for mutation. The generator process has
+        metrics of its own, served on the next port (see monitor()).
+        """
+        candidates = multiprocessing.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+        self.generation_stop = multiprocessing.Event()
+        self.generator_process = multiprocessing.Process(
+            target=generation_stage,
+            args=(self.mutator_mode, generator_options, candidates, self.generation_stop, monitor_options),
+            name="purplefuzz-generator",
+        )
+        self.generator_process.start()
+        PIPELINE_DEPTH.set_function(candidates.qsize)
+
+        print(f"\n--- START (pipeline, {PIPELINE_QUEUE_SIZE} candidates buffered) ---")
+
+        while True:
             try:
-                os.makedirs(temp_dir_path, exist_ok=True)
-            except Exception as e:
-                print(f"[ERROR] Could not create temp dir: {e}")
-                continue 
+                candidate = candidates.get(timeout=1)
+            except queue.Empty:
+                if not self.generator_process.is_alive():
+                    print("[ERROR] Generation stage exited. Stopping.")
+                    return
+                continue
+            self.submit_candidate(candidate)
+
+    def stats_line(self, rate):
+        """
+        One line of throughput and latency for what this process does.
+        """
+        parts = []
+        if self.engine is not None:
+            parts.append(f"{rate('execs', EXECS.total()):.1f} execs/s ({EXECS.get(result='timeout')} timeouts, "
+                         f"{EXECS.get(result='error')} errors total), exec p50 {milliseconds(EXEC_SECONDS.quantile(0.5))} "
+                         f"p95 {milliseconds(EXEC_SECONDS.quantile(0.95))}, {IN_FLIGHT.get()} in flight, "
+                         f"queue write p95 {milliseconds(QUEUE_WRITE_SECONDS.quantile(0.95))}")
+        if self.mutators.available():
+            mutants = MUTANTS.total()
+            parts.append(f"{rate('mutants', mutants):.1f} mutants/s, "
+                         f"{CANDIDATES.get(result='new') / max(mutants, 1):.1%} new, "
+                         f"{MUTATOR_ERRORS.total()} mutator errors, {len(self.scheduler)} seeds")
+        return "; ".join(parts)
+
+    def monitor(self, metrics_port=None, stats_interval=0):
+        start_monitoring(metrics_port, stats_interval, self.stats_line)
+
+    def stop_pipeline(self):
+        if getattr(self, "generator_process", None) is None:
+            return
+        self.generation_stop.set()
+        self.generator_process.join(timeout=10)
+        if self.generator_process.is_alive():
+            self.generator_process.terminate()
 
-            # --- Execute and enqueue ---
-            run_success = self.execute_command(mutated_command, cwd=temp_dir_path)
-            
-            # Clean up the temporary directory
+
+def load_pending_candidates(path=PENDING_FILE):
+    """
+    Takes the candidates saved by save_pending_candidates (and removes
+    the file, so they are handed out once).
+    """
+    if not os.path.exists(path):
+        return []
+    with open(path, "r", encoding="utf-8") as f:
+        pending = [json.loads(line) for line in f if line.strip()]
+    os.remove(path)
+    return pending
+
+
+def save_pending_candidates(pending, path=PENDING_FILE):
+    if not pending:
+        return
+    with open(path, "a", encoding="utf-8") as f:
+        for candidate in pending:
+            f.write(json.dumps(candidate) + "\n")
+    print(f"[i] Saved {len(pending)} queued candidates to {path} for the next run.")
+
+
+def generation_stage(mutator_mode, generator_options, candidates, stop, monitor_options=None):
+    """
+    Body of the generator process: keeps the bounded 'candidates' queue
+    filled with pre-deduplicated mutants. It owns the dedup stores, which
+    mark candidates as tested when they are generated, so at shutdown it
+    drains the queue and saves what the executors never took to
+    PENDING_FILE; the next generator queues those first.
+    'generator_options' are ProducerFuzzer keyword arguments;
+    'monitor_options' log_level, metrics_port and stats_interval.
+    """
+    monitor_options = dict(monitor_options or {})
+    setup_logging(monitor_options.pop("log_level", "info"))
+    if monitor_options.get("metrics_port"):
+        monitor_options["metrics_port"] += 1
+    generator = None
+    held = deque(load_pending_candidates())
+    if held:
+        print(f"[i] Resuming {len(held)} candidates queued at the last shutdown.")
+    try:
+        generator = ProducerFuzzer(mutator_mode, execute=False, **generator_options)
+        if not generator.prepare_generation():
+            return
+        generator.monitor(**monitor_options)
+        while not stop.is_set():
+            if not held:
+                held.extend(generator.generate_candidates())
+                continue
             try:
-                os.rmdir(temp_dir_path)
-            except Exception as e:
-                print(f"[WARN] Could not remove temp dir: {e}")
-            # ------------------------------------
-                
-            # write to queue.txt 
-            # Format: ID|RunSuccess|Tags|Command
-            tags_str = " ".join(command_tags)
-            with open(QUEUE_FILE, 'a', encoding='utf-8') as qf:
-                # Write the 'mutated_command' (the actual command) so the consumer can record it
-                qf.write(f"{correlation_id}|{run_success}|{tags_str}|{mutated_command}\n")
-            
-            print(f"  [+] Executed & queued (ID: ...{correlation_id[-6:]})")
-            
-            
+                candidates.put(held[0], timeout=1) # Blocks while the executors are behind
+                held.popleft()
+            except queue.Full:
+                continue
+    except KeyboardInterrupt:
+        pass
+    finally:
+        # Candidates are marked as tested already: keep the ones nobody executed
+        leftovers = []
+        while True:
+            try:
+                leftovers.append(candidates.get(timeout=0.2))
+            except (queue.Empty, KeyboardInterrupt):
+                break
+        save_pending_candidates(leftovers + list(held))
+        if generator and generator.oracle:
+            print(f"[i] Oracle: {generator.oracle.stats}")
+        if generator and generator.dedup:
+            generator.dedup.close()
+        if generator and generator.canonical_budget:
+            generator.canonical_budget.close()
+        candidates.cancel_join_thread()
+
+
 if __name__ == "__main__":
     # --- Logic Argparse ---
     parser = argparse.ArgumentParser(description="PurpleFuzz - Detection-Guided Fuzzer (Producer)")
@@ -283,17 +719,127 @@ if __name__ == "__main__":
         choices=[0, 1],
         help="Mutator mode: 0=default ('mutators' dir), 1=custom ('custom_mutators' dir)"
     )
+    parser.add_argument(
+        "-w", "--workers",
+        type=int,
+        default=DEFAULT_WORKERS,
+        help="Number of commands kept in flight concurrently"
+    )
+    parser.add_argument(
+        "-t", "--timeout",
+        type=int,
+        default=DEFAULT_TIMEOUT,
+        help="Per-command timeout in seconds; the process tree is killed when it expires"
+    )
+    parser.add_argument(
+        "-b", "--canon-budget",
+        type=int,
+        default=CANONICAL_BUDGET,
+        help="Max executions per canonical form (same command modulo case/carets/concatenation); 0=unlimited"
+    )
+    parser.add_argument(
+        "-P", "--persistent",
+        action="store_true",
+        help="Run commands in long-lived interpreter workers (cmd/powershell, /bin/sh off Windows) instead of a fresh shell each"
+    )
+    parser.add_argument(
+        "--persistent-tags",
+        nargs="+",
+        default=list(PERSISTENT_TAGS),
+        choices=["generic", "cmd", "powershell"],
+        help="Seed tags run in persistent interpreters with -P; cmd/powershell are off by default because "
+             "a persistent interpreter's commands never appear as a process CommandLine for the rules to see"
+    )
+    parser.add_argument(
+        "-p", "--pipeline",
+        action="store_true",
+        help="Generate and deduplicate candidates in a separate process, ahead of the executors"
+    )
+    parser.add_argument(
+        "-o", "--oracle",
+        default="off",
+        choices=ORACLE_MODES,
+        help="Local detection oracle: drop or defer candidates the local rules predict as detected"
+    )
+    parser.add_argument(
+        "--rules-dir",
+        default=RULES_DIR,
+        help="Directory of Sigma-style rules (.yml needs PyYAML, .json always works)"
+    )
+    parser.add_argument(
+        "--explore-rate",
+        type=float,
+        default=ORACLE_EXPLORATION_RATE,
+        help="Share of predicted-detected candidates executed anyway to measure oracle accuracy"
+    )
+    parser.add_argument(
+        "-c", "--coordinator",
+        default=None,
+        help="Coordinator address (host:port or unix:/path) to share corpus, dedup and queue log with other producers"
+    )
+    parser.add_argument(
+        "--metrics-port",
+        type=int,
+        default=None,
+        help="Serve Prometheus metrics on 127.0.0.1:PORT/metrics (with --pipeline the generator uses PORT+1)"
+    )
+    parser.add_argument(
+        "--stats-interval",
+        type=float,
+        default=0,
+        help="Print a throughput/latency stats line every N seconds (0=off)"
+    )
+    parser.add_argument(
+        "--log-level",
+        default="info",
+        choices=LOG_LEVELS,
+        help="Per-command messages are 'debug' (rate-limited); timeouts 'info'; execution errors 'warning'"
+    )
+    parser.add_argument(
+        "--output-cap",
+        type=int,
+        default=OUTPUT_CAP,
+        help="Bytes of stdout/stderr kept per command and stream (the tail) and stored in the queue record; 0=all"
+    )
     args = parser.parse_args()
+    setup_logging(args.log_level)
     # ---------------------------------
 
+    generator_options = {
+        "canonical_budget": args.canon_budget,
+        "oracle_mode": args.oracle,
+        "rules_dir": args.rules_dir,
+        "exploration_rate": args.explore_rate,
+        "coordinator": args.coordinator,
+        "producer_id": f"{socket.gethostname()}-{os.getpid()}",
+    }
+    monitor_options = {"metrics_port": args.metrics_port, "stats_interval": args.stats_interval}
+
     fuzzer = None # Initialize as None
     try:
-        fuzzer = ProducerFuzzer(mutator_mode=args.mode) # pass mode into constructor
-        fuzzer.main_loop()
+        fuzzer = ProducerFuzzer(mutator_mode=args.mode, workers=args.workers, timeout=args.timeout,
+                                generate=not args.pipeline, persistent=args.persistent,
+                                persistent_tags=args.persistent_tags, output_cap=args.output_cap,
+                                **generator_options) # pass mode into constructor
+        fuzzer.monitor(**monitor_options)
+        if args.pipeline:
+            fuzzer.pipeline_loop(generator_options, dict(monitor_options, log_level=args.log_level))
+        else:
+            fuzzer.main_loop()
     except KeyboardInterrupt:
         print("\n[!] Producer is stopping...")
     finally:
-        # Ensure the hash file is always closed, even on error
-        if fuzzer and fuzzer.hash_file_handle:
-            fuzzer.hash_file_handle.close()
-            print("[i] Hash file closed.")
\ No newline at end of file
+        # Let in-flight executions finish so their queue lines are not lost
+        if fuzzer:
+            fuzzer.stop_pipeline()
+            fuzzer.engine.shutdown(wait=True)
+            fuzzer.workdirs.close()
+            fuzzer.queue_log.close()
+        if fuzzer and fuzzer.oracle:
+            print(f"[i] Oracle: {fuzzer.oracle.stats}")
+        # Ensure pending hashes are always written, even on error
+        if fuzzer and fuzzer.dedup:
+            fuzzer.dedup.close()
+            print("[i] Dedup store closed.")
+        if fuzzer and fuzzer.canonical_budget:
+            fuzzer.canonical_budget.close()
\ No newline at end of file
@@ -0,0 +1,240 @@
+import os
+import json
+import struct
+import threading
+import zlib
+
+# --- Queue Log Defaults ---
+SEGMENT_MAX_BYTES = 64 * 1024 * 1024
+READ_CHUNK_BYTES = 1024 * 1024
+SEGMENT_SUFFIX = ".seg"
+OFFSET_SUFFIX = ".offset"
+
+# Frame layout: <payload length><crc32 of payload><payload (UTF-8 JSON)>
+FRAME_HEADER = struct.Struct("<II")
+
+
+def segment_name(number):
+    return f"{number:010d}{SEGMENT_SUFFIX}"
+
+
+def list_segments(log_dir):
+    numbers = []
+    for filename in os.listdir(log_dir):
+        if filename.endswith(SEGMENT_SUFFIX):
+            try:
+                numbers.append(int(filename[:-len(SEGMENT_SUFFIX)]))
+            except ValueError:
+                continue
+    return sorted(numbers)
+
+
+def encode_frame(record):
+    payload = json.dumps(record, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+    return FRAME_HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+
+def scan_frames(data, position=0):
+    """
+    Yields (record, next_position) for every complete, valid frame in 'data'
+    starting at 'position'. Stops at the first torn or corrupt frame.
+    """
+    while position + FRAME_HEADER.size <= len(data):
+        length, crc = FRAME_HEADER.unpack_from(data, position)
+        start = position + FRAME_HEADER.size
+        end = start + length
+        if end > len(data):
+            return
+        payload = data[start:end]
+        if zlib.crc32(payload) != crc:
+            return
+        try:
+            record = json.loads(payload.decode("utf-8"))
+        except ValueError:
+            return
+        yield record, end
+        position = end
+
+
+class QueueLogWriter:
+    """
+    Append-only, length-framed segment log written by the producer.
+    One writer process per log directory; appends from several threads are
+    serialized by a lock and each frame goes out in a single write().
+    """
+    def __init__(self, log_dir, segment_max_bytes=SEGMENT_MAX_BYTES, fsync=False):
+        self.log_dir = log_dir
+        self.segment_max_bytes = segment_max_bytes
+        self.fsync = fsync
+        self.lock = threading.Lock()
+        os.makedirs(log_dir, exist_ok=True)
+
+        segments = list_segments(log_dir)
+        self.segment_number = segments[-1] if segments else 0
+        self.recover_tail()
+        self.handle = open(self.segment_path(), "ab")
+
+    def segment_path(self, number=None):
+        return os.path.join(self.log_dir, segment_name(self.segment_number if number is None else number))
+
+    def recover_tail(self):
+        """
+        Truncates a torn frame left by a crash in the middle of an append,
+        so that new records are never written behind garbage.
+        """
+        path = self.segment_path()
+        if not os.path.exists(path):
+            return
+        with open(path, "rb") as f:
+            data = f.read()
+        valid_end = 0
+        for _, next_position in scan_frames(data):
+            valid_end = next_position
+        if valid_end < len(data):
+            print(f"  [!] Queue log: truncating {len(data) - valid_end} torn bytes in {path}")
+            with open(path, "r+b") as f:
+                f.truncate(valid_end)
+
+    def append(self, record):
+        self.append_many([record])
+
+    def append_many(self, records):
+        data = b"".join(encode_frame(record) for record in records)
+        if not data:
+            return
+        with self.lock:
+            if self.handle.tell() > 0 and self.handle.tell() + len(data) > self.segment_max_bytes:
+                self.roll()
+            self.handle.write(data)
+            self.handle.flush()
+            if self.fsync:
+                os.fsync(self.handle.fileno())
+
+    def roll(self):
+        self.handle.close()
+        self.segment_number += 1
+        self.handle = open(self.segment_path(), "ab")
+
+    def close(self):
+        with self.lock:
+            self.handle.close()
+
+
+class QueueLogReader:
+    """
+    Reads records after the committed offset of a named consumer.
+    Nothing is acknowledged until commit() is called with the offset
+    returned alongside the last processed record.
+    """
+    def __init__(self, log_dir, name="consumer"):
+        self.log_dir = log_dir
+        self.offset_path = os.path.join(log_dir, name + OFFSET_SUFFIX)
+        os.makedirs(log_dir, exist_ok=True)
+        self.committed = self.load_offset()
+
+    def load_offset(self):
+        try:
+            with open(self.offset_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            return (int(data["segment"]), int(data["position"]))
+        except FileNotFoundError:
+            segments = list_segments(self.log_dir)
+            return (segments[0] if segments else 0, 0)
+
+    def read_batch(self, max_records=1000, start=None):
+        """
+        Returns a list of (record, offset_after_record), reading at most
+        'max_records' new records starting at 'start' (default: committed).
+        """
+        segment, position = start or self.committed
+        batch = []
+        segments = list_segments(self.log_dir)
+        while len(batch) < max_records:
+            later = [n for n in segments if n > segment]
+            path = os.path.join(self.log_dir, segment_name(segment))
+            if not os.path.exists(path):
+                if not later:
+                    break
+                segment, position = later[0], 0
+                continue
+
+            at_end = False
+            chunk_size = READ_CHUNK_BYTES
+            with open(path, "rb") as f:
+                while len(batch) < max_records:
+                    f.seek(position)
+                    data = f.read(chunk_size)
+                    consumed = 0
+                    for record, next_position in scan_frames(data):
+                        consumed = next_position
+                        batch.append((record, (segment, position + next_position)))
+                        if len(batch) >= max_records:
+                            break
+                    position += consumed
+                    if len(data) < chunk_size and consumed == len(data):
+                        at_end = True
+                        break
+                    if consumed == 0:
+                        if len(data) < chunk_size:
+                            # Torn or still-being-written frame at the end of the segment
+                            break
+                        chunk_size *= 2
+
+            if len(batch) >= max_records or not later:
+                break
+            if not at_end:
+                print(f"  [!] Queue log: skipping unreadable bytes at end of segment {segment}")
+            segment, position = later[0], 0
+        return batch
+
+    def commit(self, offset):
+        """
+        Atomically persists the consumer offset and drops segments that are
+        fully acknowledged.
+        """
+        tmp_path = self.offset_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"segment": offset[0], "position": offset[1]}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.offset_path)
+        self.committed = offset
+
+        for number in list_segments(self.log_dir):
+            if number >= offset[0]:
+                break
+            try:
+                os.remove(os.path.join(self.log_dir, segment_name(number)))
+            except OSError:
+                pass
+
+
+def parse_legacy_line(line):
+    """
+    Parses one 'ID|RunSuccess|Tags|Command' line from the old queue.txt.
+    """
+    cid, success_str, tags_str, cmd = line.rstrip("\n").split('|', 3)
+    return {
+        "id": cid,
+        "success": (success_str == 'True'),
+        "tags": tags_str.split(' '),
+        "cmd": cmd,
+    }
+
+
+def import_legacy_queue(path, writer):
+    """
+    Moves the records of an old text queue file into the log, then removes it.
+    """
+    if not os.path.exists(path):
+        return 0
+    records = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                records.append(parse_legacy_line(line))
+            except ValueError:
+                continue
+    writer.append_many(records)
+    os.remove(path)
+    return len(records)
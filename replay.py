@@ -0,0 +1,143 @@
+"""
+Batch replay of finds, to check which bypasses still reproduce (e.g. after a
+rule deploy).
+
+Every find is re-executed --runs times with fresh correlation IDs, all of
+them in parallel, and the verdicts are collected in bulk (verifier.py: the
+consumer's SIEM query path, or --local-oracle). A run reproduces if it
+executes successfully and is not detected. One JSON line per find goes to
+REPLAY_DIR:
+
+    {"cmd": ..., "tag": ..., "seed_id": ..., "source": ..., "runs": 3,
+     "succeeded": 3, "detected": 1, "reproduced": 2, "rate": 0.667}
+
+    python replay.py --prio 1 --tag cmd --runs 3 -w 16
+    python results_archive.py export --legacy finds/ --verdict 1 --since 2024-06-01
+    python replay.py finds/interesting_finds/
+"""
+import os
+import time
+import json
+import argparse
+
+from executor import ExecutionEngine, DEFAULT_TIMEOUT
+from interp_pool import InterpreterPool
+from corpus_store import CorpusStore, CORPUS_DB, PRIO_1_BYPASS_SUCCESS
+from oracle import DetectionOracle, RULES_DIR
+from verifier import Verifier, connect_siem
+
+# --- Replay Defaults ---
+REPLAY_DIR = "replays"
+DEFAULT_WORKERS = 8
+DEFAULT_RUNS = 3
+
+
+def finds_from_dir(directory, corpus, default_tag):
+    """
+    One find per .txt file. Tag and seed id come from the corpus when the
+    command is in it.
+    """
+    finds = []
+    for filename in sorted(os.listdir(directory)):
+        if not filename.endswith(".txt"):
+            continue
+        with open(os.path.join(directory, filename), "r", encoding="utf-8") as f:
+            command = f.read().strip()
+        if not command:
+            continue
+        row = corpus.find(command)
+        finds.append({"cmd": command, "tag": row["tag"] if row is not None else default_tag,
+                      "seed_id": row["id"] if row is not None else None, "source": filename})
+    return finds
+
+
+def finds_from_corpus(corpus, priority, tag=None, limit=None):
+    rows = [row for row in corpus.seeds(priority) if tag is None or row["tag"] == tag]
+    return [{"cmd": row["cmd"], "tag": row["tag"], "seed_id": row["id"], "source": row["source"]}
+            for row in rows[:limit]]
+
+
+def replay(verifier, finds, runs):
+    """
+    Executes every find 'runs' times in one batch. Returns the finds with
+    their counts and reproduction rate filled in.
+    """
+    items = [(find["cmd"], [find["tag"]]) for find in finds for _ in range(runs)]
+    results = verifier.verify_items(items)
+    for i, find in enumerate(finds):
+        find_runs = results[i * runs:(i + 1) * runs]
+        find["runs"] = runs
+        find["succeeded"] = sum(run["success"] for run in find_runs)
+        find["detected"] = sum(run["detected"] for run in find_runs)
+        find["reproduced"] = sum(run["success"] and not run["detected"] for run in find_runs)
+        find["rate"] = round(find["reproduced"] / runs, 3)
+    return finds
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="PurpleFuzz - Batch replay and stability check of finds")
+    parser.add_argument("directory", nargs="?", help="Directory of find files (e.g. from results_archive.py export --legacy)")
+    parser.add_argument("--prio", type=int, choices=[1, 2, 3], help="Replay corpus seeds of this priority instead")
+    parser.add_argument("--tag", help="Only corpus seeds with this tag; for files not in the corpus, their tag")
+    parser.add_argument("--limit", type=int, help="At most this many finds")
+    parser.add_argument("-r", "--runs", type=int, default=DEFAULT_RUNS, help="Executions per find")
+    parser.add_argument("--chunk", type=int, default=0,
+                        help="Finds per verification batch (0=all at once; each batch waits one verdict deadline)")
+    parser.add_argument("-w", "--workers", type=int, default=DEFAULT_WORKERS, help="Commands executed in parallel")
+    parser.add_argument("-t", "--timeout", type=int, default=DEFAULT_TIMEOUT, help="Per-command timeout in seconds")
+    parser.add_argument("-P", "--persistent", action="store_true", help="Run generic seeds in long-lived interpreters (see interp_pool.PERSISTENT_TAGS)")
+    parser.add_argument("--local-oracle", action="store_true",
+                        help="Judge detection with the local rules instead of the SIEM (fast, approximate)")
+    parser.add_argument("--rules-dir", default=RULES_DIR, help="Rules for --local-oracle")
+    parser.add_argument("--db", default=CORPUS_DB, help="Corpus database file")
+    parser.add_argument("-o", "--output", help="Output JSONL file (default: replays/replay_<time>.jsonl)")
+    args = parser.parse_args()
+    if args.runs < 1:
+        parser.error("--runs must be at least 1")
+
+    corpus = CorpusStore(args.db)
+    if args.directory:
+        finds = finds_from_dir(args.directory, corpus, args.tag or "generic")[:args.limit]
+    else:
+        finds = finds_from_corpus(corpus, args.prio or PRIO_1_BYPASS_SUCCESS, args.tag, args.limit)
+    corpus.close()
+    if not finds:
+        print("[ERROR] No finds to replay.")
+        exit(1)
+
+    engine = ExecutionEngine(workers=args.workers, timeout=args.timeout,
+                             interpreter_pool=InterpreterPool(timeout=args.timeout) if args.persistent else None)
+    if args.local_oracle:
+        verifier = Verifier(engine, oracle=DetectionOracle(args.rules_dir, mode="drop"))
+    else:
+        try:
+            verifier = Verifier(engine, siem_client=connect_siem())
+        except Exception as e:
+            print(f"[ERROR] Could not connect to Elasticsearch: {e}")
+            engine.shutdown()
+            exit(1)
+
+    os.makedirs(REPLAY_DIR, exist_ok=True)
+    output = args.output or os.path.join(REPLAY_DIR, f"replay_{time.strftime('%Y%m%d_%H%M%S')}.jsonl")
+    chunk = args.chunk or len(finds)
+    print(f"Replaying {len(finds)} finds x {args.runs} runs with {args.workers} workers; verdicts from "
+          f"{'local rules in ' + args.rules_dir + '/' if args.local_oracle else 'the SIEM'}")
+
+    totals = {"stable": 0, "flaky": 0, "dead": 0}
+    started = time.time()
+    try:
+        with open(output, "w", encoding="utf-8") as out:
+            for start in range(0, len(finds), chunk):
+                batch = replay(verifier, finds[start:start + chunk], args.runs)
+                for find in batch:
+                    out.write(json.dumps(find, separators=(",", ":")) + "\n")
+                    totals["stable" if find["rate"] == 1 else "dead" if find["rate"] == 0 else "flaky"] += 1
+                out.flush()
+                print(f"  [+] {min(start + chunk, len(finds))}/{len(finds)} finds verified")
+    finally:
+        engine.shutdown()
+        verifier.close()
+
+    print(f"\n[+] Replay done in {time.time() - started:.0f}s: {totals['stable']} reproduce every run, "
+          f"{totals['flaky']} flaky, {totals['dead']} no longer reproduce")
+    print(f"    Results: {output}")
@@ -0,0 +1,385 @@
+"""
+Append-only archive of the consumer's verdicts.
+
+Records are buffered and appended in batches: each batch is one block of
+zlib-compressed JSON lines, framed like the queue log (length, CRC, record
+count), in rotating segment files. A SQLite index maps every correlation ID
+to its verdict, tag, timestamps and block, so lookups by ID or verdict read
+only the blocks they need:
+
+    python results_archive.py query --verdict 1 --since 2024-06-01 --tag cmd
+    python results_archive.py query --id 0b5e...
+    python results_archive.py export -o finds.jsonl --verdict 1
+    python results_archive.py export --legacy out/    # out/interesting_finds/, out/alerts/
+    python results_archive.py stats
+
+A block is written before its index rows are committed; on open, blocks at
+the end of the last segment that are missing from the index are indexed
+and a torn block is truncated.
+"""
+import os
+import json
+import time
+import zlib
+import struct
+import sqlite3
+import argparse
+from datetime import datetime
+
+# --- Archive Defaults ---
+ARCHIVE_DIR = "results"
+SEGMENT_MAX_BYTES = 64 * 1024 * 1024
+SEGMENT_SUFFIX = ".arc"
+INDEX_DB = "index.db"
+BATCH_RECORDS = 1000          # add() flushes a block once this many records are buffered
+COMPRESSION_LEVEL = 6
+
+# Block layout: <compressed length><crc32 of compressed payload><record count><payload>
+BLOCK_HEADER = struct.Struct("<III")
+
+# Run fields of a queue record (executor.run_details) kept with the verdict
+RUN_FIELDS = ("returncode", "timed_out", "error", "stdout", "stderr", "output_bytes", "usage")
+
+# Per-file layout of the older consumer: verdict -> directory
+LEGACY_DIRS = {1: "interesting_finds", 3: "alerts"}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    id           TEXT PRIMARY KEY,
+    verdict      INTEGER NOT NULL,
+    tag          TEXT,
+    seed_id      INTEGER,
+    executed_at  REAL,
+    decided_at   REAL NOT NULL,
+    segment      INTEGER NOT NULL,
+    offset       INTEGER NOT NULL,
+    position     INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS results_verdict ON results (verdict, decided_at);
+CREATE INDEX IF NOT EXISTS results_decided ON results (decided_at);
+CREATE TABLE IF NOT EXISTS blocks (
+    segment      INTEGER NOT NULL,
+    offset       INTEGER NOT NULL,
+    next_offset  INTEGER NOT NULL,
+    records      INTEGER NOT NULL,
+    PRIMARY KEY (segment, offset)
+);
+"""
+
+
+def segment_name(number):
+    return f"{number:010d}{SEGMENT_SUFFIX}"
+
+
+def list_segments(archive_dir):
+    numbers = []
+    for filename in os.listdir(archive_dir):
+        if filename.endswith(SEGMENT_SUFFIX):
+            try:
+                numbers.append(int(filename[:-len(SEGMENT_SUFFIX)]))
+            except ValueError:
+                continue
+    return sorted(numbers)
+
+
+def encode_block(records):
+    payload = "".join(json.dumps(record, separators=(",", ":"), ensure_ascii=False) + "\n"
+                      for record in records).encode("utf-8")
+    compressed = zlib.compress(payload, COMPRESSION_LEVEL)
+    return BLOCK_HEADER.pack(len(compressed), zlib.crc32(compressed), len(records)) + compressed
+
+
+def decode_block(data, position=0):
+    """
+    Returns (records, next_position) for the block at 'position', or None if
+    it is torn or corrupt.
+    """
+    if position + BLOCK_HEADER.size > len(data):
+        return None
+    length, crc, count = BLOCK_HEADER.unpack_from(data, position)
+    start = position + BLOCK_HEADER.size
+    end = start + length
+    if end > len(data):
+        return None
+    compressed = data[start:end]
+    if zlib.crc32(compressed) != crc:
+        return None
+    try:
+        lines = zlib.decompress(compressed).decode("utf-8").splitlines()
+        records = [json.loads(line) for line in lines]
+    except (zlib.error, ValueError):
+        return None
+    if len(records) != count:
+        return None
+    return records, end
+
+
+def parse_time(text):
+    """
+    Epoch seconds, or an ISO date/time ('2024-06-01', '2024-06-01T12:00').
+    """
+    try:
+        return float(text)
+    except ValueError:
+        return datetime.fromisoformat(text).timestamp()
+
+
+def legacy_filename(record):
+    """
+    Name the older consumer gave the file of a verdict, with the full
+    correlation ID so two verdicts in the same second cannot collide.
+    """
+    return f"prio_{record['verdict']}__{int(record['decided_at'])}__{record['id']}.txt"
+
+
+class ResultsArchive:
+    """
+    One writer process per archive directory (the consumer); any number of
+    readers. add() buffers, flush() writes the buffered records as one block.
+    """
+    def __init__(self, archive_dir=ARCHIVE_DIR, segment_max_bytes=SEGMENT_MAX_BYTES,
+                 batch_records=BATCH_RECORDS, fsync=False):
+        self.archive_dir = archive_dir
+        self.segment_max_bytes = segment_max_bytes
+        self.batch_records = batch_records
+        self.fsync = fsync
+        self.buffer = []
+        self.handle = None
+        os.makedirs(archive_dir, exist_ok=True)
+
+        self.conn = sqlite3.connect(os.path.join(archive_dir, INDEX_DB), timeout=30)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        self.conn.commit()
+
+        segments = list_segments(archive_dir)
+        self.segment_number = segments[-1] if segments else 0
+
+    def segment_path(self, number=None):
+        return os.path.join(self.archive_dir, segment_name(self.segment_number if number is None else number))
+
+    # --- Writing ---
+
+    def open_for_append(self):
+        """
+        Opens the last segment for appending, after indexing blocks the index
+        missed and truncating a torn one (crash between write and commit).
+        """
+        path = self.segment_path()
+        if os.path.exists(path):
+            row = self.conn.execute("SELECT MAX(next_offset) FROM blocks WHERE segment = ?",
+                                    (self.segment_number,)).fetchone()
+            position = row[0] or 0
+            with open(path, "rb") as f:
+                data = f.read()
+            recovered = 0
+            while True:
+                block = decode_block(data, position)
+                if block is None:
+                    break
+                records, next_position = block
+                self.index_block(self.segment_number, position, next_position, records)
+                recovered += len(records)
+                position = next_position
+            if recovered:
+                print(f"  [!] Results archive: indexed {recovered} records missing from the index")
+            if position < len(data):
+                print(f"  [!] Results archive: truncating {len(data) - position} torn bytes in {path}")
+                with open(path, "r+b") as f:
+                    f.truncate(position)
+        self.handle = open(path, "ab")
+
+    def index_block(self, segment, offset, next_offset, records):
+        with self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO blocks (segment, offset, next_offset, records) "
+                              "VALUES (?, ?, ?, ?)", (segment, offset, next_offset, len(records)))
+            # A verdict archived again (consumer restarted before its offset commit) points at the newest copy
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO results (id, verdict, tag, seed_id, executed_at, decided_at, "
+                "segment, offset, position) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [(r["id"], r["verdict"], r["tags"][0] if r.get("tags") else None, r.get("seed_id"),
+                  r.get("executed_at"), r["decided_at"], segment, offset, i) for i, r in enumerate(records)])
+
+    def add(self, record):
+        self.buffer.append(record)
+        if len(self.buffer) >= self.batch_records:
+            self.flush()
+
+    def flush(self):
+        """
+        Appends the buffered records as one block and indexes them.
+        """
+        if not self.buffer:
+            return 0
+        if self.handle is None:
+            self.open_for_append()
+        records, self.buffer = self.buffer, []
+        data = encode_block(records)
+        if self.handle.tell() > 0 and self.handle.tell() + len(data) > self.segment_max_bytes:
+            self.roll()
+        offset = self.handle.tell()
+        self.handle.write(data)
+        self.handle.flush()
+        if self.fsync:
+            os.fsync(self.handle.fileno())
+        self.index_block(self.segment_number, offset, offset + len(data), records)
+        return len(records)
+
+    def roll(self):
+        self.handle.close()
+        self.segment_number += 1
+        self.handle = open(self.segment_path(), "ab")
+
+    # --- Reading ---
+
+    def read_block(self, segment, offset):
+        with open(self.segment_path(segment), "rb") as f:
+            f.seek(offset)
+            header = f.read(BLOCK_HEADER.size)
+            if len(header) < BLOCK_HEADER.size:
+                return []
+            length = BLOCK_HEADER.unpack(header)[0]
+            block = decode_block(header + f.read(length))
+        if block is None:
+            print(f"  [!] Results archive: corrupt block at {segment_name(segment)}:{offset}")
+            return []
+        return block[0]
+
+    def get(self, correlation_id):
+        row = self.conn.execute("SELECT segment, offset, position FROM results WHERE id = ?",
+                                (correlation_id,)).fetchone()
+        if row is None:
+            return None
+        records = self.read_block(row["segment"], row["offset"])
+        return records[row["position"]] if row["position"] < len(records) else None
+
+    def query(self, verdict=None, tag=None, since=None, until=None, limit=None):
+        """
+        Yields the archived records matching all given filters, in archive
+        order. Each block is read and decompressed once.
+        """
+        clauses, params = [], []
+        for clause, value in (("verdict = ?", verdict), ("tag = ?", tag),
+                              ("decided_at >= ?", since), ("decided_at < ?", until)):
+            if value is not None:
+                clauses.append(clause)
+                params.append(value)
+        sql = "SELECT segment, offset, position FROM results"
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += " ORDER BY segment, offset, position"
+        if limit:
+            sql += f" LIMIT {int(limit)}"
+        block_key, records = None, []
+        for row in self.conn.execute(sql, params).fetchall():
+            if (row["segment"], row["offset"]) != block_key:
+                block_key = (row["segment"], row["offset"])
+                records = self.read_block(*block_key)
+            if row["position"] < len(records):
+                yield records[row["position"]]
+
+    def stats(self):
+        verdicts = self.conn.execute("SELECT verdict, COUNT(*) AS n, MIN(decided_at) AS first, "
+                                     "MAX(decided_at) AS last FROM results GROUP BY verdict ORDER BY verdict").fetchall()
+        segments = list_segments(self.archive_dir)
+        size = sum(os.path.getsize(self.segment_path(n)) for n in segments)
+        blocks = self.conn.execute("SELECT COUNT(*) FROM blocks").fetchone()[0]
+        return verdicts, len(segments), blocks, size
+
+    # --- Export ---
+
+    def export_jsonl(self, path, **filters):
+        count = 0
+        with open(path, "w", encoding="utf-8") as f:
+            for record in self.query(**filters):
+                f.write(json.dumps(record, separators=(",", ":"), ensure_ascii=False) + "\n")
+                count += 1
+        return count
+
+    def export_legacy(self, out_dir, **filters):
+        """
+        Writes one file per PRIO_1/PRIO_3 verdict into interesting_finds/ and
+        alerts/ under 'out_dir', as the consumer used to.
+        """
+        count = 0
+        for record in self.query(**filters):
+            if record["verdict"] not in LEGACY_DIRS:
+                continue
+            write_legacy_file(record, out_dir)
+            count += 1
+        return count
+
+    def close(self):
+        self.flush()
+        if self.handle is not None:
+            self.handle.close()
+        self.conn.close()
+
+
+def write_legacy_file(record, base_dir="."):
+    directory = os.path.join(base_dir, LEGACY_DIRS[record["verdict"]])
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, legacy_filename(record)), "w", encoding="utf-8") as f:
+        f.write(record["cmd"])
+
+
+def format_record(record):
+    decided = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(record["decided_at"]))
+    tag = record["tags"][0] if record.get("tags") else "-"
+    return f"{decided}  prio {record['verdict']}  {tag:<10} {record['id']}  {record['cmd']}"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="PurpleFuzz - Results archive queries and export")
+    parser.add_argument("--dir", default=ARCHIVE_DIR, help="Archive directory")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    filters = argparse.ArgumentParser(add_help=False)
+    filters.add_argument("--verdict", "--prio", type=int, choices=[1, 2, 3], help="Only this verdict priority")
+    filters.add_argument("--tag", help="Only commands with this (original) tag")
+    filters.add_argument("--since", type=parse_time, help="Decided at or after (epoch seconds or ISO date/time)")
+    filters.add_argument("--until", type=parse_time, help="Decided before (epoch seconds or ISO date/time)")
+    filters.add_argument("--limit", type=int, help="At most this many records")
+
+    p_query = sub.add_parser("query", parents=[filters], help="Print archived verdicts")
+    p_query.add_argument("--id", help="Look up one correlation ID")
+    p_query.add_argument("--json", action="store_true", help="Full records as JSON lines")
+
+    p_export = sub.add_parser("export", parents=[filters], help="Export archived verdicts")
+    p_export.add_argument("-o", "--output", help="JSONL file to write")
+    p_export.add_argument("--legacy", metavar="DIR",
+                          help="Write one file per PRIO_1/PRIO_3 verdict into DIR/interesting_finds and DIR/alerts")
+
+    sub.add_parser("stats", help="Show record counts per verdict and archive size")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.dir):
+        parser.error(f"no results archive in {args.dir}/")
+    archive = ResultsArchive(args.dir)
+    if args.command in ("query", "export"):
+        selected = {"verdict": args.verdict, "tag": args.tag, "since": args.since, "until": args.until,
+                    "limit": args.limit}
+    if args.command == "query":
+        records = [archive.get(args.id)] if args.id else archive.query(**selected)
+        for record in records:
+            if record is None:
+                print(f"No archived verdict for {args.id}")
+                continue
+            print(json.dumps(record, ensure_ascii=False) if args.json else format_record(record))
+    elif args.command == "export":
+        if not args.output and not args.legacy:
+            parser.error("give -o/--output and/or --legacy")
+        if args.output:
+            print(f"Exported {archive.export_jsonl(args.output, **selected)} records to {args.output}")
+        if args.legacy:
+            print(f"Exported {archive.export_legacy(args.legacy, **selected)} find files to {args.legacy}/")
+    elif args.command == "stats":
+        verdicts, segments, blocks, size = archive.stats()
+        for row in verdicts:
+            print(f"  prio {row['verdict']}: {row['n']:>9} verdicts, "
+                  f"{time.strftime('%Y-%m-%d %H:%M', time.localtime(row['first']))} .. "
+                  f"{time.strftime('%Y-%m-%d %H:%M', time.localtime(row['last']))}")
+        print(f"  {segments} segment(s), {blocks} blocks, {size / 1024 / 1024:.1f} MB compressed")
+    archive.close()
@@ -0,0 +1,280 @@
+import math
+import time
+import random
+
+# --- Priority Flags ---
+PRIO_1_BYPASS_SUCCESS = 1
+PRIO_2_BYPASS_FAIL = 2
+PRIO_3_DETECTED_OR_ERROR = 3
+
+# --- Power Schedule ---
+# Share of picks per priority bin (bins without seeds are skipped)
+PRIORITY_WEIGHTS = {
+    PRIO_1_BYPASS_SUCCESS: 0.60,
+    PRIO_2_BYPASS_FAIL: 0.30,
+    PRIO_3_DETECTED_OR_ERROR: 0.10,
+}
+# Beta prior on a seed's bypass rate: an unexplored seed has energy ~1
+YIELD_PRIOR_HITS = 1.0
+YIELD_PRIOR_MISSES = 9.0
+MIN_ENERGY = 0.05
+MAX_ENERGY = 20.0
+# New seeds get up to (1 + RECENCY_BOOST) times their energy, decaying with age
+RECENCY_BOOST = 2.0
+RECENCY_HALF_LIFE = 600.0
+RECENCY_HORIZON = 8 * RECENCY_HALF_LIFE  # After this the boost is negligible
+RECENCY_REFRESH_INTERVAL = 60.0          # Seconds between re-weighting young seeds
+REBUILD_EVERY = 100_000                  # Updates between rebuilds from the exact weights (float drift)
+
+
+def seed_energy(seed, now):
+    """
+    Power schedule for one seed: posterior bypass rate relative to the prior
+    mean (so seeds that keep getting caught fade out, productive ones grow),
+    times a boost for recently added seeds.
+    """
+    prior_mean = YIELD_PRIOR_HITS / (YIELD_PRIOR_HITS + YIELD_PRIOR_MISSES)
+    rate = (seed.get("bypasses", 0) + YIELD_PRIOR_HITS) / \
+           (seed.get("execs", 0) + YIELD_PRIOR_HITS + YIELD_PRIOR_MISSES)
+    energy = min(MAX_ENERGY, max(MIN_ENERGY, rate / prior_mean))
+    age = now - seed.get("added_at", now)
+    if age < RECENCY_HORIZON:
+        energy *= 1.0 + RECENCY_BOOST * math.pow(0.5, max(0.0, age) / RECENCY_HALF_LIFE)
+    return energy
+
+
+class FenwickTree:
+    """
+    Binary indexed tree over slot weights: O(log n) update, prefix sum and
+    weighted sampling.
+    """
+    def __init__(self, capacity=1024):
+        self.size = capacity
+        self.tree = [0.0] * (capacity + 1)
+        self.weights = [0.0] * capacity
+        self.total = 0.0
+
+    def grow(self, capacity):
+        weights = self.weights + [0.0] * (capacity - self.size)
+        self.rebuild(weights)
+
+    def rebuild(self, weights=None):
+        weights = self.weights if weights is None else weights
+        self.size = len(weights)
+        self.weights = weights
+        tree = [0.0] * (self.size + 1)
+        for i, w in enumerate(weights, start=1):
+            tree[i] += w
+            parent = i + (i & -i)
+            if parent <= self.size:
+                tree[parent] += tree[i]
+        self.tree = tree
+        self.total = sum(weights)
+
+    def set(self, slot, weight):
+        delta = weight - self.weights[slot]
+        if delta == 0.0:
+            return
+        self.weights[slot] = weight
+        self.total += delta
+        i = slot + 1
+        while i <= self.size:
+            self.tree[i] += delta
+            i += i & -i
+
+    def find(self, value):
+        """
+        Smallest slot whose prefix sum exceeds 'value' (0 <= value < total).
+        When float drift in the partial sums lands the search on an empty
+        slot (or past the end), the tree is rebuilt from the exact weights
+        and the result clamped to the last slot with weight > 0 before it.
+        """
+        slot = self.search(value)
+        if slot < self.size and self.weights[slot] > 0.0:
+            return slot
+        self.rebuild()
+        slot = min(self.search(value), self.size - 1)
+        return slot if self.weights[slot] > 0.0 else self.occupied_near(slot)
+
+    def occupied_near(self, slot):
+        """
+        Last slot at or before 'slot' with weight > 0 (else the first after it).
+        """
+        for i in range(slot, -1, -1):
+            if self.weights[i] > 0.0:
+                return i
+        for i in range(slot + 1, self.size):
+            if self.weights[i] > 0.0:
+                return i
+        return slot
+
+    def search(self, value):
+        pos = 0
+        step = 1 << self.size.bit_length()
+        while step:
+            nxt = pos + step
+            if nxt <= self.size and self.tree[nxt] <= value:
+                pos = nxt
+                value -= self.tree[nxt]
+            step >>= 1
+        return pos
+
+
+class SeedBin:
+    """
+    Seeds of one priority with their energies in a Fenwick tree.
+    """
+    def __init__(self):
+        self.tree = FenwickTree()
+        self.slots = []          # slot -> seed (None once removed)
+        self.free = []
+        self.count = 0
+        self.updates = 0
+
+    def add(self, seed, energy):
+        if self.free:
+            slot = self.free.pop()
+            self.slots[slot] = seed
+        else:
+            slot = len(self.slots)
+            self.slots.append(seed)
+            if slot >= self.tree.size:
+                self.tree.grow(self.tree.size * 2)
+        seed["slot"] = slot
+        self.count += 1
+        self.set(slot, energy)
+
+    def remove(self, seed):
+        slot = seed.pop("slot")
+        self.set(slot, 0.0)
+        self.slots[slot] = None
+        self.free.append(slot)
+        self.count -= 1
+
+    def set(self, slot, energy):
+        self.tree.set(slot, energy)
+        self.updates += 1
+        if self.updates >= REBUILD_EVERY:
+            self.tree.rebuild()
+            self.updates = 0
+
+    def sample(self, rng):
+        return self.slots[self.tree.find(rng.random() * self.tree.total)]
+
+
+class SeedScheduler:
+    """
+    Picks seeds in O(log n): first a priority bin by PRIORITY_WEIGHTS, then a
+    seed inside the bin proportionally to its energy (seed_energy). Energies
+    are updated incrementally as feedback arrives; recency boosts are
+    refreshed for young seeds only.
+    """
+    def __init__(self, rng=None):
+        self.rng = rng or random
+        self.bins = {prio: SeedBin() for prio in PRIORITY_WEIGHTS}
+        self.young = set()       # ids of seeds still inside the recency horizon
+        self.seeds = {}          # id -> seed
+        self.last_recency_refresh = 0.0
+
+    def __len__(self):
+        return len(self.seeds)
+
+    def count(self, priority):
+        return self.bins[priority].count
+
+    def add(self, seed, now=None):
+        now = now if now is not None else time.time()
+        self.seeds[seed["id"]] = seed
+        seed["bin"] = seed["priority"]
+        self.bins[seed["bin"]].add(seed, seed_energy(seed, now))
+        if now - seed.get("added_at", now) < RECENCY_HORIZON:
+            self.young.add(seed["id"])
+
+    def update(self, seed, now=None):
+        """
+        Re-weights a seed after its stats or priority changed.
+        """
+        now = now if now is not None else time.time()
+        if seed["bin"] != seed["priority"]:
+            self.bins[seed["bin"]].remove(seed)
+            seed["bin"] = seed["priority"]
+            self.bins[seed["bin"]].add(seed, seed_energy(seed, now))
+        else:
+            self.bins[seed["bin"]].set(seed["slot"], seed_energy(seed, now))
+
+    def remove(self, seed):
+        self.seeds.pop(seed["id"], None)
+        self.young.discard(seed["id"])
+        self.bins[seed["bin"]].remove(seed)
+
+    def refresh_recency(self, now=None):
+        now = now if now is not None else time.time()
+        if now - self.last_recency_refresh < RECENCY_REFRESH_INTERVAL:
+            return
+        self.last_recency_refresh = now
+        for seed_id in list(self.young):
+            seed = self.seeds.get(seed_id)
+            if seed is None:
+                self.young.discard(seed_id)
+                continue
+            self.update(seed, now)
+            if now - seed.get("added_at", now) >= RECENCY_HORIZON:
+                self.young.discard(seed_id)
+
+    def sample(self):
+        levels = [prio for prio in PRIORITY_WEIGHTS if self.bins[prio].count and self.bins[prio].tree.total > 0]
+        if not levels:
+            return None
+        prio = self.rng.choices(levels, weights=[PRIORITY_WEIGHTS[p] for p in levels], k=1)[0]
+        return self.bins[prio].sample(self.rng)
+
+
+# --- Mutator Bandit ---
+BANDIT_WINDOW = 5000    # Verdicts per tag over which an arm's evidence decays by 1/e
+
+
+def mutator_arm(name):
+    return f"mutator:{name}"
+
+
+def depth_arm(depth):
+    return f"depth:{depth}"
+
+
+class MutatorBandit:
+    """
+    Thompson sampling over havoc mutators and stack depth, per seed tag.
+
+    Every arm has a Beta(1 + bypasses, 1 + trials - bypasses) posterior on
+    its bypass rate; a verdict credits each mutator of the chain that
+    produced the mutant, and the chain's depth. Each choice draws from the
+    posteriors and takes the best, so budget shifts to operators that evade
+    the rules while rarely used ones keep being explored. The counts are
+    the corpus store's recent_* ones, exponentially decayed over about
+    BANDIT_WINDOW verdicts of the tag, so arms lose their record (good or
+    bad) after the rules change.
+    """
+    def __init__(self, max_depth, rng=None):
+        self.max_depth = max_depth
+        self.rng = rng or random
+        self.stats = {}         # (tag, arm) -> (bypasses, trials)
+
+    def load(self, rows):
+        self.stats = {(row["tag"], row["arm"]): (row["recent_bypasses"], row["recent_trials"]) for row in rows}
+
+    def draw(self, tag, arm):
+        bypasses, trials = self.stats.get((tag, arm), (0, 0))
+        return self.rng.betavariate(1 + bypasses, 1 + max(0, trials - bypasses))
+
+    def choose_depth(self, tag):
+        return max(range(1, self.max_depth + 1), key=lambda depth: self.draw(tag, depth_arm(depth)))
+
+    def choose_mutator(self, tag, mutators):
+        return max(mutators, key=lambda m: self.draw(tag, mutator_arm(m.__class__.__name__)))
+
+    def summary(self, tag):
+        """
+        (arm, bypasses, trials) for a tag, best observed rate first.
+        """
+        arms = [(arm, b, t) for (arm_tag, arm), (b, t) in self.stats.items() if arm_tag == tag]
+        return sorted(arms, key=lambda a: (a[1] + 1) / (a[2] + 2), reverse=True)
@@ -0,0 +1,383 @@
+import os
+import re
+import json
+import time
+import ntpath
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from concurrent.futures import ThreadPoolExecutor
+import config
+
+RETRYABLE_STATUSES = (429, 502, 503, 504)
+
+# Correlation IDs are uuid4 strings; one fixed pattern finds them in any text,
+# however many IDs are outstanding.
+UUID_RE = re.compile(r"[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}")
+PATH_SPLIT_RE = re.compile(r"[\\/]+")
+
+
+def iter_strings(value):
+    """
+    Yields every string leaf of a (nested) _source document.
+    """
+    if isinstance(value, str):
+        yield value
+    elif isinstance(value, dict):
+        for item in value.values():
+            yield from iter_strings(item)
+    elif isinstance(value, list):
+        for item in value:
+            yield from iter_strings(item)
+
+
+def get_field(source, dotted):
+    """
+    Reads 'a.b.c' from a _source document, whether it is stored nested or flat.
+    """
+    if dotted in source:
+        return source[dotted]
+    value = source
+    for part in dotted.split("."):
+        if not isinstance(value, dict) or part not in value:
+            return None
+        value = value[part]
+    return value
+
+
+def id_fields():
+    fields = list(config.SIEM_CWD_FIELDS)
+    if config.SIEM_ID_KEYWORD_FIELD:
+        fields.append(config.SIEM_ID_KEYWORD_FIELD)
+    return fields
+
+
+def candidate_ids(source):
+    """
+    Every correlation-ID-shaped token in a hit: path segments of the
+    run-directory fields plus UUID tokens anywhere in the document.
+    """
+    found = set()
+    for field in id_fields():
+        for text in iter_strings(get_field(source, field)):
+            for segment in PATH_SPLIT_RE.split(text):
+                if UUID_RE.fullmatch(segment):
+                    found.add(segment.lower())
+    for text in iter_strings(source):
+        for token in UUID_RE.findall(text):
+            found.add(token.lower())
+    return found
+
+
+def ids_in_hit(source, outstanding):
+    """
+    Matches a hit against the set of outstanding IDs; each candidate token is
+    a set membership test, however many IDs are outstanding.
+    """
+    return {cid for cid in candidate_ids(source) if cid in outstanding}
+
+
+def is_retryable(error):
+    """
+    True for throttling (429), gateway errors and timeouts/connection drops,
+    without depending on a particular client library's exception classes.
+    """
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "meta", None), "status", None)
+    if status in RETRYABLE_STATUSES:
+        return True
+    name = error.__class__.__name__
+    return "Timeout" in name or "ConnectionError" in name
+
+
+def path_variants(cwd):
+    """
+    Exact keyword values a run directory may be logged as (Sysmon appends a separator).
+    """
+    variants = {cwd, cwd.rstrip("\\/") + "\\", cwd.rstrip("\\/") + "/"}
+    drive, rest = ntpath.splitdrive(cwd)
+    if drive:
+        for other in (drive.upper(), drive.lower()):
+            variants.add(other + rest)
+            variants.add(other + rest.rstrip("\\") + "\\")
+    return sorted(variants)
+
+
+class SiemQueryPlanner:
+    """
+    Plans the lookups for one verdict cycle:
+    1. exact 'terms' queries on an extracted ID keyword field, or on the
+       run-directory keyword fields using the cwd recorded by the producer
+       (plus 'prefix' clauses for subdirectories of it);
+    2. optional 'match_phrase' fallback on 'message' for IDs still unmatched.
+    Every query is paged to exhaustion with a point in time + search_after,
+    so noisy rules can no longer truncate the result set. Pages are sent as
+    parallel _msearch batches from a small thread pool.
+    """
+    def __init__(self, client, concurrency=None):
+        self.client = client
+        self.pool = ThreadPoolExecutor(
+            max_workers=concurrency or config.SIEM_QUERY_CONCURRENCY,
+            thread_name_prefix="siem"
+        )
+
+    # --- Query construction ---
+
+    def exact_queries(self, correlation_ids, cwd_by_id):
+        batch_size = config.SIEM_TERMS_BATCH
+        if config.SIEM_ID_KEYWORD_FIELD:
+            for i in range(0, len(correlation_ids), batch_size):
+                yield {"terms": {config.SIEM_ID_KEYWORD_FIELD: correlation_ids[i:i + batch_size]}}
+            return
+
+        # The run directory itself (exact terms) or a subdirectory the command cd'ed into
+        # (prefix on the directory with its separator)
+        cwds = [cwd_by_id[cid] for cid in correlation_ids if cwd_by_id.get(cid)]
+        batch_size = config.SIEM_PREFIX_BATCH
+        for i in range(0, len(cwds), batch_size):
+            values = [value for cwd in cwds[i:i + batch_size] for value in path_variants(cwd)]
+            prefixes = [value for value in values if value.endswith(("\\", "/"))]
+            should = [{"terms": {field: values}} for field in config.SIEM_CWD_FIELDS]
+            should += [{"prefix": {field: prefix}} for field in config.SIEM_CWD_FIELDS for prefix in prefixes]
+            yield {"bool": {"should": should, "minimum_should_match": 1}}
+
+    def phrase_queries(self, correlation_ids):
+        batch_size = config.SIEM_PHRASE_BATCH
+        for i in range(0, len(correlation_ids), batch_size):
+            yield {
+                "bool": {
+                    "should": [{"match_phrase": {"message": cid}} for cid in correlation_ids[i:i + batch_size]],
+                    "minimum_should_match": 1
+                }
+            }
+
+    def source_fields(self):
+        return id_fields() + ["message", config.SIEM_TAIL_FIELD]
+
+    # --- Paging ---
+
+    def open_pit(self):
+        try:
+            response = self.client.open_point_in_time(index=config.SIEM_INDEX, keep_alive=config.SIEM_PIT_KEEP_ALIVE)
+            return response["id"]
+        except Exception as e:
+            print(f"  [~] Point in time unavailable ({e}), paging without it.")
+            return None
+
+    def close_pit(self, pit_id):
+        if pit_id is None:
+            return
+        try:
+            self.client.close_point_in_time(id=pit_id)
+        except Exception:
+            pass
+
+    def page_body(self, query, pit_id, search_after=None):
+        body = {
+            "query": query,
+            "_source": self.source_fields(),
+            "size": config.SIEM_PAGE_SIZE,
+            "track_total_hits": False,
+        }
+        if pit_id is not None:
+            body["pit"] = {"id": pit_id, "keep_alive": config.SIEM_PIT_KEEP_ALIVE}
+            body["sort"] = [{"_shard_doc": "asc"}]
+        else:
+            body["sort"] = [{"@timestamp": "asc"}, {config.SIEM_TIEBREAKER_FIELD: "asc"}]
+        if search_after is not None:
+            body["search_after"] = search_after
+        return body
+
+    def search_with_retry(self, body):
+        for attempt in range(config.SIEM_MAX_RETRIES + 1):
+            try:
+                return self.client.search(index=config.SIEM_INDEX, body=body)
+            except Exception as e:
+                if attempt >= config.SIEM_MAX_RETRIES or not is_retryable(e):
+                    raise
+                time.sleep(config.SIEM_RETRY_BACKOFF * (2 ** attempt))
+
+    # --- Parallel _msearch execution ---
+
+    def send_msearch(self, pages, pit_id):
+        """
+        Sends one _msearch for a list of (query, search_after) pages and returns
+        the per-page responses. Transport-level 429s and timeouts are retried
+        with exponential backoff.
+        """
+        header = {} if pit_id is not None else {"index": config.SIEM_INDEX}
+        searches = []
+        for query, search_after in pages:
+            searches.append(header)
+            searches.append(self.page_body(query, pit_id, search_after))
+
+        for attempt in range(config.SIEM_MAX_RETRIES + 1):
+            try:
+                return self.client.msearch(searches=searches)["responses"]
+            except Exception as e:
+                if attempt >= config.SIEM_MAX_RETRIES or not is_retryable(e):
+                    raise
+                delay = config.SIEM_RETRY_BACKOFF * (2 ** attempt)
+                print(f"  [~] msearch failed ({e.__class__.__name__}), retrying in {delay:.1f}s...")
+                time.sleep(delay)
+
+    def run_queries(self, queries, pit_id, outstanding, detected):
+        """
+        Runs every query to exhaustion. Each round packs the pending pages into
+        _msearch requests of SIEM_MSEARCH_BATCH searches and sends up to
+        SIEM_QUERY_CONCURRENCY of them at once; full pages schedule their
+        next page (search_after) for the following round.
+
+        Failures are raised rather than skipped: a lost batch would otherwise
+        turn every ID in it into a false bypass.
+        """
+        pending = [(query, None) for query in queries]
+        throttled_rounds = 0
+        while pending:
+            chunks = [pending[i:i + config.SIEM_MSEARCH_BATCH] for i in range(0, len(pending), config.SIEM_MSEARCH_BATCH)]
+            futures = [(chunk, self.pool.submit(self.send_msearch, chunk, pit_id)) for chunk in chunks]
+
+            next_pending = []
+            throttled = False
+            for chunk, future in futures:
+                responses = future.result()
+                for (query, search_after), response in zip(chunk, responses):
+                    if "error" in response:
+                        if response.get("status") in RETRYABLE_STATUSES:
+                            # Item-level rejection inside a successful _msearch
+                            next_pending.append((query, search_after))
+                            throttled = True
+                            continue
+                        raise RuntimeError(f"search failed: {response['error']}")
+                    hits = response["hits"]["hits"]
+                    for hit in hits:
+                        source = hit.get("_source", {})
+                        seen_at = alert_time(source)
+                        for cid in ids_in_hit(source, outstanding):
+                            if cid not in detected or (seen_at is not None and (detected[cid] is None or seen_at < detected[cid])):
+                                detected[cid] = seen_at
+                    if len(hits) >= config.SIEM_PAGE_SIZE:
+                        next_pending.append((query, hits[-1]["sort"]))
+
+            if throttled:
+                throttled_rounds += 1
+                if throttled_rounds > config.SIEM_MAX_RETRIES:
+                    raise RuntimeError("searches still rejected after retries")
+                time.sleep(config.SIEM_RETRY_BACKOFF * (2 ** (throttled_rounds - 1)))
+            else:
+                throttled_rounds = 0
+            pending = next_pending
+
+    # --- Planner entry point ---
+
+    def find_detected(self, correlation_ids, cwd_by_id=None):
+        """
+        Returns {cid: epoch time of its earliest alert (or None)} for every
+        detected ID.
+        """
+        cwd_by_id = cwd_by_id or {}
+        outstanding = set(correlation_ids)
+        detected = {}
+
+        pit_id = self.open_pit()
+        try:
+            self.run_queries(list(self.exact_queries(correlation_ids, cwd_by_id)), pit_id, outstanding, detected)
+
+            if config.SIEM_MESSAGE_FALLBACK:
+                remaining = [cid for cid in correlation_ids if cid not in detected]
+                if remaining:
+                    self.run_queries(list(self.phrase_queries(remaining)), pit_id, outstanding, detected)
+        finally:
+            self.close_pit(pit_id)
+        return detected
+
+
+def parse_timestamp(value):
+    try:
+        return datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    except ValueError:
+        return None
+
+
+def alert_time(source):
+    """
+    Epoch seconds at which an alert was written (SIEM_TAIL_FIELD), or None.
+    """
+    stamp = parse_timestamp(get_field(source, config.SIEM_TAIL_FIELD))
+    return stamp.timestamp() if stamp is not None else None
+
+
+class AlertTailer:
+    """
+    Follows the alerts index by SIEM_TAIL_FIELD instead of querying per ID.
+    Each poll asks for everything at or after (watermark - overlap), so
+    alerts indexed slightly out of order are not missed; hits already seen
+    inside the overlap window are dropped. The watermark is checkpointed to
+    disk so a restart resumes where it left off.
+    """
+    def __init__(self, planner, checkpoint_path):
+        self.planner = planner
+        self.checkpoint_path = checkpoint_path
+        self.watermark = None
+        self.seen = OrderedDict()   # hit _id -> tail timestamp
+        try:
+            with open(checkpoint_path, "r", encoding="utf-8") as f:
+                self.watermark = parse_timestamp(json.load(f).get("watermark"))
+        except (FileNotFoundError, ValueError):
+            pass
+
+    def save_checkpoint(self):
+        if self.watermark is None:
+            return
+        tmp_path = self.checkpoint_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"watermark": self.watermark.isoformat().replace("+00:00", "Z")}, f)
+        os.replace(tmp_path, self.checkpoint_path)
+
+    def poll(self):
+        """
+        Returns the _source of every alert not returned by an earlier poll.
+        """
+        overlap = timedelta(seconds=config.SIEM_TAIL_OVERLAP)
+        if self.watermark is None:
+            lower = datetime.now(timezone.utc) - timedelta(seconds=config.SIEM_TAIL_LOOKBACK)
+        else:
+            lower = self.watermark - overlap
+        filters = [{"range": {config.SIEM_TAIL_FIELD: {"gte": lower.isoformat().replace("+00:00", "Z")}}}]
+        if config.SIEM_TAIL_FILTER:
+            filters.append(config.SIEM_TAIL_FILTER)
+
+        new_sources = []
+        search_after = None
+        while True:
+            body = {
+                "query": {"bool": {"filter": filters}},
+                "_source": self.planner.source_fields(),
+                "size": config.SIEM_PAGE_SIZE,
+                "sort": [{config.SIEM_TAIL_FIELD: "asc"}, {config.SIEM_TIEBREAKER_FIELD: "asc"}],
+                "track_total_hits": False,
+            }
+            if search_after is not None:
+                body["search_after"] = search_after
+            hits = self.planner.search_with_retry(body)["hits"]["hits"]
+            for hit in hits:
+                source = hit.get("_source", {})
+                stamp = parse_timestamp(get_field(source, config.SIEM_TAIL_FIELD))
+                if hit["_id"] in self.seen:
+                    continue
+                self.seen[hit["_id"]] = stamp
+                new_sources.append(source)
+                if stamp is not None and (self.watermark is None or stamp > self.watermark):
+                    self.watermark = stamp
+            if len(hits) < config.SIEM_PAGE_SIZE:
+                break
+            search_after = hits[-1]["sort"]
+
+        # Only hits inside the overlap window can be returned again
+        if self.watermark is not None:
+            horizon = self.watermark - overlap
+            for hit_id in list(self.seen):
+                stamp = self.seen[hit_id]
+                if stamp is None or stamp < horizon:
+                    del self.seen[hit_id]
+        return new_sources
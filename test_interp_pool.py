@@ -0,0 +1,59 @@
+import os
+import unittest
+import tempfile
+
+from interp_pool import Interpreter, InterpreterWorker, INTERPRETERS, frame_cmd, sh_quote
+
+PAREN_COMMANDS = [
+    'echo a) & echo b',
+    'echo (a & echo b',
+    '(echo a) & (echo b)',
+    'echo ^(a^) ) ) (',
+]
+
+
+def frame_sh_script(script, cwd, token):
+    # Stand-in for frame_cmd where cmd.exe is not available: same shape, the command runs from the script
+    return (f"(cd {sh_quote(cwd)} && . {sh_quote(script)}) </dev/null\n"
+            f"printf '\\n{token} %d\\n' $?; printf '\\n{token}\\n' >&2\n")
+
+
+class FrameCmdTest(unittest.TestCase):
+    def test_command_text_stays_out_of_the_frame(self):
+        for command in PAREN_COMMANDS:
+            frame = frame_cmd("C:\\temp\\pf.cmd", "C:\\work dir", "TOKEN")
+            lines = frame.split("\r\n")
+            self.assertEqual(lines[0], 'cd /d "C:\\work dir" & call "C:\\temp\\pf.cmd" <nul')
+            self.assertNotIn(command, frame)
+
+    def test_cmd_workers_use_a_script(self):
+        self.assertEqual(INTERPRETERS["cmd"].script_suffix, ".cmd")
+
+
+@unittest.skipIf(os.name == "nt", "needs /bin/sh")
+class ScriptWorkerTest(unittest.TestCase):
+    def setUp(self):
+        self.worker = InterpreterWorker(Interpreter("stub", ["/bin/sh"], frame_sh_script, script_suffix=".sh"))
+        self.cwd = tempfile.mkdtemp()
+
+    def tearDown(self):
+        self.worker.close()
+        os.rmdir(self.cwd)
+
+    def test_unbalanced_parens_do_not_break_the_worker(self):
+        for command in ["echo 'a)'; echo b", "echo a )", "echo ( b", "(echo a) && (echo b)"]:
+            self.worker.run(command, self.cwd, timeout=5)
+        result = self.worker.run("echo '(still) alive'", self.cwd, timeout=5)
+        self.assertFalse(result.timed_out)
+        self.assertEqual(result.stdout, "(still) alive\n")
+        self.assertEqual(result.returncode, 0)
+        self.assertTrue(os.path.exists(self.worker.script))
+
+    def test_script_is_removed_on_close(self):
+        self.worker.run("true", self.cwd, timeout=5)
+        self.worker.close()
+        self.assertFalse(os.path.exists(self.worker.script))
+
+
+if __name__ == "__main__":
+    unittest.main()
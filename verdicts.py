@@ -0,0 +1,211 @@
+import os
+import json
+import time
+import bisect
+from collections import deque, OrderedDict, Counter
+import config
+
+# --- Verdict Defaults ---
+UNCLAIMED_TTL = 600     # Seconds an alert for a not-yet-read ID is remembered
+
+
+class OutstandingIndex:
+    """
+    In-memory index of correlation IDs read from the queue log that have no
+    verdict yet. It also tracks the queue offset that can safely be
+    committed: the offset after the longest prefix of resolved records.
+    """
+    def __init__(self, unclaimed_ttl=UNCLAIMED_TTL):
+        self.entries = OrderedDict()   # cid -> {"data": ..., "added": ts}
+        self.read_order = deque()      # (cid, offset after record), in log order
+        self.read_count = Counter()    # occurrences of each cid in read_order
+        self.resolved = set()
+        self.unclaimed = OrderedDict() # cid -> time an alert for it was seen
+        self.unclaimed_ttl = unclaimed_ttl
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, cid):
+        return cid in self.entries
+
+    def add(self, cid, data, offset, added=None):
+        """
+        Registers a queue record. Returns True if an alert for it was already
+        seen before the record was read (the producer enqueues after the run,
+        so a fast alert can win the race).
+        """
+        self.read_order.append((cid, offset))
+        self.read_count[cid] += 1
+        if cid in self.entries or cid in self.resolved:
+            # Duplicate record; it is acknowledged together with the first one
+            return False
+        self.entries[cid] = {"data": data, "added": added if added is not None else time.time(), "checks": 0}
+        return self.unclaimed.pop(cid, None) is not None
+
+    def skip(self, offset):
+        """
+        Registers a record that needs no verdict (e.g. malformed) so it does
+        not hold back the committed offset.
+        """
+        marker = ("skip", offset)
+        self.read_order.append((marker, offset))
+        self.read_count[marker] += 1
+        self.resolved.add(marker)
+
+    def resolve(self, cid):
+        entry = self.entries.pop(cid, None)
+        if entry is not None:
+            self.resolved.add(cid)
+        return entry
+
+    def remember_unclaimed(self, cid, now=None):
+        self.unclaimed[cid] = now if now is not None else time.time()
+        self.unclaimed.move_to_end(cid)
+
+    def expire_unclaimed(self, now=None):
+        now = now if now is not None else time.time()
+        while self.unclaimed:
+            cid, seen = next(iter(self.unclaimed.items()))
+            if now - seen < self.unclaimed_ttl:
+                break
+            self.unclaimed.popitem(last=False)
+
+    def older_than(self, age, now=None):
+        """
+        IDs that have been outstanding for at least 'age' seconds (oldest first).
+        """
+        now = now if now is not None else time.time()
+        expired = []
+        for cid, entry in self.entries.items():
+            if now - entry["added"] < age:
+                break
+            expired.append(cid)
+        return expired
+
+    def committable_offset(self):
+        """
+        Pops the resolved prefix of the read order and returns the queue offset
+        after it, or None if nothing new can be acknowledged.
+        """
+        offset = None
+        while self.read_order and self.read_order[0][0] in self.resolved:
+            cid, offset = self.read_order.popleft()
+            self.read_count[cid] -= 1
+            if self.read_count[cid] <= 0:
+                del self.read_count[cid]
+                self.resolved.discard(cid)
+        return offset
+
+    def items(self):
+        return self.entries.items()
+
+
+# Upper bounds (seconds) of the latency histogram buckets; the last bucket is open
+LATENCY_BUCKETS = [1, 2, 3, 5, 7, 10, 15, 20, 30, 45, 60, 90, 120, 180, 240, 300,
+                   450, 600, 900, 1200, 1800, 2700, 3600]
+
+
+class LatencyHistogram:
+    """
+    Measured delay between executing a command and its alert becoming visible,
+    in fixed log-spaced buckets. Persisted so the estimate survives restarts.
+    """
+    def __init__(self, counts=None):
+        self.counts = counts or [0] * (len(LATENCY_BUCKETS) + 1)
+
+    @classmethod
+    def load(cls, path):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("buckets") == LATENCY_BUCKETS:
+                return cls(data["counts"])
+        except (FileNotFoundError, ValueError, KeyError):
+            pass
+        return cls()
+
+    def save(self, path):
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"buckets": LATENCY_BUCKETS, "counts": self.counts}, f)
+        os.replace(tmp_path, path)
+
+    @property
+    def total(self):
+        return sum(self.counts)
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(LATENCY_BUCKETS, max(0.0, seconds))] += 1
+
+    def quantile(self, q):
+        """
+        Upper bound of the bucket holding the q-quantile (None if empty or in the open bucket).
+        """
+        total = self.total
+        if not total:
+            return None
+        rank = q * total
+        running = 0
+        for i, count in enumerate(self.counts):
+            running += count
+            if running >= rank:
+                return LATENCY_BUCKETS[i] if i < len(LATENCY_BUCKETS) else None
+        return None
+
+    def summary(self):
+        parts = []
+        for q in (0.5, 0.9, 0.99):
+            value = self.quantile(q)
+            parts.append(f"p{int(q * 100)}<={value}s" if value is not None else f"p{int(q * 100)}=>{LATENCY_BUCKETS[-1]}s")
+        return f"{self.total} samples, " + ", ".join(parts)
+
+
+class VerdictPolicy:
+    """
+    Decides when a pending ID is re-checked and when "no alert" becomes final.
+
+    Re-checks follow VERDICT_RECHECK_SCHEDULE (seconds after execution). The
+    final deadline is VERDICT_DEADLINE until VERDICT_MIN_SAMPLES detections
+    have been measured; after that (with VERDICT_AUTO_DEADLINE) it is the
+    VERDICT_LATENCY_QUANTILE of the measured ingestion latency times
+    VERDICT_SAFETY_FACTOR, clamped to [VERDICT_MIN_DEADLINE, VERDICT_MAX_DEADLINE].
+    """
+    def __init__(self, histogram_path):
+        self.histogram_path = histogram_path
+        self.histogram = LatencyHistogram.load(histogram_path)
+        self.dirty = False
+
+    def deadline(self):
+        if config.VERDICT_AUTO_DEADLINE and self.histogram.total >= config.VERDICT_MIN_SAMPLES:
+            upper = self.histogram.quantile(config.VERDICT_LATENCY_QUANTILE)
+            if upper is None:
+                return config.VERDICT_MAX_DEADLINE
+            return min(config.VERDICT_MAX_DEADLINE,
+                       max(config.VERDICT_MIN_DEADLINE, upper * config.VERDICT_SAFETY_FACTOR))
+        return config.VERDICT_DEADLINE
+
+    def observe(self, latency):
+        self.histogram.observe(latency)
+        self.dirty = True
+
+    def is_due(self, entry, now, deadline):
+        """
+        True if the entry passed its next re-check point or the final deadline.
+        """
+        age = now - entry["added"]
+        if age >= deadline:
+            return True
+        schedule = config.VERDICT_RECHECK_SCHEDULE
+        return entry["checks"] < len(schedule) and age >= schedule[entry["checks"]]
+
+    def mark_checked(self, entry, now):
+        age = now - entry["added"]
+        schedule = config.VERDICT_RECHECK_SCHEDULE
+        while entry["checks"] < len(schedule) and schedule[entry["checks"]] <= age:
+            entry["checks"] += 1
+
+    def save(self):
+        if self.dirty:
+            self.histogram.save(self.histogram_path)
+            self.dirty = False
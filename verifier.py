@@ -0,0 +1,137 @@
+"""
+Execute-and-verify path for tools that need a verdict for specific commands
+right away (minimize.py, replay.py) rather than through the producer queue
+and the consumer.
+
+Commands run like the producer runs them: through an ExecutionEngine, each
+in its own correlation directory. Verdicts come from the SIEM, looked up the
+way the consumer does (SiemQueryPlanner; "not detected" only at the verdict
+deadline), or, with a local oracle, from the local rules at once. Every run
+is also appended to VERIFY_LOG_DIR, in the queue log format, as an audit
+trail of what was executed.
+"""
+import os
+import time
+import uuid
+
+import config
+from executor import WorkdirPool, run_details
+from queue_log import QueueLogWriter
+from siem_query import SiemQueryPlanner
+from verdicts import VerdictPolicy
+
+# --- Verifier Defaults ---
+TEMP_WORKDIR = "temp_workdirs"
+VERIFY_LOG_DIR = "verify_log"
+LATENCY_FILE = "ingestion_latency.json"   # Written by the consumer; only read here
+
+
+def connect_siem():
+    """
+    Elasticsearch client for the config.SIEM_* settings. Raises if the
+    cluster does not answer a ping.
+    """
+    # Only needed for SIEM verdicts, so local-oracle runs work without the client installed
+    import urllib3
+    from elasticsearch import Elasticsearch
+    urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+
+    auth_creds = None
+    if config.SIEM_USER and config.SIEM_PASS:
+        auth_creds = (config.SIEM_USER, config.SIEM_PASS)
+    scheme = "https" if config.SIEM_USE_SSL else "http"
+
+    client = Elasticsearch(
+        hosts=[{'host': config.SIEM_HOST, 'port': config.SIEM_PORT, 'scheme': scheme}],
+        basic_auth=auth_creds,
+        verify_certs=config.SIEM_VERIFY_CERTS,
+        ssl_show_warn=False,
+        connections_per_node=config.SIEM_CONNECTIONS_PER_NODE,
+        request_timeout=config.SIEM_REQUEST_TIMEOUT,
+        max_retries=0  # Retries with backoff are done by SiemQueryPlanner
+    )
+    if not client.ping():
+        raise ConnectionError("Ping failed")
+    return client
+
+
+class Verifier:
+    """
+    verify(commands, tags) executes the commands in parallel and returns one
+    run dict per command: id, cmd, tags, cwd, ts, success, detected (and
+    'rules' with a local oracle), plus executor.run_details(). verify_items() does the same for
+    (command, tags) pairs with tags of their own.
+    """
+    def __init__(self, engine, siem_client=None, oracle=None, log_dir=VERIFY_LOG_DIR):
+        if (siem_client is None) == (oracle is None):
+            raise ValueError("Verifier needs either a SIEM client or a local oracle")
+        self.engine = engine
+        self.oracle = oracle
+        self.planner = SiemQueryPlanner(siem_client) if siem_client is not None else None
+        self.policy = VerdictPolicy(LATENCY_FILE)
+        self.log = QueueLogWriter(log_dir)
+        self.workdirs = WorkdirPool(TEMP_WORKDIR, spares=engine.workers)
+
+    def run_one(self, command_string, tags):
+        correlation_id = str(uuid.uuid4())
+        run = {"id": correlation_id, "cmd": command_string, "tags": tags,
+               "cwd": os.path.join(self.workdirs.root, correlation_id), "ts": time.time(), "success": False}
+        try:
+            self.workdirs.acquire(correlation_id)
+        except Exception as e:
+            print(f"[ERROR] Could not create temp dir: {e}")
+            return run
+        result = self.engine.run(command_string, cwd=run["cwd"], tag=tags[0] if tags else "generic")
+        self.workdirs.release(run["cwd"])
+        run["success"] = result.success
+        run.update(run_details(result))
+        return run
+
+    def execute(self, items):
+        futures = [self.engine.submit(self.run_one, command_string, tags) for command_string, tags in items]
+        runs = [future.result() for future in futures]
+        self.log.append_many(runs)
+        return runs
+
+    def wait_for_siem(self, runs):
+        """
+        Queries at the re-check points after the last execution until every
+        run is detected or the verdict deadline passed.
+        """
+        deadline = self.policy.deadline()
+        started = max(run["ts"] for run in runs)
+        outstanding = {run["id"]: run for run in runs}
+        checkpoints = sorted({age for age in config.VERDICT_RECHECK_SCHEDULE if age < deadline} | {deadline})
+        for age in checkpoints:
+            time.sleep(max(0.0, started + age - time.time()))
+            try:
+                detected = self.planner.find_detected(list(outstanding),
+                                                      {cid: run["cwd"] for cid, run in outstanding.items()})
+            except Exception as e:
+                if age == deadline:
+                    raise
+                print(f"  [!] SIEM query failed, retrying at the next check: {e}")
+                continue
+            for cid in detected:
+                outstanding.pop(cid)["detected"] = True
+            if not outstanding:
+                break
+        for run in outstanding.values():
+            run["detected"] = False
+
+    def verify(self, commands, tags):
+        return self.verify_items([(command_string, tags) for command_string in commands])
+
+    def verify_items(self, items):
+        runs = self.execute(items)
+        if self.oracle is not None:
+            for run in runs:
+                run["rules"] = self.oracle.predict(run["cmd"], run["tags"])
+                run["detected"] = bool(run["rules"])
+        elif runs:
+            self.wait_for_siem(runs)
+        return runs
+
+    def close(self):
+        self.log.close()
+        self.workdirs.close()